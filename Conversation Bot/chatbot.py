@@ -0,0 +1,82 @@
+from langchain import OpenAI, PromptTemplate
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.schema import BaseLanguageModel
+
+from common.streaming import StreamStats, TokenSink
+from token_budget_memory import TokenBudgetMemory
+
+# Pieces of the Conversation Bot shared by the terminal app (conversation-bot.py) and the multi-session server
+# (conversation-server.py)
+
+prompt_template = """You are a helpful conversation Assistant.You are here to help 
+keep the human entertained and provide with engaging responses. You will be friendly, respectful,
+and use your profound knowledge to help the human.  
+
+You will provide accurate responses. You do not have knowledge about current events. You should not
+hallucinate and generate your own responses. In case, you are not sure about something or unable to provide 
+an accurate response, you will politely say you are unable to help and ask the human on what else you can help with. 
+
+{history}
+
+Human: {human_input}
+Assistant:"""
+
+
+# Forward streamed LLM tokens to a sink and time the first token
+class SinkCallbackHandler(AsyncCallbackHandler):
+    def __init__(self, sink: TokenSink = None):
+        self.sink = sink
+        self.stats = StreamStats()
+        self.visible = False
+
+    @property
+    def always_verbose(self) -> bool:
+        return True
+
+    async def on_llm_start(self, serialized, prompts, **kwargs):
+        self.stats = StreamStats()
+        self.visible = False
+
+    async def on_llm_new_token(self, token, **kwargs):
+        self.stats.on_token()
+        if not self.visible:
+            # Completions usually start with blank lines, keep them off the screen
+            token = token.lstrip()
+            self.visible = bool(token)
+        if token and self.sink is not None:
+            self.sink.write(token)
+
+    async def on_llm_end(self, response, **kwargs):
+        self.stats.finish()
+        if self.sink is not None:
+            self.sink.close()
+
+    async def on_llm_error(self, error, **kwargs):
+        self.stats.finish()
+
+
+# Call OpenAI API to generate a response
+async def generate_response(chatgpt_chain, user_input):
+    response = await chatgpt_chain.arun(human_input=user_input)
+    return response
+
+
+# Initialize the prompt
+def create_prompt():
+    return PromptTemplate(
+        input_variables=["history", "human_input"],
+        template=prompt_template
+    )
+
+
+# Initialize the memory. It keeps the history under a token budget by folding the oldest turns into a rolling
+# summary, written by a separate non-streaming LLM
+def create_memory(history_token_limit=1000, summary_llm: BaseLanguageModel = None):
+    summary_token_limit = history_token_limit // 4
+    if summary_llm is None:
+        summary_llm = OpenAI(temperature=0, max_tokens=summary_token_limit)
+    # The history is rendered as text into {history}, the way the memory counts it against the budget
+    return TokenBudgetMemory(llm=summary_llm,
+                             max_token_limit=history_token_limit,
+                             summary_token_limit=summary_token_limit,
+                             ai_prefix="Assistant")
@@ -2,114 +2,206 @@ import os
 import configparser
 import asyncio
 import sys
-from langchain import OpenAI, LLMChain, PromptTemplate
-from langchain.memory import ConversationBufferMemory
-from langchain.schema import HumanMessage, AIMessage
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import (METRICS, add_langchain_handler, configure_metrics_from_config, finish_metrics,
+                                    record_error, timed)
+from common.resilience import resilient_client_from_config, use_resilient_client
+from common.startup import Deferred, connect_daemon, serve_daemon
+from common.streaming import StdoutSink
+from transcript import TranscriptWriter, restore_memory, rotate_transcript
 
 # Load API key from config file
 config = configparser.ConfigParser()
 config.read('config.ini')
 os.environ["OPENAI_API_KEY"] = config.get('API_KEYS', 'OPENAI-API_KEY')
-
-prompt_template = """You are a helpful conversation Assistant.You are here to help 
-keep the human entertained and provide with engaging responses. You will be friendly, respectful,
-and use your profound knowledge to help the human.  
-
-You will provide accurate responses. You do not have knowledge about current events. You should not
-hallucinate and generate your own responses. In case, you are not sure about something or unable to provide 
-an accurate response, you will politely say you are unable to help and ask the human on what else you can help with. 
-
-{history}
-
-Human: {human_input}
-Assistant:"""
-
-
-# Call OpenAI API to generate a response
-async def generate_response(chatgpt_chain, user_input):
-    response = await chatgpt_chain.arun(human_input=user_input)
-    return response
-
-
-# Process user input and display response or error message
-async def process_input(chatgpt_chain, user_input):
+stream_responses = config.getboolean('SETTINGS', 'STREAM', fallback=False)
+history_token_limit = config.getint('SETTINGS', 'HISTORY_TOKEN_LIMIT', fallback=1000)
+transcript_file = config.get('SETTINGS', 'TRANSCRIPT_FILE', fallback='human_assistant_messages.txt')
+transcript_fsync_every = config.getint('SETTINGS', 'TRANSCRIPT_FSYNC_EVERY', fallback=0)
+daemon_socket = config.get('SETTINGS', 'DAEMON_SOCKET', fallback='conversation-bot.sock')
+# Stage timings and token counts, off unless METRICS is set
+metrics = configure_metrics_from_config(config)
+# Retries, circuit breaker, deadline and hedging of the requests to OpenAI, shared by every chain of the process
+resilient = resilient_client_from_config(config)
+
+
+# Process user input and display response or error message. The chain is called like chatbot.generate_response()
+# does, without importing it, since a RemoteChain does not need LangChain
+async def process_input(chatgpt_chain, user_input, transcript=None):
     sys.stdout.write(".....waiting for magic.....")
     sys.stdout.flush()
     try:
-        response = await generate_response(chatgpt_chain, user_input)
-        sys.stdout.write("\r" + " " * len(".....waiting for magic.....") + "\r")
-        sys.stdout.flush()
-        print(response, "\n")
+        handler = streaming_handler(chatgpt_chain)
+        if handler is not None:
+            # The handler prints the tokens as they arrive, only the timings are left to show
+            handler.sink = StdoutSink(erase=len(".....waiting for magic....."))
+            with timed("request"):
+                response = await chatgpt_chain.arun(human_input=user_input)
+            print(f"\033[90m({handler.stats})\033[0m\n")
+        else:
+            with timed("request"):
+                response = await chatgpt_chain.arun(human_input=user_input)
+            sys.stdout.write("\r" + " " * len(".....waiting for magic.....") + "\r")
+            sys.stdout.flush()
+            print(response, "\n")
+        # Save the turn right away so nothing is lost if the app stops
+        if transcript is not None:
+            transcript.append_turn(user_input, response.strip())
+        # The summary of evicted turns is written in the background; have it ready before the next turn
+        wait_for_summary = getattr(getattr(chatgpt_chain, 'memory', None), 'wait_for_summary', None)
+        if wait_for_summary is not None:
+            await wait_for_summary()
         return None
     except Exception as e:
+        record_error(e)
         sys.stdout.write("\r" + " " * len(".....waiting for magic.....") + "\r")
         sys.stdout.flush()
-        error_message = "AI Assistant encountered an error. Please try again later."
+        # An open circuit breaker, or a rate limit still hit after the retries, says when to come back
+        if getattr(e, 'retry_after', None) is not None:
+            error_message = f"AI Assistant is unavailable right now. Please try again in {e.retry_after:.0f} seconds."
+        else:
+            error_message = f"AI Assistant encountered an error ({type(e).__name__}). Please try again later."
         print(error_message)
         return error_message
 
 
+# Return the streaming callback handler of the chain's LLM, or None when streaming is off
+def streaming_handler(chatgpt_chain):
+    if not getattr(chatgpt_chain.llm, 'streaming', False):
+        return None
+    from chatbot import SinkCallbackHandler
+    for handler in chatgpt_chain.llm.callback_manager.handlers:
+        if isinstance(handler, SinkCallbackHandler):
+            return handler
+    return None
+
+
 # Run async function synchronously
 def run_async(coroutine_object):
     return asyncio.get_event_loop().run_until_complete(coroutine_object)
 
 
-# Export the chat history into a text file
-def export_chat_history(memory, filename):
-    formatted_history = ""
-    for message in memory['history']:
-        if isinstance(message, HumanMessage):
-            formatted_history += f"Human: {message.content}\n"
-        elif isinstance(message, AIMessage):
-            formatted_history += f"Assistant: {message.content}\n\n"
-
-    # Create a new file to store the conversation history
-    file_path = os.path.join(os.getcwd(), filename)
-    with open(file_path, 'w') as f:
-        f.write(formatted_history)
-    print("Conversation history exported successfully to human_assistant_messages.txt!")
-
-
-# Get user input and process it
-def get_user_input(chatgpt_chain):
+# Get user input and process it. A failed message is reported and the conversation goes on, so it can be sent again
+def get_user_input(chatgpt_chain, transcript=None):
     while True:
         user_input = input(f"\nYour message: ")
         if user_input.lower() == 'exit':
-            export_input = input(f"\nNice talking to you. Do you want to export our conversation? (Y/N): ")
-            if export_input.lower() == 'y':
-                # Access the memory
-                memory = chatgpt_chain.memory.load_memory_variables({})
-                # Save chat history in memory
-                export_chat_history(memory, "human_assistant_messages.txt")
+            if transcript is not None:
+                print(f"\nNice talking to you. Our conversation is saved in {transcript.path}.")
             break
         else:
-            error_message = run_async(process_input(chatgpt_chain, user_input))
-            if error_message is not None:
-                break
+            run_async(process_input(chatgpt_chain, user_input, transcript))
 
 
 # Initialize the prompt and llm chain
-def initialize_chatbot():
-    # Initialize the prompt
-    prompt = PromptTemplate(
-        input_variables=["history", "human_input"],
-        template=prompt_template
-    )
+def initialize_chatbot(streaming=False, history_token_limit=1000):
+    # LangChain takes seconds to import, so it is only imported here, while the user types the first message
+    from langchain import OpenAI, LLMChain
+    from langchain.callbacks.base import AsyncCallbackManager
+    from chatbot import SinkCallbackHandler, create_memory, create_prompt
 
-    # Initialize the LLM Chain and memory
+    # Initialize the prompt
+    prompt = create_prompt()
+
+    # Initialize the LLM, streaming tokens through an async callback handler when asked to
+    if streaming:
+        llm = OpenAI(temperature=0, max_tokens=100, streaming=True,
+                     callback_manager=AsyncCallbackManager([SinkCallbackHandler()]))
+    else:
+        llm = OpenAI(temperature=0, max_tokens=100)
+    if METRICS.enabled:
+        # A streaming LLM has a callback manager of its own
+        add_langchain_handler(llm.callback_manager)
+
+    # Initialize the LLM Chain and memory. The requests of the LLM and of the memory's summaries are retried and
+    # hedged by the resilient client
     chatgpt_chain = LLMChain(
-        llm=OpenAI(temperature=0, max_tokens=100),
+        llm=use_resilient_client(llm, resilient),
         prompt=prompt,
-        memory=ConversationBufferMemory(return_messages=True)
+        memory=create_memory(history_token_limit)
     )
+    use_resilient_client(chatgpt_chain.memory.llm, resilient)
     return chatgpt_chain
 
 
-# Main function to start the app
+# Offer to resume the previous conversation, then open the transcript every turn is appended to. A previous
+# conversation that is not resumed is kept under another name
+def open_transcript(chatgpt_chain, filename):
+    file_path = os.path.join(os.getcwd(), filename)
+    if os.path.exists(file_path) and os.path.getsize(file_path) > 0:
+        resume_input = input(f"\nDo you want to continue our previous conversation? (Y/N): ")
+        if resume_input.lower() == 'y':
+            if isinstance(chatgpt_chain, RemoteChain):
+                turns = chatgpt_chain.restore(file_path)
+            else:
+                turns = restore_memory(chatgpt_chain.memory, file_path)
+            print(f"Restored {turns} turns from {filename}.")
+        else:
+            rotated = rotate_transcript(file_path)
+            print(f"The previous conversation is kept in {os.path.basename(rotated)}.")
+    return TranscriptWriter(file_path, fsync_every=transcript_fsync_every)
+
+
+# Stands in for the LLM chain of a daemon started with `python conversation-bot.py serve`. The daemon answers the
+# messages with a memory of its own for this connection; its responses are not streamed
+class RemoteChain:
+    llm = None
+
+    def __init__(self, client):
+        self.client = client
+
+    async def arun(self, human_input):
+        return self.client.request(message=human_input)["response"]
+
+    def restore(self, path):
+        return self.client.request(restore=path)["turns"]
+
+
+# Run as a resident daemon that keeps LangChain loaded and answers the messages of the bots connecting to its socket,
+# every connection with its own conversation memory
+def serve():
+    # Build a first chain now, so LangChain is loaded before a bot connects
+    initialize_chatbot(history_token_limit=history_token_limit)
+
+    def handle(request, state):
+        if 'chain' not in state:
+            state['chain'] = initialize_chatbot(history_token_limit=history_token_limit)
+        chain = state['chain']
+        if 'restore' in request:
+            return {"turns": restore_memory(chain.memory, request['restore'])}
+        with timed("request"):
+            return {"response": chain.run(human_input=request['message'])}
+
+    try:
+        serve_daemon(daemon_socket, handle)
+    finally:
+        finish_metrics(metrics)
+
+
+# Main function to start the app. Run it with the 'serve' argument to start the daemon instead
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+        serve()
+        return
     print(f"\nWelcome to the ChatGPT Chatbot app!")
-    chatgpt_chain = initialize_chatbot()
-    get_user_input(chatgpt_chain)
+    client = connect_daemon(daemon_socket)
+    if client is not None:
+        print(f"Connected to the Conversation Bot daemon on {daemon_socket}")
+        chatgpt_chain = RemoteChain(client)
+    else:
+        # The chain is built in the background, while the user reads the welcome and types the first message
+        chatgpt_chain = Deferred(lambda: initialize_chatbot(streaming=stream_responses,
+                                                            history_token_limit=history_token_limit),
+                                 name="chatbot")
+    transcript = open_transcript(chatgpt_chain, transcript_file)
+    try:
+        get_user_input(chatgpt_chain, transcript)
+    finally:
+        transcript.close()
+        if client is not None:
+            client.close()
+        finish_metrics(metrics)
     print(f"\nExiting the app. Have a great day!\n")
 
 
@@ -0,0 +1,286 @@
+import argparse
+import asyncio
+import configparser
+import os
+import sys
+import time
+from collections import OrderedDict, deque
+
+import aiohttp
+import openai
+from aiohttp import web
+from langchain import OpenAI, LLMChain
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from chatbot import create_memory, create_prompt, generate_response
+from common.resilience import CircuitOpenError, ResilientClient, resilient_client_from_config, use_resilient_client
+
+# Hosts many Conversation Bot sessions from one process. Every session has its own token-budgeted memory, keyed by
+# session id, while the prompt, the LLMs and the HTTP connection pool to the OpenAI API are shared.
+#
+#   POST   /sessions/{session_id}/messages   {"message": "..."} -> {"response": "...", "latency_ms": ...}
+#   GET    /sessions/{session_id}/ws         websocket, one text frame in and one text frame out per turn
+#   DELETE /sessions/{session_id}            forget a session
+#   GET    /stats                            sessions held, memory per session and turn latency percentiles
+
+
+class Session:
+    """
+    One conversation: its LLM chain (with its own memory) and a lock so turns of the same session run in order.
+    """
+
+    def __init__(self, session_id: str, chain: LLMChain):
+        self.session_id = session_id
+        self.chain = chain
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+        self.size = 0
+
+    def estimate_size(self) -> int:
+        """
+        Approximate memory held by the session: the characters of its window and summary.
+        The window is bounded by the token budget, so this is cheap to recompute after every turn.
+        """
+        memory = self.chain.memory
+        return (sum(len(message.content) for message in memory.chat_memory.messages)
+                + len(memory.moving_summary_buffer))
+
+
+class SessionStore:
+    """
+    Sessions in least-recently-used order. Sessions idle for longer than `idle_ttl` seconds are dropped by
+    evict_idle(), and the least recently used ones are dropped whenever `max_sessions` or `max_total_bytes` is
+    exceeded.
+    """
+
+    def __init__(self, llm, summary_llm, history_token_limit=1000, max_sessions=10000,
+                 max_total_bytes=256 * 1024 * 1024, idle_ttl=30 * 60):
+        self.llm = llm
+        self.summary_llm = summary_llm
+        self.history_token_limit = history_token_limit
+        self.max_sessions = max_sessions
+        self.max_total_bytes = max_total_bytes
+        self.idle_ttl = idle_ttl
+        self.prompt = create_prompt()
+        self.sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self.total_bytes = 0
+        self.evicted = 0
+        self.turns = 0
+        self.latencies = deque(maxlen=10000)
+
+    def get(self, session_id: str) -> Session:
+        session = self.sessions.get(session_id)
+        if session is None:
+            chain = LLMChain(llm=self.llm,
+                             prompt=self.prompt,
+                             memory=create_memory(self.history_token_limit, self.summary_llm))
+            session = Session(session_id, chain)
+            self.sessions[session_id] = session
+        else:
+            self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def drop(self, session_id: str) -> bool:
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self.total_bytes -= session.size
+        return True
+
+    def evict_idle(self) -> int:
+        """
+        Drop the sessions that have been idle for longer than the TTL.
+        :return: number of sessions dropped
+        """
+        deadline = time.monotonic() - self.idle_ttl
+        dropped = 0
+        # Sessions are kept in LRU order, so the idle ones are at the front
+        while self.sessions:
+            session = next(iter(self.sessions.values()))
+            if session.last_used > deadline or session.lock.locked():
+                break
+            self.drop(session.session_id)
+            dropped += 1
+        self.evicted += dropped
+        return dropped
+
+    def enforce_limits(self, keep: str):
+        # Drop least recently used sessions, never the one that just answered or one in the middle of a turn
+        for session_id in list(self.sessions):
+            if len(self.sessions) <= self.max_sessions and self.total_bytes <= self.max_total_bytes:
+                break
+            if session_id != keep and not self.sessions[session_id].lock.locked():
+                self.drop(session_id)
+                self.evicted += 1
+
+    async def turn(self, session_id: str, message: str) -> str:
+        """
+        Answer one message of a session.
+        :param session_id: session to continue, created if it does not exist
+        :param message: the human's message
+        :return: the assistant's response
+        """
+        session = self.get(session_id)
+        async with session.lock:
+            started = time.perf_counter()
+            response = await generate_response(session.chain, message)
+            self.latencies.append(time.perf_counter() - started)
+            self.turns += 1
+            # The session may have been dropped, and another one created under its id, during the turn
+            if self.sessions.get(session_id) is session:
+                size = session.estimate_size()
+                self.total_bytes += size - session.size
+                session.size = size
+            session.last_used = time.monotonic()
+        self.enforce_limits(keep=session_id)
+        return response
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(pct):
+            return 1000 * latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))] if latencies else 0.0
+
+        sessions = len(self.sessions)
+        return {
+            "sessions": sessions,
+            "evicted_sessions": self.evicted,
+            "turns": self.turns,
+            "memory_bytes": self.total_bytes,
+            "memory_bytes_per_session": self.total_bytes / sessions if sessions else 0.0,
+            "turn_latency_p50_ms": percentile(50),
+            "turn_latency_p99_ms": percentile(99)
+        }
+
+
+# Make every OpenAI call of a request reuse the app's pooled HTTP session instead of opening a new one
+@web.middleware
+async def shared_http_session(request, handler):
+    openai.aiosession.set(request.app['http_session'])
+    return await handler(request)
+
+
+async def post_message(request):
+    session_id = request.match_info['session_id']
+    try:
+        body = await request.json()
+    except ValueError:
+        return web.json_response({"error": "The body is not valid JSON"}, status=400)
+    message = body.get('message') if isinstance(body, dict) else None
+    if not message:
+        return web.json_response({"error": "'message' is required"}, status=400)
+    started = time.perf_counter()
+    try:
+        response = await request.app['store'].turn(session_id, message)
+    except CircuitOpenError as e:
+        # The OpenAI API keeps failing; tell the client when to come back instead of queueing more turns
+        return web.json_response({"error": f"AI Assistant is unavailable. {e}"}, status=503,
+                                 headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    except Exception as e:
+        return web.json_response({"error": f"AI Assistant encountered an error. Please try again later. {e}"},
+                                 status=502)
+    return web.json_response({
+        "session_id": session_id,
+        "response": response.strip(),
+        "latency_ms": 1000 * (time.perf_counter() - started)
+    })
+
+
+async def websocket(request):
+    session_id = request.match_info['session_id']
+    ws = web.WebSocketResponse()
+    await ws.prepare(request)
+    async for msg in ws:
+        if msg.type != aiohttp.WSMsgType.TEXT:
+            continue
+        try:
+            response = await request.app['store'].turn(session_id, msg.data)
+            await ws.send_str(response.strip())
+        except Exception:
+            await ws.send_str("AI Assistant encountered an error. Please try again later.")
+    return ws
+
+
+async def delete_session(request):
+    dropped = request.app['store'].drop(request.match_info['session_id'])
+    return web.json_response({"deleted": dropped}, status=200 if dropped else 404)
+
+
+async def stats(request):
+    return web.json_response(request.app['store'].stats())
+
+
+# Drop idle sessions periodically
+async def sweep_idle_sessions(store: SessionStore, interval: float):
+    while True:
+        await asyncio.sleep(interval)
+        store.evict_idle()
+
+
+async def on_startup(app):
+    connector = aiohttp.TCPConnector(limit=app['pool_size'], limit_per_host=app['pool_size'],
+                                     keepalive_timeout=30, ttl_dns_cache=300)
+    app['http_session'] = aiohttp.ClientSession(connector=connector)
+    app['sweeper'] = asyncio.create_task(sweep_idle_sessions(app['store'], min(60.0, app['store'].idle_ttl / 2)))
+
+
+async def on_cleanup(app):
+    app['sweeper'].cancel()
+    await app['http_session'].close()
+
+
+def create_app(store: SessionStore, pool_size: int = 100) -> web.Application:
+    """
+    Build the web application around a session store.
+    :param store: sessions to serve
+    :param pool_size: maximum number of pooled connections to the OpenAI API
+    :return: the aiohttp application
+    """
+    app = web.Application(middlewares=[shared_http_session])
+    app['store'] = store
+    app['pool_size'] = pool_size
+    app.router.add_post('/sessions/{session_id}/messages', post_message)
+    app.router.add_get('/sessions/{session_id}/ws', websocket)
+    app.router.add_delete('/sessions/{session_id}', delete_session)
+    app.router.add_get('/stats', stats)
+    app.on_startup.append(on_startup)
+    app.on_cleanup.append(on_cleanup)
+    return app
+
+
+def create_store(history_token_limit=1000, max_sessions=10000, max_memory_mb=256, idle_ttl=30 * 60,
+                 resilient: ResilientClient = None) -> SessionStore:
+    """
+    Create the session store with the LLMs shared by every session. With a ResilientClient, their requests are
+    retried, hedged and cut off by its circuit breaker and deadline.
+    """
+    llm = OpenAI(temperature=0, max_tokens=100)
+    summary_llm = OpenAI(temperature=0, max_tokens=history_token_limit // 4)
+    if resilient is not None:
+        use_resilient_client(llm, resilient)
+        use_resilient_client(summary_llm, resilient)
+    return SessionStore(llm, summary_llm, history_token_limit, max_sessions, max_memory_mb * 1024 * 1024, idle_ttl)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve many Conversation Bot sessions over HTTP and websockets.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max-sessions', type=int, default=10000)
+    parser.add_argument('--max-memory-mb', type=float, default=256, help='cap on the memory held by all sessions')
+    parser.add_argument('--idle-ttl', type=float, default=30 * 60, help='seconds before an idle session is dropped')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    os.environ["OPENAI_API_KEY"] = config.get('API_KEYS', 'OPENAI-API_KEY')
+    history_token_limit = config.getint('SETTINGS', 'HISTORY_TOKEN_LIMIT', fallback=1000)
+
+    store = create_store(history_token_limit, args.max_sessions, args.max_memory_mb, args.idle_ttl,
+                         resilient_client_from_config(config))
+    web.run_app(create_app(store), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+import asyncio
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.chains.llm import LLMChain
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.prompt import SUMMARY_PROMPT
+from langchain.prompts.base import BasePromptTemplate
+from langchain.schema import BaseLanguageModel, BaseMessage, SystemMessage, get_buffer_string
+from pydantic import Field
+
+from common.tokens import get_token_counter
+
+
+class TokenBudgetMemory(BaseChatMemory):
+    """
+    Conversation memory with a hard token budget.
+    The most recent turns are kept word for word in a sliding window. When the window overflows, the oldest
+    messages are evicted down to a low-water mark and folded into a rolling summary, so the summary is only
+    refreshed every few turns and the rendered history never grows past `max_token_limit` tokens.
+    Token counts are computed once per message and kept alongside the window, so saving a turn costs the same no
+    matter how long the session has been running.
+    A turn saved from a running event loop does not block the loop on the summary LLM: the evicted lines are kept
+    verbatim (trimmed to the budget) until a background task replaces them with the LLM's summary (`apredict`).
+    Await `wait_for_summary()` to have the summary in place before the next turn.
+    """
+
+    llm: Optional[BaseLanguageModel] = None
+    """LLM used to update the summary. Without one, evicted lines are kept verbatim and trimmed to fit."""
+    summary_prompt: BasePromptTemplate = SUMMARY_PROMPT
+    max_token_limit: int = 1000
+    """Token budget of the whole history: summary plus window."""
+    summary_token_limit: int = 250
+    """Part of the budget reserved for the summary."""
+    low_water_ratio: float = 0.5
+    """On overflow, the window is emptied down to this fraction of its budget."""
+    human_prefix: str = "Human"
+    ai_prefix: str = "AI"
+    memory_key: str = "history"
+    moving_summary_buffer: str = ""
+    token_counter: Callable[[str], int] = Field(default_factory=get_token_counter)
+    message_tokens: List[int] = Field(default_factory=list)
+    window_tokens: int = 0
+    summary_tokens: int = 0
+    summary_version: int = 0
+    summary_task: Optional[Any] = None
+
+    @property
+    def window_token_limit(self) -> int:
+        return self.max_token_limit - self.summary_token_limit
+
+    @property
+    def memory_variables(self) -> List[str]:
+        """
+        :meta private:
+        """
+        return [self.memory_key]
+
+    @property
+    def buffer(self) -> List[BaseMessage]:
+        messages = list(self.chat_memory.messages)
+        if self.moving_summary_buffer:
+            messages.insert(0, SystemMessage(content=self.moving_summary_buffer))
+        return messages
+
+    @property
+    def history_tokens(self) -> int:
+        """
+        Tokens of the rendered history, summary included.
+        """
+        return self.summary_tokens + self.window_tokens
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        """Return the summary followed by the window of recent messages."""
+        if self.return_messages:
+            return {self.memory_key: self.buffer}
+        return {self.memory_key: get_buffer_string(self.buffer,
+                                                   human_prefix=self.human_prefix,
+                                                   ai_prefix=self.ai_prefix)}
+
+    def _count_message(self, message: BaseMessage) -> int:
+        return self.token_counter(get_buffer_string([message],
+                                                    human_prefix=self.human_prefix,
+                                                    ai_prefix=self.ai_prefix))
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        """Save the turn and evict the oldest messages into the summary if the window overflows."""
+        super().save_context(inputs, outputs)
+        for message in self.chat_memory.messages[-2:]:
+            tokens = self._count_message(message)
+            self.message_tokens.append(tokens)
+            self.window_tokens += tokens
+
+        if self.window_tokens <= self.window_token_limit:
+            return
+        low_water = int(self.window_token_limit * self.low_water_ratio)
+        evicted = []
+        while self.chat_memory.messages and self.window_tokens > low_water:
+            evicted.append(self.chat_memory.messages.pop(0))
+            self.window_tokens -= self.message_tokens.pop(0)
+        new_lines = get_buffer_string(evicted, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+
+        if self.llm is not None and _running_loop() is not None:
+            previous_summary = self.moving_summary_buffer
+            self._set_summary(f"{previous_summary}\n{new_lines}")
+            self.summary_task = _running_loop().create_task(
+                self._arefresh_summary(self.summary_version, previous_summary, new_lines))
+        elif self.llm is not None:
+            chain = LLMChain(llm=self.llm, prompt=self.summary_prompt)
+            self._set_summary(chain.predict(summary=self.moving_summary_buffer, new_lines=new_lines))
+        else:
+            self._set_summary(f"{self.moving_summary_buffer}\n{new_lines}")
+
+    async def wait_for_summary(self):
+        """
+        Wait until the summary task started by the last overflow, if any, has replaced the provisional summary.
+        """
+        if self.summary_task is not None:
+            await asyncio.shield(self.summary_task)
+
+    async def _arefresh_summary(self, version: int, previous_summary: str, new_lines: str):
+        chain = LLMChain(llm=self.llm, prompt=self.summary_prompt)
+        try:
+            summary = await chain.apredict(summary=previous_summary, new_lines=new_lines)
+        except Exception:
+            # Keep the verbatim lines; the next overflow will try again
+            return
+        # A later eviction has already replaced the provisional summary this task was started for
+        if version == self.summary_version:
+            self._set_summary(summary, bump=False)
+
+    def _set_summary(self, summary: str, bump: bool = True):
+        self.moving_summary_buffer = self._truncate(summary.strip(), self.summary_token_limit).lstrip()
+        self.summary_tokens = self._count_summary(self.moving_summary_buffer)
+        if bump:
+            self.summary_version += 1
+
+    def _count_summary(self, summary: str) -> int:
+        # The summary is rendered as a "System: " message, joined to the window by a newline
+        if not summary:
+            return 0
+        return self.token_counter(get_buffer_string([SystemMessage(content=summary)],
+                                                    human_prefix=self.human_prefix,
+                                                    ai_prefix=self.ai_prefix) + "\n")
+
+    def _truncate(self, text: str, limit: int) -> str:
+        # Keep the most recent part of the text; shrink proportionally until its rendered message fits the budget
+        tokens = self._count_summary(text)
+        while tokens > limit and text:
+            text = text[len(text) - int(len(text) * limit / tokens * 0.95):]
+            tokens = self._count_summary(text)
+        return text
+
+    def clear(self) -> None:
+        """Clear memory contents."""
+        super().clear()
+        self.moving_summary_buffer = ""
+        self.message_tokens = []
+        self.window_tokens = 0
+        self.summary_tokens = 0
+        self.summary_version += 1
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
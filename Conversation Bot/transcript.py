@@ -0,0 +1,182 @@
+import json
+import os
+import time
+from typing import Iterator, Optional, Tuple
+
+# Append-only conversation transcripts. Every turn is written (and flushed) as soon as it happens, so a crash loses
+# at most the turn in flight, and a transcript can be streamed back turn by turn to resume a session.
+#
+# Two formats are supported:
+#   text  - "Human: ...\nAssistant: ...\n\n", the format of human_assistant_messages.txt. A line of a message that
+#           starts like a speaker ("Human: ", "Assistant: ") or with a backslash is written with a backslash before it
+#   jsonl - one {"human": ..., "assistant": ..., "time": ...} object per line
+
+FORMATS = ('text', 'jsonl')
+SPEAKERS = ('Human: ', 'Assistant: ')
+
+
+def resolve_format(path: str, transcript_format: Optional[str] = None) -> str:
+    """
+    Return the transcript format, guessing it from the file extension when it is not given.
+    :param path: transcript file path
+    :param transcript_format: 'text', 'jsonl' or None to guess
+    :return: the format
+    """
+    if transcript_format is None:
+        transcript_format = 'jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'text'
+    if transcript_format not in FORMATS:
+        raise ValueError(f"Unknown transcript format '{transcript_format}', expected one of {FORMATS}")
+    return transcript_format
+
+
+def rotate_transcript(path: str) -> Optional[str]:
+    """
+    Keep an existing transcript under a name stamped with its modification time, so a new conversation can start
+    in `path`: human_assistant_messages.txt becomes e.g. human_assistant_messages-20230425-181502.txt.
+    :param path: transcript file path
+    :return: the new path of the old transcript, None when there was none
+    """
+    if not os.path.exists(path):
+        return None
+    stem, extension = os.path.splitext(path)
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(os.path.getmtime(path)))
+    rotated = f"{stem}-{stamp}{extension}"
+    suffix = 1
+    while os.path.exists(rotated):
+        suffix += 1
+        rotated = f"{stem}-{stamp}-{suffix}{extension}"
+    os.replace(path, rotated)
+    return rotated
+
+
+def _escape(message: str) -> str:
+    # The first line follows the speaker, only the lines after it could be taken for a new message
+    first, *rest = message.split('\n')
+    return '\n'.join([first] + ['\\' + line if line.startswith(SPEAKERS + ('\\',)) else line for line in rest])
+
+
+def _unescape(line: str) -> str:
+    return line[1:] if line.startswith('\\') else line
+
+
+class TranscriptWriter:
+    """
+    Append conversation turns to a transcript file.
+    Each turn is flushed to the operating system right away. `fsync_every` additionally forces the data to disk
+    every N turns, trading a little latency for durability across power loss; 0 leaves that to the OS.
+    """
+
+    def __init__(self, path: str, transcript_format: Optional[str] = None, fsync_every: int = 0,
+                 truncate: bool = False):
+        """
+        :param path: transcript file path
+        :param transcript_format: 'text', 'jsonl' or None to guess from the extension
+        :param fsync_every: fsync after this many turns, 0 to never fsync
+        :param truncate: start a new transcript instead of appending to the existing one
+        """
+        self.path = path
+        self.format = resolve_format(path, transcript_format)
+        self.fsync_every = fsync_every
+        self.unsynced = 0
+        self.file = open(path, 'w' if truncate else 'a', encoding='utf-8')
+
+    def append_turn(self, human: str, assistant: str):
+        """
+        Append one turn to the transcript.
+        :param human: the human's message
+        :param assistant: the assistant's response
+        """
+        if self.format == 'jsonl':
+            line = json.dumps({"human": human, "assistant": assistant, "time": time.time()}) + "\n"
+        else:
+            line = f"Human: {_escape(human)}\nAssistant: {_escape(assistant)}\n\n"
+        self.file.write(line)
+        self.file.flush()
+        self.unsynced += 1
+        if self.fsync_every and self.unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        """
+        Force the turns written so far to disk.
+        """
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        if self.file.closed:
+            return
+        if self.fsync_every and self.unsynced:
+            self.sync()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def load_transcript(path: str, transcript_format: Optional[str] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Stream the turns of a transcript, one (human, assistant) pair at a time, without reading the whole file.
+    In text transcripts, lines that do not start with a speaker belong to the previous message. A trailing turn
+    without an answer (e.g. cut short by a crash) is skipped.
+    :param path: transcript file path
+    :param transcript_format: 'text', 'jsonl' or None to guess from the extension
+    :return: iterator over (human, assistant) pairs
+    """
+    transcript_format = resolve_format(path, transcript_format)
+    with open(path, 'r', encoding='utf-8') as f:
+        if transcript_format == 'jsonl':
+            for line in f:
+                if line.strip():
+                    try:
+                        turn = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A partially written last line
+                        continue
+                    yield turn["human"], turn["assistant"]
+            return
+
+        human, assistant = None, None
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('Human: '):
+                if human is not None and assistant is not None:
+                    yield human, assistant.rstrip('\n')
+                human, assistant = line[len('Human: '):], None
+            elif line.startswith('Assistant: ') and human is not None:
+                assistant = line[len('Assistant: '):]
+            elif assistant is not None:
+                assistant += '\n' + _unescape(line)
+            elif human is not None:
+                human += '\n' + _unescape(line)
+        if human is not None and assistant is not None:
+            yield human, assistant.rstrip('\n')
+
+
+def restore_memory(memory, path: str, transcript_format: Optional[str] = None) -> int:
+    """
+    Replay a transcript into a conversation memory to resume a session.
+    Turns are streamed from the file. A memory with a summary LLM (TokenBudgetMemory) is replayed without it, so
+    resuming a long session does not make one summary call per overflow; the older turns are kept verbatim and
+    trimmed to the summary budget instead.
+    :param memory: langchain memory to fill
+    :param path: transcript file path
+    :param transcript_format: 'text', 'jsonl' or None to guess from the extension
+    :return: number of turns replayed
+    """
+    summary_llm = getattr(memory, 'llm', None)
+    if summary_llm is not None:
+        memory.llm = None
+    turns = 0
+    try:
+        for human, assistant in load_transcript(path, transcript_format):
+            memory.save_context({"human_input": human}, {"text": assistant})
+            turns += 1
+    finally:
+        if summary_llm is not None:
+            memory.llm = summary_llm
+    return turns
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import configparser
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.http_client import OPENAI_API_BASE, OpenAIHTTPClient
+from common.rate_limit import RateLimiter, call_with_retries, estimate_tokens
+
+# Batch mode for offline bulk generation. Prompts are read from a JSONL file (or stdin), sent concurrently under
+# request and token rate limits, and the results are written to a JSONL file in input order.
+#
+# Each input line is either a JSON string (the prompt) or an object with a "prompt" key and optional
+# "max_tokens", "temperature" and "model" keys that override the command line defaults.
+#
+#   python openai-batch-sample.py prompts.jsonl results.jsonl --concurrency 8 --rpm 3000 --tpm 250000
+
+
+# argparse type of a count that must be at least 1
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {number}")
+    return number
+
+
+# Parse the command line arguments
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run many completion prompts concurrently.')
+    parser.add_argument('input', help="JSONL file with one prompt per line, or '-' for stdin")
+    parser.add_argument('output', help='JSONL file to write the results to, in input order')
+    parser.add_argument('--concurrency', type=positive_int, default=8, help='maximum number of requests in flight')
+    parser.add_argument('--max-backlog', type=positive_int, default=None,
+                        help='maximum number of finished results held back for the output order, '
+                             'defaults to 4 times the concurrency')
+    parser.add_argument('--rpm', type=float, default=None, help='requests per minute limit')
+    parser.add_argument('--tpm', type=float, default=None, help='tokens per minute limit')
+    parser.add_argument('--max-retries', type=int, default=5, help='retries on 429, 5xx and network errors')
+    parser.add_argument('--model', default='text-davinci-003')
+    parser.add_argument('--max-tokens', type=int, default=50)
+    parser.add_argument('--temperature', type=float, default=0.5)
+    parser.add_argument('--api-base', default=OPENAI_API_BASE)
+    return parser.parse_args()
+
+
+# Turn one input line into request parameters
+def parse_request(line, args):
+    item = json.loads(line)
+    if isinstance(item, str):
+        item = {"prompt": item}
+    return {
+        "prompt": item["prompt"],
+        "model": item.get("model", args.model),
+        "max_tokens": item.get("max_tokens", args.max_tokens),
+        "temperature": item.get("temperature", args.temperature)
+    }
+
+
+# Read the input lazily so large batches are never loaded at once. Lines are read in the loop's executor, so a slow
+# producer piping into stdin does not stall the requests in flight and the writer
+async def read_requests(input_file, queue, concurrency):
+    loop = asyncio.get_running_loop()
+    index = 0
+    while True:
+        line = await loop.run_in_executor(None, input_file.readline)
+        if not line:
+            break
+        if line.strip():
+            await queue.put((index, line))
+            index += 1
+    for _ in range(concurrency):
+        await queue.put(None)
+    return index
+
+
+# Send one request, waiting for the rate limiter and retrying transient errors
+async def run_request(client, limiter, index, line, args):
+    result = {"index": index}
+    attempts = 0
+
+    async def attempt():
+        nonlocal attempts
+        attempts += 1
+        await limiter.acquire(estimate_tokens(request["prompt"], request["max_tokens"]))
+        return await client.create_completion(**request)
+
+    try:
+        request = parse_request(line, args)
+        result["prompt"] = request["prompt"]
+        response = await call_with_retries(attempt, max_retries=args.max_retries)
+        result["completion"] = response['choices'][0]['text'].strip()
+        result["usage"] = response.get("usage")
+    except Exception as e:
+        result["error"] = getattr(e, 'message', None) or repr(e)
+    result["attempts"] = attempts
+    return result
+
+
+# Write results as soon as every earlier result is done, holding back only the ones that finished out of order.
+# A request may only start within `max_backlog` of the first unwritten one, so a slow request holds back at most
+# that many results instead of letting them pile up for the rest of the batch
+class OrderedWriter:
+    def __init__(self, output_file, max_backlog):
+        if max_backlog < 1:
+            # No request could ever start
+            raise ValueError(f"max_backlog must be at least 1, got {max_backlog}")
+        self.output_file = output_file
+        self.max_backlog = max_backlog
+        self.pending = {}
+        self.next_index = 0
+        self.errors = 0
+        self.max_pending = 0
+        self._written = asyncio.Condition()
+
+    async def wait_turn(self, index):
+        async with self._written:
+            await self._written.wait_for(lambda: index < self.next_index + self.max_backlog)
+
+    async def add(self, result):
+        self.pending[result["index"]] = result
+        self.max_pending = max(self.max_pending, len(self.pending))
+        if self.next_index not in self.pending:
+            return
+        while self.next_index in self.pending:
+            ready = self.pending.pop(self.next_index)
+            self.errors += "error" in ready
+            self.output_file.write(json.dumps(ready) + "\n")
+            self.next_index += 1
+        self.output_file.flush()
+        async with self._written:
+            self._written.notify_all()
+
+
+# Worker pulling requests from the queue until it gets the stop marker
+async def worker(client, limiter, queue, writer, args):
+    while True:
+        item = await queue.get()
+        if item is None:
+            return
+        index, line = item
+        await writer.wait_turn(index)
+        await writer.add(await run_request(client, limiter, index, line, args))
+
+
+# Run the whole batch and return the number of prompts and the writer, which counts the errors
+async def run_batch(api_key, input_file, output_file, args):
+    limiter = RateLimiter(args.rpm, args.tpm)
+    writer = OrderedWriter(output_file, 4 * args.concurrency if args.max_backlog is None else args.max_backlog)
+    queue = asyncio.Queue(maxsize=args.concurrency * 2)
+    async with OpenAIHTTPClient(api_key, api_base=args.api_base, limit=args.concurrency,
+                                limit_per_host=args.concurrency) as client:
+        workers = [asyncio.create_task(worker(client, limiter, queue, writer, args))
+                   for _ in range(args.concurrency)]
+        total = await read_requests(input_file, queue, args.concurrency)
+        await asyncio.gather(*workers)
+    return total, writer
+
+
+# Main function to start the batch
+def main():
+    args = parse_args()
+    config = configparser.ConfigParser()
+    config.read('config.ini')
+    api_key = config.get('API_KEYS', 'OPENAI-API_KEY')
+
+    started = time.perf_counter()
+    input_file = sys.stdin if args.input == '-' else open(args.input, 'r')
+    try:
+        with open(args.output, 'w') as output_file:
+            total, writer = asyncio.run(run_batch(api_key, input_file, output_file, args))
+    finally:
+        if input_file is not sys.stdin:
+            input_file.close()
+    elapsed = time.perf_counter() - started
+    print(f"Completed {total} prompts ({writer.errors} failed) in {elapsed:.1f}s, "
+          f"{total / elapsed if elapsed else 0:.1f} prompts/s. Results saved to {args.output}")
+
+
+# Entry point of the script
+if __name__ == '__main__':
+    main()
@@ -2,78 +2,94 @@ import openai
 import configparser
 import asyncio
 import aiohttp
-import json
+import os
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.http_client import APIError, OpenAIHTTPClient
+from common.instrumentation import configure_metrics_from_config, finish_metrics, record_error, timed
+from common.resilience import CircuitOpenError, DeadlineExceeded, resilient_client_from_config
+from common.streaming import StdoutSink, StreamStats, stream_to_sink
+
 # Load API key from config file
 config = configparser.ConfigParser()
 config.read('config.ini')
 openai.api_key = config.get('API_KEYS', 'OPENAI-API_KEY')
+stream_responses = config.getboolean('SETTINGS', 'STREAM', fallback=False)
+# Stage timings and token counts, off unless METRICS is set
+metrics = configure_metrics_from_config(config)
 
-# Define custom APIError exception
-class APIError(Exception):
-    def __init__(self, status_code, message):
-        self.status_code = status_code
-        self.message = message
-        super().__init__(self.message)
+# One pooled HTTP client and one event loop for the whole session, so the connection to the API is reused
+client = OpenAIHTTPClient(openai.api_key)
+# Retries, circuit breaker, deadline and hedging of the requests (MAX_RETRIES, REQUEST_DEADLINE, ... in config.ini)
+resilient = resilient_client_from_config(config)
+loop = asyncio.new_event_loop()
 
-# Get user input and process it
+# Get user input and process it. A failed message is reported and the next one can be typed
 def get_user_input():
     while True:
         user_input = input(f"\nYour message: ")
         if user_input.lower() == 'exit':
             break
         else:
-            status_code = run_async(process_input(user_input))
-            if status_code is not None:
-                break
+            run_async(process_input(user_input))
 
 # Run async function synchronously
 def run_async(coroutine_object):
-    return asyncio.get_event_loop().run_until_complete(coroutine_object)
+    return loop.run_until_complete(coroutine_object)
 
 # Process user input and display response or error message
 async def process_input(user_input):
     sys.stdout.write(".....waiting for magic.....")
     sys.stdout.flush()
     try:
-        response = await generate_response(user_input)
+        with timed("request"):
+            return await show_response(user_input)
+    except (APIError, CircuitOpenError, DeadlineExceeded, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        record_error(e)
         sys.stdout.write("\r" + " " * len(".....waiting for magic.....") + "\r")
         sys.stdout.flush()
-        print(response, "\n")
+        print(f"Error occurred: {getattr(e, 'message', None) or str(e) or type(e).__name__}")
+        return e
+
+# Generate the response and display it
+async def show_response(user_input):
+    if stream_responses:
+        stats = await generate_streaming_response(user_input, StdoutSink(erase=len(".....waiting for magic.....")))
+        print(f"\033[90m({stats})\033[0m\n")
         return None
-    except APIError as e:
-        sys.stdout.write("\r" + " " * len(".....waiting for magic.....") + "\r")
-        sys.stdout.flush()
-        print(f"Error occurred: {e.message}")
-        return e.status_code
+    response = await generate_response(user_input)
+    sys.stdout.write("\r" + " " * len(".....waiting for magic.....") + "\r")
+    sys.stdout.flush()
+    print(response, "\n")
+    return None
 
 # Call OpenAI API to generate a response
 async def generate_response(user_input):
-    async with aiohttp.ClientSession() as session:
-        payload = {
-            "model": "text-davinci-003",
-            "prompt": f"{user_input}\n",
-            "max_tokens": 50,
-            "temperature": 0.5
-        }
-        headers = {
-            "Authorization": f"Bearer {openai.api_key}",
-            "Content-Type": "application/json"
-        }
-        async with session.post('https://api.openai.com/v1/completions',
-                                data=json.dumps(payload),
-                                headers=headers) as resp:
-            result = await resp.json()
-            if resp.status == 200:
-                return result['choices'][0]['text'].strip()
-            else:
-                raise APIError(resp.status, result.get('error', 'Unknown error'))
+    return await resilient.call("/completions",
+                                lambda: client.completion(f"{user_input}\n", max_tokens=50, temperature=0.5))
+
+# Call OpenAI API and write the response to the sink token by token, returning the timings of the attempt that
+# answered. A streamed request is retried but not hedged; one that broke off after some tokens starts over on a new
+# line, with timings of its own
+async def generate_streaming_response(user_input, sink):
+    async def attempt():
+        stats = StreamStats()
+        tokens = client.stream_completion(f"{user_input}\n", max_tokens=50, temperature=0.5)
+        await stream_to_sink(tokens, sink, stats)
+        return stats
+
+    return await resilient.call("/completions", attempt, hedge=False)
 
 # Main function to start the app
 def main():
     print(f"\nWelcome to the ChatGPT Python app!")
-    get_user_input()
+    try:
+        get_user_input()
+    finally:
+        run_async(client.close())
+        loop.close()
+        finish_metrics(metrics)
     print(f"\nExiting the app. Have a great day!\n")
 
 # Entry point of the script
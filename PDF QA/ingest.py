@@ -0,0 +1,269 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+# LangChain, the vector stores and pdfplumber are imported where they are used, so the chat can check whether the
+# database is up to date (see needs_ingest()) and show its prompt before they are loaded
+if TYPE_CHECKING:
+    from langchain.docstore.document import Document
+    from langchain.embeddings.base import Embeddings
+    from langchain.vectorstores.base import VectorStore
+
+    from common.embeddings import EmbeddingStats
+    from pdf_extract import ExtractionStats
+
+MANIFEST_FILE = "manifest.json"
+EMBEDDING_CACHE_FILE = "embedding_cache.sqlite"
+VECTOR_STORES = ("chroma", "numpy")
+# Chunks of CHUNK_SIZE tokens sharing up to CHUNK_OVERLAP tokens; see common.chunking.TokenTextChunker
+CHUNK_SIZE = 256
+CHUNK_OVERLAP = 32
+CHUNKING = f"tokens:{CHUNK_SIZE}:{CHUNK_OVERLAP}"
+
+
+@dataclass
+class IngestReport:
+    """
+    Chunk counts of one ingest run.
+    """
+    added: int = 0
+    skipped: int = 0
+    deleted: int = 0
+    files_changed: int = 0
+    files_deleted: int = 0
+    extraction: Optional["ExtractionStats"] = None
+    embedding: Optional["EmbeddingStats"] = None
+
+    def __str__(self):
+        report = (f"{self.added} chunks added, {self.skipped} skipped, {self.deleted} deleted "
+                  f"({self.files_changed} new or changed files, {self.files_deleted} deleted files)")
+        if self.extraction is not None and self.extraction.total_pages:
+            report += f"\nExtracted {self.extraction}"
+        if self.embedding is not None and self.embedding.texts:
+            report += f"\nEmbedded {self.embedding}"
+        return report
+
+
+def file_sha256(file_path: str) -> str:
+    """
+    Hash a file's content in blocks, without reading it into memory at once.
+    :param file_path: path of the file
+    :return: hex SHA-256 digest
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def text_sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_ids(file_name: str, chunks: List["Document"]) -> List[str]:
+    """
+    Build stable ids for the chunks of a file from the file name and each chunk's content hash.
+    An unchanged chunk keeps its id when other parts of the file change, so it is not embedded again.
+    Identical chunks within a file are told apart by their occurrence number.
+    :param file_name: name of the source file
+    :param chunks: chunks of the file
+    :return: one id per chunk
+    """
+    file_key = text_sha256(file_name)[:16]
+    seen = Counter()
+    ids = []
+    for chunk in chunks:
+        chunk_hash = text_sha256(chunk.page_content)
+        ids.append(f"{file_key}-{chunk_hash[:32]}-{seen[chunk_hash]}")
+        seen[chunk_hash] += 1
+    return ids
+
+
+def load_manifest(vectordb_dir_path: str) -> Dict:
+    manifest_path = os.path.join(vectordb_dir_path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return {"version": 1, "files": {}}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(vectordb_dir_path: str, manifest: Dict):
+    # Write to a temporary file first, so a crash never leaves a half-written manifest behind
+    os.makedirs(vectordb_dir_path, exist_ok=True)
+    manifest_path = os.path.join(vectordb_dir_path, MANIFEST_FILE)
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+
+def open_vectordb(vectordb_dir_path: str, embeddings: "Embeddings", vector_store: str = "chroma") -> "VectorStore":
+    """
+    Open the vector database in `vectordb_dir_path`, creating it if needed.
+    :param vectordb_dir_path: directory of the database
+    :param embeddings: embeddings of the chunks and queries
+    :param vector_store: "chroma" for Chroma, "numpy" for the local memory-mapped MemmapVectorStore
+    :return: the vector store
+    """
+    if vector_store == "chroma":
+        from langchain.vectorstores import Chroma
+        return Chroma(persist_directory=vectordb_dir_path, embedding_function=embeddings)
+    if vector_store == "numpy":
+        from common.vectorstore import MemmapVectorStore
+        return MemmapVectorStore(vectordb_dir_path, embeddings)
+    raise ValueError(f"Unknown vector store '{vector_store}', expected one of {VECTOR_STORES}")
+
+
+def count_chunks(vectordb: "VectorStore") -> int:
+    from common.vectorstore import MemmapVectorStore
+    if isinstance(vectordb, MemmapVectorStore):
+        return vectordb.count()
+    return vectordb._collection.count()
+
+
+def delete_chunks(vectordb: "VectorStore", ids: Optional[List[str]] = None):
+    # None deletes every chunk
+    from common.vectorstore import MemmapVectorStore
+    if isinstance(vectordb, MemmapVectorStore):
+        vectordb.delete(ids)
+    else:
+        vectordb._collection.delete(ids=ids)
+
+
+def index_version(vectordb_dir_path: str) -> str:
+    """
+    Version of the vector database: a hash of the ids of all the chunks in its manifest. It changes whenever an
+    ingest adds or removes chunks, and only then.
+    :param vectordb_dir_path: directory of the vector database and its manifest
+    :return: hex digest
+    """
+    files = load_manifest(vectordb_dir_path)["files"]
+    return text_sha256("\n".join(sorted(chunk_id for entry in files.values() for chunk_id in entry["chunk_ids"])))
+
+
+def needs_ingest(source_path: str = "papers", vectordb_dir_path: str = "chroma_db",
+                 vector_store: str = "chroma") -> bool:
+    """
+    Whether ingest() has anything to do: a new, changed or deleted PDF file, other chunking settings or another
+    vector store. Only the manifest is read and the files hashed, so this is fast and loads no vector store.
+    :param source_path: folder containing the PDF files
+    :param vectordb_dir_path: directory of the vector database and its manifest
+    :param vector_store: "chroma" or "numpy"
+    :return: True when the database is not up to date with the files
+    """
+    if not os.path.exists(os.path.join(vectordb_dir_path, MANIFEST_FILE)):
+        return True
+    manifest = load_manifest(vectordb_dir_path)
+    if manifest.get("vector_store", "chroma") != vector_store or manifest.get("chunking") != CHUNKING:
+        return True
+    files = manifest["files"]
+    pdf_names = sorted(name for name in os.listdir(source_path) if name.lower().endswith(".pdf"))
+    if set(files) != set(pdf_names):
+        return True
+    return any(files[name]["sha256"] != file_sha256(os.path.join(source_path, name)) for name in pdf_names)
+
+
+def ingest(source_path: str = "papers",
+           vectordb_dir_path: str = "chroma_db",
+           embeddings: Optional["Embeddings"] = None,
+           workers: Optional[int] = None,
+           vector_store: str = "chroma") -> IngestReport:
+    """
+    Bring the vector database in line with the PDF files in `source_path`.
+    A manifest in the database directory records the content hash of every ingested file and the ids and hashes of
+    its chunks. Unchanged files are skipped without being parsed. New and changed files are extracted and only their
+    new chunks are embedded; chunks that no longer exist, and all chunks of deleted files, are removed. All files are
+    chunked again when the chunking settings changed.
+    The manifest is saved after every file, so an interrupted run picks up where it stopped.
+    PDFs are parsed on a pool of worker processes and handed over to the embedding stage as soon as each file is
+    done, through a bounded queue (see pdf_extract.ExtractionPipeline).
+    :param source_path: folder containing the PDF files
+    :param vectordb_dir_path: directory of the vector database and its manifest
+    :param embeddings: embeddings used for new chunks. Defaults to OpenAIEmbeddings behind the on-disk cache in
+                       EMBEDDING_CACHE_FILE, so a chunk seen before (in any file, or before a rebuild) is not embedded
+                       again
+    :param workers: number of PDF parsing processes. Defaults to the number of CPUs; 0 parses in this process
+    :param vector_store: "chroma" or "numpy", see open_vectordb()
+    :return: counts of added, skipped and deleted chunks
+    """
+    from langchain.embeddings import OpenAIEmbeddings
+
+    from common.embeddings import CachedEmbeddings
+    from pdf_extract import ExtractionPipeline
+
+    report = IngestReport()
+    has_manifest = os.path.exists(os.path.join(vectordb_dir_path, MANIFEST_FILE))
+    manifest = load_manifest(vectordb_dir_path)
+    if embeddings is None:
+        embeddings = CachedEmbeddings.from_path(OpenAIEmbeddings(), EMBEDDING_CACHE_FILE)
+    vectordb = open_vectordb(vectordb_dir_path, embeddings, vector_store)
+
+    # A database built before manifests existed, or whose manifest describes another vector store, has chunks we
+    # cannot map back to files: start it over
+    if not has_manifest or manifest.get("vector_store", "chroma") != vector_store:
+        legacy_chunks = count_chunks(vectordb)
+        if legacy_chunks:
+            delete_chunks(vectordb)
+            report.deleted += legacy_chunks
+        manifest = {"version": 1, "files": {}}
+    manifest["vector_store"] = vector_store
+    # Files chunked with other settings are chunked again, even when they did not change. The new settings are only
+    # recorded once all the files are done, so an interrupted run rechunks the rest next time
+    rechunk = manifest.get("chunking") != CHUNKING
+    files = manifest["files"]
+
+    pdf_names = sorted(name for name in os.listdir(source_path) if name.lower().endswith(".pdf"))
+    file_hashes = {}
+    for file_name in pdf_names:
+        file_hash = file_sha256(os.path.join(source_path, file_name))
+        entry = files.get(file_name)
+        if entry is not None and entry["sha256"] == file_hash and not rechunk:
+            report.skipped += len(entry["chunk_ids"])
+        else:
+            file_hashes[file_name] = file_hash
+
+    with ExtractionPipeline([os.path.join(source_path, file_name) for file_name in file_hashes],
+                            workers=workers, chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP) as pipeline:
+        for file_path, chunks in pipeline:
+            file_name = os.path.basename(file_path)
+            entry = files.get(file_name)
+            ids = chunk_ids(file_name, chunks)
+            old_ids = set(entry["chunk_ids"]) if entry is not None else set()
+            new = [(chunk_id, chunk) for chunk_id, chunk in zip(ids, chunks) if chunk_id not in old_ids]
+            stale = sorted(old_ids - set(ids))
+
+            if stale:
+                delete_chunks(vectordb, stale)
+            if new:
+                vectordb.add_texts(texts=[chunk.page_content for _, chunk in new],
+                                   metadatas=[chunk.metadata for _, chunk in new],
+                                   ids=[chunk_id for chunk_id, _ in new])
+            vectordb.persist()
+
+            report.added += len(new)
+            report.skipped += len(ids) - len(new)
+            report.deleted += len(stale)
+            report.files_changed += 1
+            files[file_name] = {"sha256": file_hashes[file_name], "chunk_ids": ids}
+            save_manifest(vectordb_dir_path, manifest)
+    report.extraction = pipeline.stats
+    if isinstance(embeddings, CachedEmbeddings):
+        report.embedding = embeddings.stats
+
+    for file_name in sorted(set(files) - set(pdf_names)):
+        stale = files[file_name]["chunk_ids"]
+        if stale:
+            delete_chunks(vectordb, stale)
+            vectordb.persist()
+        report.deleted += len(stale)
+        report.files_deleted += 1
+        del files[file_name]
+        save_manifest(vectordb_dir_path, manifest)
+
+    if rechunk:
+        manifest["chunking"] = CHUNKING
+        save_manifest(vectordb_dir_path, manifest)
+    return report
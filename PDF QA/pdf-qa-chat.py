@@ -1,255 +1,306 @@
 import configparser
-import json
 import os
-import re
 import sys
-from typing import Optional
+import threading
+from typing import TYPE_CHECKING, Optional
 
-import pdfplumber
-from langchain import OpenAI, PromptTemplate
-from langchain.chains import RetrievalQA
-from langchain.chains.combine_documents.base import BaseCombineDocumentsChain
-from langchain.chains.retrieval_qa.base import BaseRetrievalQA
-from langchain.chains.summarize import load_summarize_chain
-from langchain.document_loaders import UnstructuredPDFLoader
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import Chroma
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.instrumentation import configure_metrics_from_config, finish_metrics, record_error, timed
+from common.resilience import ResilientClient, resilient_client_from_config
+from common.startup import DaemonClient, Deferred, connect_daemon, serve_daemon
+from ingest import EMBEDDING_CACHE_FILE, IngestReport, index_version, ingest, needs_ingest, open_vectordb
+from summarize import PDFSummarizer, SummaryCheckpoint
 
+# LangChain and the vector stores take seconds to import; they are imported where they are used, so the summaries
+# and the prompt show up without waiting for them
+if TYPE_CHECKING:
+    from langchain.embeddings.base import Embeddings
+    from langchain.vectorstores.base import VectorStore
 
-def preprocess(text):
-    """
-    This function preprocesses the input text by replacing newlines with spaces and removing consecutive whitespaces
-    using regex.
-    :param text:
-    :return: text
-    """
-    text = text.replace('\n', ' ')
-    text = re.sub('\s+', ' ', text)
-    return text
+    from common.answer_cache import AnswerCache
+    from common.embeddings import CachedEmbeddings
+    from qa_session import QASession
 
+ANSWER_CACHE_FILE = "answer_cache.sqlite"
+VECTORDB_DIRS = {"chroma": "chroma_db", "numpy": "numpy_db"}
 
-def extract_page_text(file_path: str, start_page: Optional[int] = 0, num_pages: Optional[int] = 3) -> str:
-    """
-    This function takes a PDF file path and extracts text from the specified page range.
-    It takes three parameters:
-    :param file_path:a string representing the file path of the PDF file
-    :param start_page:an optional integer representing the starting page number to extract text from. The default value is 0.
-    :param num_pages:an optional integer representing the number of pages to extract text from. The default value is 3.
-    :return:pdf text
-    """
-    with pdfplumber.open(file_path) as pdf:
-        pages_text = []
-        for page_number in range(start_page, start_page + num_pages):
-            if page_number < len(pdf.pages):
-                page = pdf.pages[page_number]
-                text = preprocess(page.extract_text())
-                pages_text.append(text)
-        combined_text = ' '.join(pages_text)
-    return combined_text
-
-
-def generate_pdf_summary_chain(text: str, chain: BaseCombineDocumentsChain) -> str:
-    """
-    This function takes in a string of text and a summary chain object and generates a summary of the
-    text using the specified chain. The text is split using a RecursiveCharacterTextSplitter, then documents are
-    created from the resulting text segments. The chain is then applied to the documents to generate the summary.
-    :param text:pdf text
-    :param chain:summary chain
-    :return:concise summary of the text
-    """
-    text_splitter = RecursiveCharacterTextSplitter()
-    texts = text_splitter.split_text(text)
-    docs = text_splitter.create_documents(texts=texts)
-    summary = chain.run(docs)
-    return summary
 
-
-def generate_pdf_summary(source_path: str = "papers", output_file: str = "summaries.json"):
+def generate_pdf_summary(source_path: str = "papers", output_file: str = "summaries.json",
+                         max_concurrency: int = 4, resilient: Optional[ResilientClient] = None):
     """
     This function takes in a folder path and generates summaries of all the PDF files in that folder.
-    The summaries are stored in an output file for later retrieval. If the output file already exists, the
-    function loads and displays the existing summaries; otherwise, it generates new summaries for each
-    PDF file and stores them in the output file. The summary is generated using OpenAI's GPT-3 model
-    which is fed with a prompt template and the text extracted from the first page of each PDF.
-    The generated summaries are displayed and also saved to the output file as a JSON array of file names
-    and their corresponding summaries.
+    Whole documents are summarized with map-reduce: every chunk of a PDF is summarized, then the chunk summaries are
+    combined, by OpenAI's GPT-3 model with a prompt template. The LLM calls of all the files run concurrently.
+    Every finished summary is saved to the output file with the hash of its PDF, so an interrupted run resumes where
+    it stopped and only new or changed files are summarized again. See summarize.PDFSummarizer. When no file changed,
+    the saved summaries are shown without loading the summarizer.
+    The summaries are displayed once they are all available.
     :param source_path: Path to the folder containing PDF files. Default value is 'papers'
     :param output_file: Name of the output file to store the summaries. Default value is 'summaries.json'
+    :param max_concurrency: maximum number of LLM calls at once
+    :param resilient: client retrying, hedging and cutting off the LLM calls, None for LangChain's own retries
     """
-    summaries = []
-
-    prompt_template = """
-                        Write a concise summary of the following in passive voice no more than 150 words.\n
-                        Example of a passive voice sentence: The package was delivered by the courier to the recipient's address.\n
-                        Include key details such as the main findings and implications of the text.\n
-
-                        {text}\n
-
-                        Example response:\n
-                        A pipeline was proposed to generate a high-quality multi-turn chat corpus using ChatGPT to converse with itself. The resulting Baize model demonstrated good performance in multi-turn dialogues with guardrails that minimize potential risks. Baize model and data were released for research purposes only."""
-    prompt = PromptTemplate(template=prompt_template, input_variables=["text"])
-    summary_chain = load_summarize_chain(OpenAI(temperature=0, max_tokens=300),
-                                         chain_type="stuff",
-                                         prompt=prompt)
-
-    if os.path.exists(output_file):
-        print("\nLoading PDF summaries...\n")
-        with open(output_file, "r") as infile:
-            summaries = json.load(infile)
-            for summary in summaries:
-                print("\033[93m" + f"{summary['file_name']} Summary:" + "\033[0m")
-                print(f"{summary['summary']}\n")
-    else:
-        print("\nGenerating PDF summaries...\n")
-        summaries = []
-        for file_name in os.listdir(source_path):
-            if file_name.lower().endswith(".pdf"):
-                file_path = os.path.join(source_path, file_name)
-                first_page_text = extract_page_text(file_path)
-                summary = generate_pdf_summary_chain(first_page_text, summary_chain)
-
-                summary_data = {
-                    "file_name": file_name,
-                    "summary": summary.strip()
-                }
-                summaries.append(summary_data)
-
-                print("\033[93m" + f"{file_name} Summary:" + "\033[0m")
-                print(f"{summary}\n")
+    file_names = [file_name for file_name in sorted(os.listdir(source_path)) if file_name.lower().endswith(".pdf")]
+    print("\nLoading PDF summaries...\n")
+    file_paths = [os.path.join(source_path, file_name) for file_name in file_names]
+    checkpoint = SummaryCheckpoint(output_file)
+    summaries = checkpoint.current(file_paths)
+    summarizer = None
+    if summaries is None:
+        summarizer = PDFSummarizer(max_concurrency=max_concurrency, resilient=resilient)
+        summaries = summarizer.summarize_files(file_paths, checkpoint)
+    for file_name, summary in summaries.items():
+        print("\033[93m" + f"{file_name} Summary:" + "\033[0m")
+        print(f"{summary}\n")
+    if summarizer is not None and (summarizer.stats.summarized or summarizer.stats.failed):
+        print(f"Summarized {summarizer.stats}\n")
+
+
+def create_vectordb(vectordb_dir_path: str = "chroma_db", embeddings: Optional["Embeddings"] = None,
+                    vector_store: str = "chroma") -> IngestReport:
+    """
+    Creates or updates the vector database for the PDF files in the 'papers' directory, using the Chroma library
+    or the local NumPy vector store.
+    Only new or changed PDF files are split into chunks and embedded with OpenAI's embeddings; unchanged files are
+    skipped and the chunks of deleted or changed files are removed. See ingest.ingest() for the details.
 
-        # Save the summaries to the JSON file
-        with open(output_file, "w") as outfile:
-            json.dump(summaries, outfile, indent=2)
+    :param vectordb_dir_path: The path to the directory where the vector database should be stored. If the directory
+                              does not exist, it will be created. Default value is 'chroma_db'.
+    :param embeddings: embeddings for the new chunks. Defaults to the cached OpenAI embeddings
+    :param vector_store: "chroma" or "numpy"
+    :return: counts of the chunks added, skipped and deleted
+    """
+    return ingest("papers", vectordb_dir_path, embeddings, vector_store=vector_store)
 
 
-def create_vectordb(vectordb_dir_path: str = "chroma_db"):
+def create_embeddings() -> "CachedEmbeddings":
     """
-    Creates a vector database for the PDF files in the 'papers' directory, using the Chroma library.
+    OpenAI embeddings behind the on-disk embedding cache, shared by ingestion and queries so repeated questions
+    are embedded once too.
+    """
+    from langchain.embeddings import OpenAIEmbeddings
 
-    This function iterates through each PDF file in the directory, splits its text into smaller chunks, creates Document
-    instances from the text chunks, and extracts document embeddings using OpenAI's GPT-3 model. Then it uses Chroma to
-    store the embeddings in a vector database on disk.
+    from common.embeddings import CachedEmbeddings
+    return CachedEmbeddings.from_path(OpenAIEmbeddings(), EMBEDDING_CACHE_FILE)
 
-    :param vectordb_dir_path: The path to the directory where the vector database should be stored. If the directory
-                              does not exist, it will be created. Default value is 'chroma_db'.
-    """
-    if not os.path.exists(vectordb_dir_path):
-        embeddings = OpenAIEmbeddings()
-
-        for file_name in os.listdir("papers"):
-            if file_name.lower().endswith('.pdf'):
-                file_path = os.path.join("papers", file_name)
-                text_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=1000
-                )
-                pdf = UnstructuredPDFLoader(file_path, strategy="fast")
-                docs = pdf.load_and_split(text_splitter=text_splitter)
-                Chroma.from_documents(docs,
-                                      embeddings,
-                                      persist_directory=vectordb_dir_path)
-
-
-def load_vectordb(vectordb_dir_path: str = "chroma_db") -> Chroma:
+
+def load_vectordb(vectordb_dir_path: str = "chroma_db", embeddings: Optional["Embeddings"] = None,
+                  vector_store: str = "chroma") -> "VectorStore":
     """
-    Load a Chroma vector database from the specified directory.
+    Load a vector database from the specified directory.
 
-    :param vectordb_dir_path: Directory path where the Chroma object is stored.
-    :return: A Chroma object loaded from the specified directory.
+    :param vectordb_dir_path: Directory path where the vector database is stored.
+    :param embeddings: embeddings for the queries. Defaults to the cached OpenAI embeddings
+    :param vector_store: "chroma" or "numpy"
+    :return: A vector store loaded from the specified directory.
     """
     if not os.path.exists(vectordb_dir_path):
         raise FileNotFoundError("Vector database not found. Create them first.")
     else:
-        embeddings = OpenAIEmbeddings()
-        vectordb = Chroma(persist_directory=vectordb_dir_path,
-                          embedding_function=embeddings)
+        if embeddings is None:
+            embeddings = create_embeddings()
+        vectordb = open_vectordb(vectordb_dir_path, embeddings, vector_store)
         return vectordb
 
 
-def generate_pdf_embeddings(vectordb_dir_path: str = "chromadb") -> Chroma:
+def generate_pdf_embeddings(vectordb_dir_path: str = "chroma_db", vector_store: str = "chroma") -> "VectorStore":
     """
-    This function generates Chroma vector database for PDF documents in the specified directory to store
-    OpenAI embeddings. If the Chroma database does not exist, it will be created first.
-    :param vectordb_dir_path: directory path for the Chroma database. Default value is 'chromadb'
-    :return: Chroma object with the PDF embeddings
+    This function generates a vector database for PDF documents in the specified directory to store
+    OpenAI embeddings. The database is created if it does not exist, and brought up to date with the PDF files
+    otherwise; only new or changed files are embedded.
+    :param vectordb_dir_path: directory path for the vector database. Default value is 'chroma_db'
+    :param vector_store: "chroma" or "numpy"
+    :return: vector store with the PDF embeddings
     """
-    if not os.path.exists(vectordb_dir_path):
-        create_vectordb()
-    return load_vectordb()
+    print("\nUpdating PDF embeddings...")
+    embeddings = create_embeddings()
+    report = create_vectordb(vectordb_dir_path, embeddings, vector_store)
+    print(f"{report}\n")
+    return load_vectordb(vectordb_dir_path, embeddings, vector_store)
 
 
-def query_dataset_retrieval(query: str, qa_chain: BaseRetrievalQA):
+def query_dataset_retrieval(query: str, qa_session: "QASession"):
     """
-    Execute the RetrievalQA chain
+    Answer a query with the QA session
     :param query: Query to execute
-    :param qa_chain: The RetrievalQA chain object
+    :param qa_session: The QA session holding the RetrievalQA chain
     """
-    response = qa_chain.run(query)
+    response = qa_session.query(query)
     return response
 
 
-def process_input(user_input: str, vectordb: Chroma):
+def process_input(user_input: str, qa_session: "QASession"):
     """
     Get input from the user and perform a Retrieval QA on the PDF documents which are stored as embeddings.
     :param user_input: Input text from the user
-    :param vectordb: Chroma vector database
+    :param qa_session: QA session over the vector database, reused for every question. A Deferred session is
+                       waited for by the first question
     """
-    prompt_template = """
-        Use the following pieces of context to answer the question at the end.\n 
-        If you don't know the answer, just say that you don't know, don't try to make up an answer.\n
-
-        {context}\n
-
-        Question: {question}\n
-        Answer:"""
-    prompt = PromptTemplate(
-        template=prompt_template, input_variables=["context", "question"]
-    )
-    chain_type_kwargs = {"prompt": prompt}
-    retriever = vectordb.as_retriever(search_type="similarity", search_kwargs={"k": 2})
-    qa_chain = RetrievalQA.from_chain_type(OpenAI(temperature=0, max_tokens=400),
-                                           chain_type="stuff",
-                                           retriever=retriever,
-                                           chain_type_kwargs=chain_type_kwargs)
-
     sys.stdout.write(".....waiting for magic.....")
     sys.stdout.flush()
     try:
-        response = query_dataset_retrieval(user_input, qa_chain)
+        with timed("request"):
+            response = query_dataset_retrieval(user_input, qa_session)
         sys.stdout.write("\r" + " " * len(".....waiting for magic.....") + "\r")
         sys.stdout.flush()
-        print(response, "\n")
+        print(response)
+        if qa_session.last_context is not None:
+            print(f"({qa_session.last_context})")
+        print()
         return None
     except Exception as e:
+        record_error(e)
         sys.stdout.write("\r" + " " * len(".....waiting for magic.....") + "\r")
         sys.stdout.flush()
-        error_message = f"AI Assistant encountered an error. Please try again later.\nError:{e} "
+        if getattr(e, 'retry_after', None) is not None:
+            # An open circuit breaker, or a rate limit still hit after the retries, says when to come back
+            error_message = f"AI Assistant is unavailable right now. Please try again in {e.retry_after:.0f} seconds."
+        else:
+            error_message = f"AI Assistant encountered an error. Please try again later.\nError:{e} "
         print(error_message)
         return error_message
 
 
-def get_user_input(vectordb: Chroma):
+def get_user_input(qa_session: "QASession"):
     """
-    Get user input and process it
-    :param vectordb: Chroma vector database
+    Get user input and process it. A question that failed is reported and the next one can be asked.
+    :param qa_session: QA session over the vector database
     """
     while True:
         user_input = input(f"\nYour question: ")
         if user_input.lower() == 'exit':
             break
         else:
-            error_message = process_input(user_input, vectordb)
-            if error_message is not None:
-                break
+            process_input(user_input, qa_session)
+
+
+def create_answer_cache(config: configparser.ConfigParser) -> Optional["AnswerCache"]:
+    """
+    Create the cache of answers to earlier questions from the [SETTINGS] of config.ini, or None when it is disabled.
+    :param config: parsed config.ini
+    :return: the answer cache
+    """
+    if not config.getboolean('SETTINGS', 'ANSWER_CACHE', fallback=True):
+        return None
+    from common.answer_cache import AnswerCache
+    return AnswerCache(similarity_threshold=config.getfloat('SETTINGS', 'ANSWER_CACHE_SIMILARITY', fallback=0.95),
+                       max_entries=config.getint('SETTINGS', 'ANSWER_CACHE_SIZE', fallback=1000),
+                       ttl=config.getfloat('SETTINGS', 'ANSWER_CACHE_TTL', fallback=24 * 3600),
+                       path=ANSWER_CACHE_FILE)
 
 
-def main():
+def create_qa_session(config: configparser.ConfigParser, vectordb_dir_path: str = "chroma_db",
+                      vector_store: str = "chroma", vectordb: Optional["VectorStore"] = None,
+                      resilient: Optional[ResilientClient] = None) -> "QASession":
     """
-    Our main function
+    Build the QA session over the vector database, with the answer cache and context settings of config.ini.
+    :param config: parsed config.ini
+    :param vectordb_dir_path: directory of the vector database
+    :param vector_store: "chroma" or "numpy"
+    :param vectordb: the vector database if it is open already, otherwise it is loaded from `vectordb_dir_path`
+    :param resilient: client retrying, hedging and cutting off the LLM calls, None for LangChain's own retries
+    :return: the QA session
     """
-    generate_pdf_summary()
-    vectordb = generate_pdf_embeddings()
-    get_user_input(vectordb)
+    from qa_session import CONTEXT_TOKENS, QASession
+    if vectordb is None:
+        vectordb = load_vectordb(vectordb_dir_path, vector_store=vector_store)
+    context_tokens = config.getint('SETTINGS', 'CONTEXT_TOKENS', fallback=CONTEXT_TOKENS)
+    min_similarity = config.getfloat('SETTINGS', 'MIN_SIMILARITY', fallback=0.0)
+    return QASession(vectordb, answer_cache=create_answer_cache(config), index_version=index_version(vectordb_dir_path),
+                     fetch_k=config.getint('SETTINGS', 'FETCH_K', fallback=20),
+                     context_tokens=context_tokens or None, min_similarity=min_similarity or None,
+                     resilient=resilient)
+
+
+class RemoteQASession:
+    """
+    Stands in for the QA session of a daemon started with `python pdf-qa-chat.py serve`: the questions are answered
+    by the daemon, which has the vector database and the LLM client loaded already.
+    """
+
+    def __init__(self, client: DaemonClient):
+        self.client = client
+        self.last_context: Optional[str] = None
+
+    def query(self, question: str) -> str:
+        response = self.client.request(question=question)
+        self.last_context = response["context"]
+        return response["answer"]
+
+
+def serve(config: configparser.ConfigParser, socket_path: str, vectordb_dir_path: str = "chroma_db",
+          vector_store: str = "chroma", resilient: Optional[ResilientClient] = None):
+    """
+    Run as a resident daemon: summarize and ingest the PDF files, build the QA session once and answer the questions
+    of the chats that connect to `socket_path`, until interrupted.
+    :param config: parsed config.ini
+    :param socket_path: Unix socket to listen on
+    :param vectordb_dir_path: directory of the vector database
+    :param vector_store: "chroma" or "numpy"
+    :param resilient: client retrying, hedging and cutting off the LLM calls
+    """
+    generate_pdf_summary(max_concurrency=config.getint('SETTINGS', 'SUMMARY_CONCURRENCY', fallback=4),
+                         resilient=resilient)
+    qa_session = create_qa_session(config, vectordb_dir_path, vector_store,
+                                   generate_pdf_embeddings(vectordb_dir_path, vector_store), resilient)
+    # The context shown with an answer is the session's last one, so the questions are answered one at a time
+    lock = threading.Lock()
+
+    def handle(request, state):
+        with lock:
+            with timed("request"):
+                answer = qa_session.query(request["question"])
+            context = qa_session.last_context
+        return {"answer": answer, "context": str(context) if context is not None else None}
+
+    serve_daemon(socket_path, handle)
+    print(f"Context: {qa_session.context_stats}")
+
+
+def main(config: configparser.ConfigParser):
+    """
+    Our main function. Run it with the 'ingest' argument to only bring the vector database up to date with the
+    PDF files and report what changed, or with 'serve' to run as a daemon that the chat hands its questions to.
+    The chat shows its prompt while the vector database and QA session load in the background, unless PDF files
+    need to be ingested first.
+    :param config: parsed config.ini
+    """
+    vector_store = config.get('SETTINGS', 'VECTOR_STORE', fallback='chroma')
+    vectordb_dir_path = VECTORDB_DIRS.get(vector_store, "chroma_db")
+    socket_path = config.get('SETTINGS', 'DAEMON_SOCKET', fallback='pdf-qa.sock')
+    metrics = configure_metrics_from_config(config)
+    # Retries, circuit breaker, deadline and hedging of the LLM calls, see the MAX_RETRIES, REQUEST_DEADLINE, ...
+    # settings
+    resilient = resilient_client_from_config(config)
+    try:
+        if len(sys.argv) > 1 and sys.argv[1] == 'ingest':
+            print(create_vectordb(vectordb_dir_path, vector_store=vector_store))
+            return
+        if len(sys.argv) > 1 and sys.argv[1] == 'serve':
+            serve(config, socket_path, vectordb_dir_path, vector_store, resilient)
+            return
+        client = connect_daemon(socket_path)
+        if client is not None:
+            print(f"\nConnected to the PDF QA daemon on {socket_path}")
+            try:
+                get_user_input(RemoteQASession(client))
+            finally:
+                client.close()
+            return
+        generate_pdf_summary(max_concurrency=config.getint('SETTINGS', 'SUMMARY_CONCURRENCY', fallback=4),
+                             resilient=resilient)
+        vectordb = None
+        if needs_ingest("papers", vectordb_dir_path, vector_store):
+            vectordb = generate_pdf_embeddings(vectordb_dir_path, vector_store)
+        qa_session = Deferred(lambda: create_qa_session(config, vectordb_dir_path, vector_store, vectordb, resilient),
+                              name="qa-session")
+        get_user_input(qa_session)
+        if qa_session.ready():
+            print(f"Context: {qa_session.context_stats}")
+            if qa_session.answer_cache is not None:
+                print(f"Answer cache: {qa_session.answer_cache.stats}")
+    finally:
+        finish_metrics(metrics)
 
 
 if __name__ == '__main__':
@@ -257,4 +308,4 @@ if __name__ == '__main__':
     config.read('config.ini')
     os.environ["OPENAI_API_KEY"] = config.get('API_KEYS', 'OPENAI_API_KEY')
 
-    main()
+    main(config)
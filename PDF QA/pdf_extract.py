@@ -0,0 +1,331 @@
+import os
+import queue
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pdfplumber
+from langchain.docstore.document import Document
+
+from common.chunking import TokenTextChunker
+from common.instrumentation import METRICS
+
+WHITESPACE = re.compile(r'\s+')
+
+
+def preprocess(text):
+    """
+    This function preprocesses the input text by replacing newlines with spaces and removing consecutive whitespaces
+    using regex.
+    :param text:
+    :return: text
+    """
+    return WHITESPACE.sub(' ', text)
+
+
+def extract_page_text(file_path: str, start_page: Optional[int] = 0, num_pages: Optional[int] = 3) -> str:
+    """
+    This function takes a PDF file path and extracts text from the specified page range.
+    It takes three parameters:
+    :param file_path:a string representing the file path of the PDF file
+    :param start_page:an optional integer representing the starting page number to extract text from. The default value is 0.
+    :param num_pages:an optional integer representing the number of pages to extract text from. The default value is 3.
+                     None extracts all the pages from start_page on.
+    :return:pdf text
+    """
+    with pdfplumber.open(file_path) as pdf:
+        pages_text = []
+        end_page = len(pdf.pages) if num_pages is None else start_page + num_pages
+        for page_number in range(start_page, end_page):
+            if page_number < len(pdf.pages):
+                page = pdf.pages[page_number]
+                text = preprocess(page.extract_text())
+                pages_text.append(text)
+        combined_text = ' '.join(pages_text)
+    return combined_text
+
+
+def extract_page_texts(file_paths: List[str], start_page: int = 0, num_pages: Optional[int] = 3,
+                       workers: Optional[int] = None) -> List[str]:
+    """
+    Run extract_page_text() over many PDFs on a pool of worker processes.
+    :param file_paths: PDF files to extract
+    :param start_page: first page to extract from every file
+    :param num_pages: number of pages to extract from every file, None for all
+    :param workers: number of worker processes. Defaults to the number of CPUs; 0 extracts in this process
+    :return: the text of every file, in the order of `file_paths`
+    """
+    workers = (os.cpu_count() or 1) if workers is None else workers
+    if workers == 0 or len(file_paths) < 2:
+        return [extract_page_text(file_path, start_page, num_pages) for file_path in file_paths]
+    with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as pool:
+        return list(pool.map(extract_page_text, file_paths,
+                             [start_page] * len(file_paths), [num_pages] * len(file_paths)))
+
+
+def count_pages(file_path: str) -> int:
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_page_range(file_path: str, start_page: int, end_page: int) -> Tuple[str, int, List[str], int, float]:
+    """
+    Worker task: extract the preprocessed text of pages [start_page, end_page) of a PDF.
+    :return: (file_path, start_page, page texts, worker pid, seconds spent)
+    """
+    started = time.perf_counter()
+    texts = []
+    with pdfplumber.open(file_path) as pdf:
+        for page_number in range(start_page, min(end_page, len(pdf.pages))):
+            page = pdf.pages[page_number]
+            texts.append(preprocess(page.extract_text() or ''))
+            # pdfplumber caches every parsed object of a page; drop them as soon as the text is out
+            page.flush_cache()
+    return file_path, start_page, texts, os.getpid(), time.perf_counter() - started
+
+
+@dataclass
+class ExtractionStats:
+    """
+    Pages extracted and busy time of every worker process.
+    """
+    pages: Dict[int, int] = field(default_factory=lambda: defaultdict(int))
+    seconds: Dict[int, float] = field(default_factory=lambda: defaultdict(float))
+    started: float = field(default_factory=time.perf_counter)
+    finished: Optional[float] = None
+
+    def record(self, pid: int, pages: int, seconds: float):
+        self.pages[pid] += pages
+        self.seconds[pid] += seconds
+
+    @property
+    def total_pages(self) -> int:
+        return sum(self.pages.values())
+
+    @property
+    def wall_time(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def pages_per_second(self) -> Dict[int, float]:
+        """
+        :return: pages per second of busy time, by worker pid
+        """
+        return {pid: self.pages[pid] / self.seconds[pid] if self.seconds[pid] else 0.0 for pid in self.pages}
+
+    def __str__(self):
+        per_worker = ", ".join(f"{rate:.1f}" for rate in self.pages_per_second().values())
+        wall = self.wall_time
+        return (f"{self.total_pages} pages in {wall:.1f}s ({self.total_pages / wall if wall else 0:.1f} pages/s) "
+                f"over {len(self.pages)} workers, pages/s per worker: {per_worker}")
+
+
+def split_document(file_path: str, page_texts: List[str], chunk_size: int = 256,
+                   chunk_overlap: int = 32) -> List[Document]:
+    """
+    Split the extracted pages of a PDF into chunks for embedding, on sentence boundaries (see TokenTextChunker).
+    :param file_path: path of the PDF, kept as the chunks' source
+    :param page_texts: text of every page, in order
+    :param chunk_size: maximum tokens per chunk
+    :param chunk_overlap: maximum tokens shared by consecutive chunks
+    :return: chunks as documents
+    """
+    chunker = TokenTextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return [Document(page_content=chunk, metadata={"source": file_path})
+            for chunk in chunker.iter_chunks(text + "\n\n" for text in page_texts)]
+
+
+def chunk_pages(file_path: str, page_texts: List[str], chunk_size: int,
+                chunk_overlap: int) -> Tuple[str, List[Document], float]:
+    """
+    Worker task: split_document() on the pages of a PDF once all of them are extracted.
+    :return: (file_path, chunks, seconds spent)
+    """
+    started = time.perf_counter()
+    chunks = split_document(file_path, page_texts, chunk_size, chunk_overlap)
+    return file_path, chunks, time.perf_counter() - started
+
+
+class _Closed(Exception):
+    """
+    Raised in the feeder thread of an ExtractionPipeline that was closed, to stop it.
+    """
+
+
+class ExtractionPipeline:
+    """
+    Parse PDFs on a pool of worker processes and stream the chunked files to the consumer through a bounded queue.
+
+    Every file is cut into tasks of `pages_per_task` pages, so a large PDF is spread over all the workers. Once all
+    the pages of a file are in, one more task splits them into chunks, so tokenizing does not hold up the feeder. A
+    feeder thread keeps at most `max_in_flight` extraction tasks submitted and puts every chunked file on a queue of
+    `queue_size` entries. When the consumer (e.g. the embedding stage) falls behind, the queue fills up, the feeder stops
+    submitting work and memory stays flat regardless of the size of the corpus.
+
+    When the consumer stops early, e.g. on an error, close() stops the feeder and shuts the pool down, cancelling
+    the tasks not started yet. The iteration closes the pipeline when it ends or is abandoned, and so does `with`:
+
+        with ExtractionPipeline(paths) as pipeline:
+            for file_path, chunks in pipeline:
+                ...
+    """
+
+    def __init__(self, file_paths: List[str], workers: Optional[int] = None, pages_per_task: int = 8,
+                 max_in_flight: Optional[int] = None, queue_size: int = 4, chunk_size: int = 256,
+                 chunk_overlap: int = 32):
+        """
+        :param file_paths: PDF files to extract
+        :param workers: number of worker processes. Defaults to the number of CPUs; 0 extracts in this process
+        :param pages_per_task: pages parsed by one task
+        :param max_in_flight: maximum number of submitted tasks. Defaults to twice the number of workers
+        :param queue_size: maximum number of extracted files waiting for the consumer
+        :param chunk_size: maximum tokens per chunk
+        :param chunk_overlap: maximum tokens shared by consecutive chunks
+        """
+        self.file_paths = list(dict.fromkeys(file_paths))
+        self.workers = (os.cpu_count() or 1) if workers is None else workers
+        self.pages_per_task = pages_per_task
+        self.max_in_flight = max_in_flight or 2 * max(1, self.workers)
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.stats = ExtractionStats()
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._done = object()
+        self._closed = threading.Event()
+        self._feeder: Optional[threading.Thread] = None
+
+    def _tasks(self) -> Iterator[Tuple[str, int, int, int]]:
+        # (file_path, start_page, end_page, number of tasks of the file)
+        for file_path in self.file_paths:
+            starts = range(0, max(count_pages(file_path), 1), self.pages_per_task)
+            for start in starts:
+                yield file_path, start, start + self.pages_per_task, len(starts)
+
+    def _put(self, item):
+        # Block while the queue is full, until the consumer takes an item or closes the pipeline
+        while True:
+            if self._closed.is_set():
+                raise _Closed()
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _collect(self, parts, total_tasks, result) -> Optional[Tuple[str, List[str]]]:
+        # Returns (file_path, page texts) when the result completes its file
+        file_path, start, texts, pid, seconds = result
+        self.stats.record(pid, len(texts), seconds)
+        # Measured in the worker process
+        METRICS.observe("pdf_extract", seconds)
+        parts[file_path][start] = texts
+        if len(parts[file_path]) < total_tasks[file_path]:
+            return None
+        pages = parts.pop(file_path)
+        return file_path, [text for start in sorted(pages) for text in pages[start]]
+
+    def _finish_file(self, result):
+        file_path, chunks, seconds = result
+        METRICS.observe("chunk", seconds)
+        self._put((file_path, chunks))
+
+    def _feed_inline(self):
+        parts, total_tasks = defaultdict(dict), {}
+        for file_path, start, end, tasks in self._tasks():
+            total_tasks[file_path] = tasks
+            finished = self._collect(parts, total_tasks, extract_page_range(file_path, start, end))
+            if finished is not None:
+                self._finish_file(chunk_pages(*finished, self.chunk_size, self.chunk_overlap))
+
+    def _feed_pool(self):
+        parts, total_tasks = defaultdict(dict), {}
+        tasks = self._tasks()
+        pending, chunking = set(), set()
+        pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            while True:
+                while len(pending) - len(chunking) < self.max_in_flight:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    file_path, start, end, total_tasks[file_path] = task
+                    pending.add(pool.submit(extract_page_range, file_path, start, end))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in chunking:
+                        chunking.discard(future)
+                        # Blocks while the consumer's queue is full, which holds back new submissions
+                        self._finish_file(future.result())
+                        continue
+                    finished = self._collect(parts, total_tasks, future.result())
+                    if finished is not None:
+                        chunk_task = pool.submit(chunk_pages, *finished, self.chunk_size, self.chunk_overlap)
+                        chunking.add(chunk_task)
+                        pending.add(chunk_task)
+        finally:
+            # After an error or close(), the tasks not started yet are not needed
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def _feed(self):
+        try:
+            if self.workers == 0:
+                self._feed_inline()
+            else:
+                self._feed_pool()
+            self._put(self._done)
+        except _Closed:
+            pass
+        except BaseException as e:
+            try:
+                self._put(e)
+            except _Closed:
+                pass
+        finally:
+            self.stats.finished = time.perf_counter()
+
+    def __iter__(self) -> Iterator[Tuple[str, List[Document]]]:
+        self.close()
+        self._closed.clear()
+        self.stats = ExtractionStats()
+        self._feeder = threading.Thread(target=self._feed, name="pdf-extraction", daemon=True)
+        self._feeder.start()
+        try:
+            while True:
+                item = self._queue.get()
+                if item is self._done:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop the feeder thread and the worker processes, and drop the extracted files nobody took. Waits for the
+        tasks already running on the workers.
+        """
+        self._closed.set()
+        while self._feeder is not None and self._feeder.is_alive():
+            self._drain()
+            self._feeder.join(timeout=0.1)
+        self._feeder = None
+        self._drain()
+
+    def _drain(self):
+        try:
+            while True:
+                self._queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def __enter__(self) -> "ExtractionPipeline":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,175 @@
+import asyncio
+import threading
+from typing import List, Optional, Tuple
+
+from langchain import OpenAI, PromptTemplate
+from langchain.chains import RetrievalQA
+from langchain.docstore.document import Document
+from langchain.schema import BaseLanguageModel
+from langchain.vectorstores import VectorStore
+
+from common.answer_cache import AnswerCache, document_keys
+from common.context_packing import ContextPacker, ContextStats, PackedContext, search_with_vectors
+from common.instrumentation import timed
+from common.resilience import ResilientClient, use_resilient_client
+from common.tokens import DEFAULT_MODEL, context_window, get_token_counter
+
+PROMPT_TEMPLATE = """
+    Use the following pieces of context to answer the question at the end.\n
+    If you don't know the answer, just say that you don't know, don't try to make up an answer.\n
+
+    {context}\n
+
+    Question: {question}\n
+    Answer:"""
+# Default maximum tokens of context per question: a handful of chunks. Filling the whole context window costs more
+# and is slower, and the least relevant chunks add little to the answer
+CONTEXT_TOKENS = 1500
+
+
+class QASession:
+    """
+    Question answering over a vector database, built once and reused for every question.
+    The prompt, the retriever, the LLM client and the RetrievalQA chain are created when the session is, so a
+    question only costs the retrieval and the LLM call. query() answers one question; aquery() and aquery_many()
+    answer several at the same time from an event loop.
+    The context of a question is packed rather than a fixed number of chunks: `fetch_k` candidates are retrieved and
+    a ContextPacker fills the prompt with the most relevant of them, skipping near-duplicates, up to what the LLM's
+    context window leaves after the prompt, the question and the answer, or `context_tokens` if lower. Chunks less
+    than `min_similarity` similar to the question are left out. The tokens used are kept in `last_context` and
+    `context_stats`.
+    With an AnswerCache, the question is embedded first and exact or near repeats of earlier questions asked
+    against the same `index_version` are answered from the cache, without retrieval or LLM call.
+    """
+
+    def __init__(self, vectordb: VectorStore, llm: Optional[BaseLanguageModel] = None, k: int = 2,
+                 max_concurrency: int = 8, answer_cache: Optional[AnswerCache] = None, index_version: str = "",
+                 fetch_k: int = 20, context_tokens: Optional[int] = CONTEXT_TOKENS,
+                 min_similarity: Optional[float] = None, packer: Optional[ContextPacker] = None,
+                 resilient: Optional[ResilientClient] = None):
+        """
+        :param vectordb: vector database holding the document chunks
+        :param llm: LLM answering the questions. Defaults to OpenAI with temperature 0 and 400 max tokens
+        :param k: number of chunks retrieved per question when the vector database has no embedding function to
+                  pack the context with
+        :param max_concurrency: maximum number of questions aquery_many() answers at once
+        :param answer_cache: cache of earlier answers, None to always ask the LLM
+        :param index_version: version of the vector database, see ingest.index_version()
+        :param fetch_k: number of candidate chunks retrieved per question for context packing
+        :param context_tokens: maximum tokens of context per question, None for all the LLM's window allows
+        :param min_similarity: minimum cosine similarity of a chunk to the question, None to keep every chunk. Used
+                               by the default packer
+        :param packer: context packer. Defaults to a ContextPacker for the LLM's model
+        :param resilient: client the requests of the LLM go through (see common.resilience), None for LangChain's
+                          own retries
+        """
+        self.vectordb = vectordb
+        self.prompt = PromptTemplate(template=PROMPT_TEMPLATE, input_variables=["context", "question"])
+        self.retriever = vectordb.as_retriever(search_type="similarity", search_kwargs={"k": k})
+        self.llm = llm if llm is not None else OpenAI(temperature=0, max_tokens=400)
+        if resilient is not None:
+            # Before the chain is built: it holds a copy of the LLM
+            use_resilient_client(self.llm, resilient)
+        self.chain = RetrievalQA.from_chain_type(self.llm,
+                                                 chain_type="stuff",
+                                                 retriever=self.retriever,
+                                                 chain_type_kwargs={"prompt": self.prompt})
+        self.k = k
+        self.max_concurrency = max_concurrency
+        self.answer_cache = answer_cache
+        self.index_version = index_version
+        self.embeddings = getattr(vectordb, "_embedding_function", None)
+        if answer_cache is not None and self.embeddings is None:
+            raise ValueError("The answer cache needs a vector database with an embedding function")
+        self.fetch_k = fetch_k
+        self.context_tokens = context_tokens
+        model = getattr(self.llm, "model_name", DEFAULT_MODEL)
+        self.packer = packer if packer is not None else ContextPacker(min_similarity=min_similarity, model=model)
+        self.count_tokens = get_token_counter(model)
+        # What the context window leaves for the context once the prompt and the answer are in
+        max_tokens = getattr(self.llm, "max_tokens", 0)
+        self._window = (context_window(model) - (max_tokens if max_tokens > 0 else 256)
+                        - self.count_tokens(self.prompt.format(context="", question="")))
+        self.context_stats = ContextStats()
+        self.last_context: Optional[PackedContext] = None
+        # Chroma's embedded database cannot serve two searches at once from different threads
+        self._search_lock = threading.Lock()
+
+    def context_budget(self, question: str) -> int:
+        """
+        :return: maximum tokens of context for the question
+        """
+        budget = self._window - self.count_tokens(question)
+        return max(0, min(budget, self.context_tokens) if self.context_tokens is not None else budget)
+
+    def query(self, question: str) -> str:
+        """
+        Answer a question from the documents.
+        :param question: the user's question
+        :return: the answer
+        """
+        embedding, cached, docs = self._retrieve(question)
+        if cached is not None:
+            return cached
+        answer = self.chain.combine_documents_chain.run(input_documents=docs, question=question)
+        if self.answer_cache is not None:
+            self._cache_answer(question, embedding, docs, answer)
+        return answer
+
+    def _retrieve(self, question: str) -> Tuple[Optional[List[float]], Optional[str], List[Document]]:
+        # (question embedding, cached answer, retrieved documents). The question is embedded outside the lock, so
+        # concurrent questions only queue up for the search itself. A question answered without packing, e.g. from
+        # the answer cache, has no context of its own: never report the previous question's
+        self.last_context = None
+        if self.embeddings is None:
+            with self._search_lock, timed("vector_search"):
+                return None, None, self.retriever.get_relevant_documents(question)
+        embedding = self.embeddings.embed_query(question)
+        if self.answer_cache is not None:
+            cached = self.answer_cache.lookup(question, embedding, self.index_version)
+            if cached is not None:
+                return embedding, cached.answer, []
+        with self._search_lock, timed("vector_search"):
+            candidates = search_with_vectors(self.vectordb, embedding, self.fetch_k)
+            if candidates is None:
+                docs = self.vectordb.similarity_search_by_vector(embedding, k=self.fetch_k)
+        if candidates is None:
+            # Other vector stores do not return the embeddings of their chunks
+            candidates = list(zip(docs, self.embeddings.embed_documents([doc.page_content for doc in docs])))
+        context = self.packer.pack([doc for doc, _ in candidates], [vector for _, vector in candidates], embedding,
+                                   self.context_budget(question))
+        self.context_stats.record(context)
+        self.last_context = context
+        return embedding, None, context.documents
+
+    def _cache_answer(self, question: str, embedding: List[float], docs: List[Document], answer: str):
+        self.answer_cache.put(question, embedding, document_keys(docs), answer, self.index_version)
+
+    async def aquery(self, question: str) -> str:
+        """
+        Answer a question without blocking the event loop. The similarity search runs in the loop's executor and the
+        LLM is called asynchronously.
+        :param question: the user's question
+        :return: the answer
+        """
+        embedding, cached, docs = await asyncio.get_running_loop().run_in_executor(None, self._retrieve, question)
+        if cached is not None:
+            return cached
+        answer = await self.chain.combine_documents_chain.arun(input_documents=docs, question=question)
+        if self.answer_cache is not None:
+            self._cache_answer(question, embedding, docs, answer)
+        return answer
+
+    async def aquery_many(self, questions: List[str]) -> List[str]:
+        """
+        Answer several questions concurrently, at most `max_concurrency` at a time.
+        :param questions: the questions
+        :return: the answers, in the order of the questions
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def bounded(question: str) -> str:
+            async with semaphore:
+                return await self.aquery(question)
+
+        return await asyncio.gather(*(bounded(question) for question in questions))
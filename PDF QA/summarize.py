@@ -0,0 +1,251 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from common.instrumentation import timed
+from common.resilience import ResilientClient, use_resilient_client
+from ingest import file_sha256
+
+# LangChain and pdfplumber are only imported once there is something to summarize
+if TYPE_CHECKING:
+    from langchain.chains import LLMChain
+    from langchain.schema import BaseLanguageModel
+
+SUMMARY_PROMPT_TEMPLATE = """
+                        Write a concise summary of the following in passive voice no more than 150 words.\n
+                        Example of a passive voice sentence: The package was delivered by the courier to the recipient's address.\n
+                        Include key details such as the main findings and implications of the text.\n
+
+                        {text}\n
+
+                        Example response:\n
+                        A pipeline was proposed to generate a high-quality multi-turn chat corpus using ChatGPT to converse with itself. The resulting Baize model demonstrated good performance in multi-turn dialogues with guardrails that minimize potential risks. Baize model and data were released for research purposes only."""
+
+MAP_PROMPT_TEMPLATE = """
+                        Write a concise summary of the following part of a longer document.\n
+                        Keep the main findings, methods and numbers.\n
+
+                        {text}\n
+
+                        Concise summary:"""
+
+
+@dataclass
+class SummaryStats:
+    """
+    Counts of one summarization run.
+    """
+    files: int = 0
+    summarized: int = 0
+    resumed: int = 0
+    failed: int = 0
+    chunks: int = 0
+    llm_calls: int = 0
+    seconds: float = 0.0
+
+    def __str__(self):
+        return (f"{self.files} files: {self.summarized} summarized, {self.resumed} resumed from the checkpoint, "
+                f"{self.failed} failed ({self.chunks} chunks, {self.llm_calls} LLM calls in {self.seconds:.1f}s)")
+
+
+class SummaryCheckpoint:
+    """
+    Summaries of PDF files keyed by the SHA-256 of the file's content, kept in a JSON file as an array of
+    {"file_name", "sha256", "summary"} objects.
+    The file is rewritten after every finished summary, so an interrupted run keeps the summaries it finished and the
+    next run only summarizes the rest. A summary is only reused while its file's hash matches; summaries without a
+    hash, written by older versions, are redone.
+    """
+
+    def __init__(self, path: str = "summaries.json"):
+        """
+        :param path: JSON file of the summaries
+        """
+        self.path = path
+        self.entries: Dict[str, Dict[str, str]] = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.entries = {entry["file_name"]: entry for entry in json.load(f)}
+
+    def get(self, file_name: str, sha256: str) -> Optional[str]:
+        """
+        :return: the summary of the file if it was made from the same content, otherwise None
+        """
+        entry = self.entries.get(file_name)
+        return entry["summary"] if entry is not None and entry.get("sha256") == sha256 else None
+
+    def current(self, file_paths: List[str]) -> Optional[Dict[str, str]]:
+        """
+        :param file_paths: PDF files
+        :return: the summaries of all the files by file name, when every file has one made from its current content,
+                 otherwise None
+        """
+        summaries = {}
+        for file_path in file_paths:
+            file_name = os.path.basename(file_path)
+            summary = self.get(file_name, file_sha256(file_path)) if file_name in self.entries else None
+            if summary is None:
+                return None
+            summaries[file_name] = summary
+        return summaries
+
+    def put(self, file_name: str, sha256: str, summary: str):
+        self.entries[file_name] = {"file_name": file_name, "sha256": sha256, "summary": summary}
+        self.save()
+
+    def prune(self, file_names: List[str]):
+        """
+        Drop the summaries of the files that are not in `file_names` anymore.
+        """
+        removed = set(self.entries) - set(file_names)
+        for file_name in removed:
+            del self.entries[file_name]
+        if removed:
+            self.save()
+
+    def save(self):
+        # Write to a temporary file first, so a crash never leaves a half-written file behind
+        with open(self.path + ".tmp", "w") as f:
+            json.dump([self.entries[file_name] for file_name in sorted(self.entries)], f, indent=2)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class PDFSummarizer:
+    """
+    Map-reduce summarization of whole PDF files.
+
+    The text of a file is split into chunks of `chunk_size` tokens and every chunk is summarized on its own
+    (map). The chunk summaries are then combined into the final summary (reduce); when they are longer than
+    `token_max` tokens, they are first combined in groups that fit, as many times as needed. A file of one chunk is
+    summarized in a single call.
+
+    All the LLM calls of all the files run concurrently, at most `max_concurrency` at a time, and the files are
+    extracted in worker processes while earlier files are being summarized.
+    """
+
+    def __init__(self, llm: Optional["BaseLanguageModel"] = None, chunk_size: int = 1000, chunk_overlap: int = 100,
+                 token_max: int = 3000, max_concurrency: int = 4, resilient: Optional[ResilientClient] = None):
+        """
+        :param llm: LLM writing the summaries. Defaults to OpenAI with temperature 0 and 300 max tokens
+        :param chunk_size: maximum tokens per chunk
+        :param chunk_overlap: maximum tokens shared by consecutive chunks
+        :param token_max: maximum number of tokens of summaries combined in one call
+        :param max_concurrency: maximum number of LLM calls at once
+        :param resilient: client the requests of the LLM go through (see common.resilience), None for LangChain's
+                          own retries
+        """
+        from langchain import OpenAI, PromptTemplate
+        from langchain.chains import LLMChain
+
+        from common.chunking import TokenTextChunker
+
+        self.llm = llm if llm is not None else OpenAI(temperature=0, max_tokens=300)
+        if resilient is not None:
+            # Before the chains are built: they hold copies of the LLM
+            use_resilient_client(self.llm, resilient)
+        self.map_chain = LLMChain(llm=self.llm, prompt=PromptTemplate(template=MAP_PROMPT_TEMPLATE,
+                                                                      input_variables=["text"]))
+        self.summary_chain = LLMChain(llm=self.llm, prompt=PromptTemplate(template=SUMMARY_PROMPT_TEMPLATE,
+                                                                          input_variables=["text"]))
+        self.chunker = TokenTextChunker(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.token_max = token_max
+        self.max_concurrency = max_concurrency
+        self.stats = SummaryStats()
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def _run(self, chain: "LLMChain", text: str) -> str:
+        async with self._semaphore:
+            self.stats.llm_calls += 1
+            return (await chain.arun(text=text)).strip()
+
+    def _groups(self, summaries: List[str]) -> List[List[str]]:
+        # Consecutive summaries in groups of at most token_max tokens, at least two per group so every round shrinks
+        groups, group, tokens = [], [], 0
+        for summary in summaries:
+            summary_tokens = self.chunker.count_tokens(summary)
+            if len(group) > 1 and tokens + summary_tokens > self.token_max:
+                groups.append(group)
+                group, tokens = [], 0
+            group.append(summary)
+            tokens += summary_tokens
+        return groups + [group]
+
+    async def asummarize_text(self, text: str) -> str:
+        """
+        Summarize a text of any length with map-reduce.
+        :param text: the text
+        :return: the summary
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        with timed("chunk"):
+            chunks = self.chunker.split_text(text)
+        self.stats.chunks += len(chunks)
+        if len(chunks) <= 1:
+            return await self._run(self.summary_chain, text)
+        summaries = await asyncio.gather(*(self._run(self.map_chain, chunk) for chunk in chunks))
+        while len(summaries) > 1 and self.chunker.count_tokens("\n\n".join(summaries)) > self.token_max:
+            summaries = await asyncio.gather(*(self._run(self.map_chain, "\n\n".join(group))
+                                               for group in self._groups(summaries)))
+        return await self._run(self.summary_chain, "\n\n".join(summaries))
+
+    async def asummarize_files(self, file_paths: List[str], checkpoint: SummaryCheckpoint,
+                               workers: Optional[int] = None) -> Dict[str, str]:
+        """
+        Summarize PDF files, reusing the summaries in the checkpoint of the files that did not change and saving
+        every new summary to it as soon as it is done. A file that fails is reported and left out; the next run
+        tries it again.
+        :param file_paths: PDF files to summarize
+        :param checkpoint: summaries of earlier runs, updated in place
+        :param workers: number of processes extracting the PDFs. Defaults to the number of CPUs; 0 extracts in a
+                        thread of this process
+        :return: summary of every file that has one, by file name
+        """
+        from pdf_extract import extract_page_text
+
+        started = time.perf_counter()
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        file_names = [os.path.basename(file_path) for file_path in file_paths]
+        checkpoint.prune(file_names)
+        loop = asyncio.get_running_loop()
+        hashes = await asyncio.gather(*(loop.run_in_executor(None, file_sha256, file_path)
+                                        for file_path in file_paths))
+        pending = [(file_path, file_name, sha256) for file_path, file_name, sha256
+                   in zip(file_paths, file_names, hashes) if checkpoint.get(file_name, sha256) is None]
+        self.stats.files += len(file_paths)
+        self.stats.resumed += len(file_paths) - len(pending)
+
+        workers = (os.cpu_count() or 1) if workers is None else workers
+        pool: Optional[Executor] = None
+        if workers > 0 and len(pending) > 1:
+            pool = ProcessPoolExecutor(max_workers=min(workers, len(pending)))
+
+        async def summarize(file_path: str, file_name: str, sha256: str):
+            try:
+                with timed("pdf_extract"):
+                    text = await loop.run_in_executor(pool, extract_page_text, file_path, 0, None)
+                checkpoint.put(file_name, sha256, await self.asummarize_text(text))
+                self.stats.summarized += 1
+            except Exception as e:
+                self.stats.failed += 1
+                print(f"Could not summarize {file_name}: {e}")
+
+        try:
+            await asyncio.gather(*(summarize(*file) for file in pending))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            self.stats.seconds += time.perf_counter() - started
+        summaries = {file_name: checkpoint.get(file_name, sha256) for file_name, sha256 in zip(file_names, hashes)}
+        return {file_name: summary for file_name, summary in summaries.items() if summary is not None}
+
+    def summarize_files(self, file_paths: List[str], checkpoint: SummaryCheckpoint,
+                        workers: Optional[int] = None) -> Dict[str, str]:
+        """
+        Blocking version of asummarize_files().
+        """
+        return asyncio.run(self.asummarize_files(file_paths, checkpoint, workers))
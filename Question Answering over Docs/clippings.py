@@ -0,0 +1,97 @@
+import hashlib
+import re
+from datetime import datetime
+from typing import Iterator, List, Optional
+
+from langchain.docstore.document import Document
+
+# Parser for the "My Clippings.txt" file of a Kindle. Every clipping is a record ending with a line of ten '=':
+#
+#   The Right It (Savoia, Alberto)
+#   - Your Highlight on page 14 | Location 252-253 | Added on Thursday, October 14, 2021 8:35:09 PM
+#
+#   When it comes to bringing new product ideas to market, failure is the most likely outcome.
+#   ==========
+
+SEPARATOR = "=========="
+TITLE_AUTHOR = re.compile(r'^(?P<title>.*?)\s*\((?P<author>[^()]*)\)\s*$')
+KIND = re.compile(r'^-\s*Your (?P<kind>\w+)', re.IGNORECASE)
+PAGE = re.compile(r'\bpage (?P<page>[\w-]+)', re.IGNORECASE)
+LOCATION = re.compile(r'\blocation (?P<location>[\d-]+)', re.IGNORECASE)
+ADDED = re.compile(r'Added on (?P<added>.+)$', re.IGNORECASE)
+
+
+def parse_added(value: str) -> str:
+    """
+    Convert the "Added on" date of a clipping to ISO 8601, or return it unchanged if it is in another format.
+    """
+    try:
+        return datetime.strptime(value.strip(), "%A, %B %d, %Y %I:%M:%S %p").isoformat()
+    except ValueError:
+        return value.strip()
+
+
+def parse_clipping(record: str) -> Optional[Document]:
+    """
+    Parse one clipping record into a document holding the clipping's text and its metadata: title, author, kind
+    (highlight or note), page, location and date. Fields missing from the record are left out of the metadata.
+    :param record: lines of one record, without the separator
+    :return: the document, or None for records without text (bookmarks)
+    """
+    lines = [line.strip() for line in record.strip().splitlines()]
+    if len(lines) < 3:
+        return None
+    text = " ".join(line for line in lines[2:] if line)
+    if not text:
+        return None
+
+    metadata = {}
+    match = TITLE_AUTHOR.match(lines[0])
+    if match:
+        metadata["title"], metadata["author"] = match.group("title"), match.group("author")
+    else:
+        metadata["title"] = lines[0]
+    fields = lines[1].split("|")
+    match = KIND.match(fields[0])
+    if match:
+        metadata["kind"] = match.group("kind").lower()
+    for field in fields:
+        for pattern, key in ((PAGE, "page"), (LOCATION, "location")):
+            match = pattern.search(field)
+            if match:
+                metadata[key] = match.group(key)
+        match = ADDED.search(field)
+        if match:
+            metadata["added"] = parse_added(match.group("added"))
+    metadata["id"] = hashlib.sha256(f"{lines[0]}\0{text}".encode("utf-8")).hexdigest()[:16]
+    return Document(page_content=text, metadata=metadata)
+
+
+def iter_clippings(path: str) -> Iterator[Document]:
+    """
+    Stream the clippings of a Kindle clippings file as documents, one per highlight or note.
+    The Kindle appends a new record when a highlight is changed, so repeated clippings of the same text in the same
+    book are only returned once.
+    :param path: path of "My Clippings.txt"
+    :return: iterator over the documents
+    """
+    seen = set()
+    record = []
+    # utf-8-sig drops the byte order mark the Kindle writes at the start of the file
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in f:
+            if line.strip() != SEPARATOR:
+                record.append(line)
+                continue
+            document = parse_clipping("".join(record))
+            record = []
+            if document is not None and document.metadata["id"] not in seen:
+                seen.add(document.metadata["id"])
+                yield document
+
+
+def load_clippings(path: str) -> List[Document]:
+    """
+    Load all the clippings of a Kindle clippings file. See iter_clippings().
+    """
+    return list(iter_clippings(path))
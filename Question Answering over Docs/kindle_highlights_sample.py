@@ -1,37 +1,93 @@
 from langchain import OpenAI
 from langchain.chains import RetrievalQA
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.vectorstores import Chroma
-from langchain.document_loaders import TextLoader
+import hashlib
 import os
+import shutil
+import sys
 
-os.environ["OPENAI_API_KEY"] = ''
-vectordb_directory = 'db'
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.answer_cache import AnswerCache, document_keys
+from common.context_packing import ContextPacker, PackingRetriever
+from common.embeddings import CachedEmbeddings
+from common.hybrid_retrieval import HybridRetriever
+from common.instrumentation import configure_metrics, finish_metrics, timed
+from common.resilience import ResilientClient, use_resilient_client
+from common.startup import Deferred
+from common.vectorstore import MemmapVectorStore
+from clippings import load_clippings
 
-# initialize the embeddings
-embeddings = OpenAIEmbeddings()
+# paste your OpenAI key here, or set it in the environment
+os.environ.setdefault("OPENAI_API_KEY", '')
+# set to True to keep the index in the local memory-mapped NumPy store instead of
+# Chroma: it opens faster and has fewer dependencies
+use_numpy_index = False
+vectordb_directory = 'highlights_numpy_db' if use_numpy_index else 'highlights_db'
+# a hash of the ids of the highlights in the index, saved next to it so a changed
+# clippings file is noticed without loading the index
+index_version_file = os.path.join(vectordb_directory, 'index_version')
+# set to 'json' to append the timings of every stage (embed, vector_search, llm) and
+# the token counts to metrics.jsonl, or to 'prometheus' to serve them on port 9100.
+# The METRICS environment variable sets it too
+metrics = configure_metrics(os.environ.get('METRICS', 'off'))
 
-# check if we have a local index saved to disk
-if not os.path.exists(vectordb_directory):
+# initialize the embeddings, behind an on-disk cache so that repeated highlights
+# and rebuilds of the index do not embed the same text twice
+embeddings = CachedEmbeddings.from_path(OpenAIEmbeddings(), 'embedding_cache.sqlite')
+
+
+def index_version_of(ids):
+    # any highlight added, removed or edited changes the version, even when the
+    # number of highlights stays the same
+    return hashlib.sha256("\n".join(sorted(ids)).encode("utf-8")).hexdigest()
+
+
+# parse the clippings file into one document per highlight or note, with the book,
+# author, page, location and date as metadata. This is fast, and the keyword index
+# below is built from these documents on every run
+docs = load_clippings('My Clippings.txt')
+
+# the version of the index these highlights need, and the version of the one saved
+# to disk, if any
+index_version = index_version_of(doc.metadata['id'] for doc in docs)
+saved_version = None
+if os.path.exists(index_version_file):
+    with open(index_version_file) as f:
+        saved_version = f.read().strip()
+
+# build the index when there is none, or when the clippings changed since it was
+# built: the keyword index and the answer cache must see the same highlights as the
+# vector index. A new version also drops the cached answers. Highlights embedded
+# before come from the embedding cache, so only new ones cost API calls
+if saved_version != index_version:
+    if os.path.exists(vectordb_directory):
+        print("The clippings changed, rebuild the index")
+        shutil.rmtree(vectordb_directory)
     # create and save the index from the docs to the disk
     print("Save the index to the disk")
-
-    # load the text file from disk, split the file into chunks 
-    # and create indexes from embeddings
-    loader = TextLoader('My Clippings.txt')
-    doc = loader.load()
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000)
-    docs = text_splitter.split_documents(doc)
-    vectordb = Chroma.from_documents(docs,
-                                     embeddings,
-                                     persist_directory=vectordb_directory)
+    vector_store_class = MemmapVectorStore if use_numpy_index else Chroma
+    vectordb = vector_store_class.from_documents(docs,
+                                                 embeddings,
+                                                 ids=[doc.metadata['id'] for doc in docs],
+                                                 persist_directory=vectordb_directory)
+    print(f"Embedded {embeddings.stats}")
+    with open(index_version_file, 'w') as f:
+        f.write(index_version)
 else:
-    # load the saved index from the disk
+    # load the saved index from the disk the first time it is searched. Opening Chroma
+    # takes most of a second, and a question answered from the answer cache, or by
+    # keyword search alone like ours, never searches it
     print("Loading the index from the disk")
-    vectordb = Chroma(persist_directory=vectordb_directory,
+
+    def open_index():
+        if use_numpy_index:
+            return MemmapVectorStore(vectordb_directory, embeddings)
+        return Chroma(persist_directory=vectordb_directory,
                       embedding_function=embeddings)
 
+    vectordb = Deferred(open_index, background=False)
+
 # create our query
 query = "what did marty cagan say about product management?"
 
@@ -39,9 +95,41 @@ query = "what did marty cagan say about product management?"
 if not vectordb:
     print("Something is wrong, cannot load index!")
 else:
-    # ask the query to OpenAI with our index
-    qa = RetrievalQA.from_chain_type(llm=OpenAI(model_name="text-davinci-003"),
-                                     chain_type="stuff",
-                                     retriever=vectordb.as_retriever())
-    response = qa.run(query)
-    print(response)
+    # keyword (BM25) search fused with vector search. A query naming an author or a
+    # book, like ours, is answered from that author's or book's highlights by keyword
+    # search alone, without embedding the query
+    hybrid_retriever = HybridRetriever(docs, vectordb, k=20)
+    metadata_filter = hybrid_retriever.metadata_filter(query)
+    if metadata_filter:
+        print(f"Searching the highlights of {metadata_filter}")
+    # of the 20 best highlights, the most relevant ones that are not near-duplicates
+    # of each other go into the prompt, up to 1500 tokens. That leaves room in
+    # text-davinci-003's context window for the prompt, the question and the answer
+    retriever = PackingRetriever(hybrid_retriever, ContextPacker(token_budget=1500), embeddings,
+                                 embed_query=not metadata_filter)
+
+    # answers to earlier questions are kept on disk; an exact or near repeat of one
+    # is answered without retrieval or LLM call. The index is only ever built from
+    # scratch, so the hash of its highlights' ids (index_version) tells its versions apart
+    answer_cache = AnswerCache(path='answer_cache.sqlite')
+    with timed("request"):
+        query_embedding = None if metadata_filter else embeddings.embed_query(query)
+        cached = answer_cache.lookup(query, query_embedding, index_version)
+        if cached is not None:
+            print(cached.answer)
+        else:
+            # ask the query to OpenAI with our index. Rate limits, server errors and timeouts
+            # are retried with backoff, within a 60 second deadline
+            llm = use_resilient_client(OpenAI(model_name="text-davinci-003"), ResilientClient(deadline=60))
+            qa = RetrievalQA.from_chain_type(llm=llm,
+                                             chain_type="stuff",
+                                             retriever=retriever,
+                                             return_source_documents=True)
+            result = qa({"query": query})
+            response = result["result"]
+            print(f"({retriever.last_context})")
+            answer_cache.put(query, query_embedding, document_keys(result["source_documents"]), response,
+                             index_version)
+            print(response)
+    print(f"Answer cache: {answer_cache.stats}")
+finish_metrics(metrics)
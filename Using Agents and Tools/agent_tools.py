@@ -0,0 +1,177 @@
+import re
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, List, Optional, Sequence, Tuple, Union
+
+from langchain import LLMChain, OpenAI, PromptTemplate
+from langchain.agents import AgentExecutor, AgentOutputParser, Tool, ZeroShotAgent
+from langchain.agents.mrkl.prompt import FORMAT_INSTRUCTIONS
+from langchain.schema import AgentAction, AgentFinish, BaseLanguageModel, OutputParserException
+from langchain.tools import BaseTool
+from pydantic import Field
+
+from date_rules import long_date, parse_relative_date
+
+DATE_PROMPT = PromptTemplate(template='Today is {date_today}. Answer the following in Long Date format: {input}',
+                             input_variables=['date_today', 'input'])
+
+
+@dataclass
+class DateParserStats:
+    """
+    How the Date Parser answered: locally with the rules or with the LLM.
+    """
+    fast_path: int = 0
+    llm_calls: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.fast_path + self.llm_calls
+        return self.fast_path / total if total else 0.0
+
+    def __str__(self):
+        return (f"{self.fast_path + self.llm_calls} dates: {self.fast_path} parsed locally, {self.llm_calls} by the LLM "
+                f"(fast-path hit rate {self.hit_rate:.0%})")
+
+
+class DateParserTool(BaseTool):
+    """
+    Custom Tool by subclassing the BaseTool class.
+    DateParserTool constructs another OpenAI call with the date context.
+    This is a great example of how you can inject context into OpenAI through chaining.
+    The chain and its OpenAI client are created once with the tool and reused by every call, synchronous (_run) or
+    asynchronous (_arun).
+    Common expressions ("today", "in a month", "next Friday", "May 18, 2023") are resolved locally by the rules in
+    date_rules.py; the LLM only gets the inputs they do not cover. `stats` counts both.
+    """
+    name = 'Date Parser'
+    description = 'Useful to infer dates from natural language strings.'
+    llm_chain: LLMChain
+    stats: DateParserStats = Field(default_factory=DateParserStats)
+
+    def __init__(self, llm: Optional[BaseLanguageModel] = None, **kwargs: Any):
+        """
+        :param llm: LLM answering with the date context. Defaults to OpenAI with temperature 0.3 and 100 max tokens
+        """
+        llm = llm if llm is not None else OpenAI(temperature=0.3, max_tokens=100)
+        super().__init__(llm_chain=LLMChain(prompt=DATE_PROMPT, llm=llm, verbose=True), **kwargs)
+
+    def _fast_path(self, tool_input: str) -> Optional[str]:
+        parsed = parse_relative_date(tool_input, date.today())
+        if parsed is None:
+            self.stats.llm_calls += 1
+            return None
+        self.stats.fast_path += 1
+        return long_date(parsed)
+
+    def _run(self, tool_input: str) -> str:
+        answer = self._fast_path(tool_input)
+        return answer if answer is not None else self.llm_chain.run(date_today=date.today(), input=tool_input)
+
+    async def _arun(self, tool_input: str) -> str:
+        answer = self._fast_path(tool_input)
+        if answer is not None:
+            return answer
+        return await self.llm_chain.arun(date_today=date.today(), input=tool_input)
+
+
+def search_tool(search: Any) -> Tool:
+    """
+    Wrap a search client in a tool that is usable from both the synchronous and the asynchronous agent.
+    :param search: object with run(query) and async arun(query) methods, e.g. a SerpAPIWrapper. Give SerpAPIWrapper
+                   an `aiosession` to reuse one HTTP session for all the asynchronous searches
+    :return: the Search tool
+    """
+    return Tool(name='Search', description='Useful if you want to search internet.', func=search.run,
+                coroutine=search.arun)
+
+
+PARALLEL_FORMAT_INSTRUCTIONS = FORMAT_INSTRUCTIONS.replace(
+    "... (this Thought/Action/Action Input/Observation can repeat N times)",
+    "... (this Thought/Action/Action Input/Observation can repeat N times)\n"
+    "When several actions do not depend on each other's results, take them at once by numbering them, "
+    "before any Observation:\n"
+    "Action 1: the first action\n"
+    "Action Input 1: the input to the first action\n"
+    "Action 2: the second action\n"
+    "Action Input 2: the input to the second action\n"
+    "Observation 1: the result of the first action\n"
+    "Observation 2: the result of the second action")
+
+ACTION = re.compile(r"Action\s*(\d*)\s*:(.*?)\nAction\s*\d*\s*Input\s*\d*\s*:[\s]*(.*?)(?=\nAction\s*\d*\s*:|\Z)",
+                    re.DOTALL)
+
+
+class ParallelActionOutputParser(AgentOutputParser):
+    """
+    Parse a ReAct step that may hold several numbered actions. One action is returned as an AgentAction, several as a
+    list, which the AgentExecutor runs concurrently in async mode. Only the first action of a step carries the LLM
+    output as its log, so the scratchpad shows it once.
+    """
+
+    def get_format_instructions(self) -> str:
+        return PARALLEL_FORMAT_INSTRUCTIONS
+
+    def parse(self, text: str) -> Union[AgentAction, List[AgentAction], AgentFinish]:
+        if "Final Answer:" in text:
+            return AgentFinish({"output": text.split("Final Answer:")[-1].strip()}, text)
+        matches = ACTION.findall(text)
+        if not matches:
+            raise OutputParserException(f"Could not parse LLM output: `{text}`")
+        actions = [AgentAction(tool.strip(), tool_input.strip().strip('"'), text if index == 0 else "")
+                   for index, (_, tool, tool_input) in enumerate(matches)]
+        return actions[0] if len(actions) == 1 else actions
+
+
+class ParallelReActAgent(ZeroShotAgent):
+    """
+    Zero-shot ReAct agent that can ask for several independent tool calls in one step, e.g. a date and a search that
+    does not need it. Run it with AgentExecutor.arun() to execute them concurrently; the synchronous run() executes
+    them one after the other.
+    """
+
+    @property
+    def _stop(self) -> List[str]:
+        # Also stop before numbered observations
+        prefix = self.observation_prefix.rstrip().rstrip(':')
+        return [f"\n{prefix}", f"\n\t{prefix}"]
+
+    @classmethod
+    def _get_default_output_parser(cls, **kwargs: Any) -> AgentOutputParser:
+        return ParallelActionOutputParser()
+
+    @classmethod
+    def from_llm_and_tools(cls, llm: BaseLanguageModel, tools: Sequence[BaseTool],
+                           format_instructions: str = PARALLEL_FORMAT_INSTRUCTIONS,
+                           **kwargs: Any) -> "ParallelReActAgent":
+        return super().from_llm_and_tools(llm, tools, format_instructions=format_instructions, **kwargs)
+
+    def _construct_scratchpad(self, intermediate_steps: List[Tuple[AgentAction, str]]) -> str:
+        # The actions of one step share its log; their observations are numbered like them
+        thoughts = ""
+        number = 0
+        for index, (action, observation) in enumerate(intermediate_steps):
+            last_of_step = index + 1 == len(intermediate_steps) or bool(intermediate_steps[index + 1][0].log)
+            if action.log:
+                thoughts += action.log
+                number = 0
+            number += 1
+            if number == 1 and last_of_step:
+                thoughts += f"\n{self.observation_prefix}{observation}"
+            else:
+                thoughts += f"\n{self.observation_prefix.rstrip().rstrip(':')} {number}: {observation}"
+            if last_of_step:
+                thoughts += f"\n{self.llm_prefix}"
+        return thoughts
+
+
+def create_agent(llm: BaseLanguageModel, tools: Sequence[BaseTool], verbose: bool = True) -> AgentExecutor:
+    """
+    Agent executor over a ParallelReActAgent.
+    :param llm: LLM driving the agent
+    :param tools: tools the agent can use
+    :param verbose: print the agent's steps
+    :return: the executor, run it with arun() to execute independent tool calls concurrently
+    """
+    agent = ParallelReActAgent.from_llm_and_tools(llm, tools)
+    return AgentExecutor.from_agent_and_tools(agent=agent, tools=tools, verbose=verbose)
@@ -0,0 +1,124 @@
+import calendar
+import re
+from datetime import date, datetime, timedelta
+from typing import Optional
+
+# Rule-based resolution of the relative dates the agent asks the Date Parser about most ("today", "in a month",
+# "next Friday", "3 weeks ago", "May 18, 2023"). Only inputs that are entirely one of these expressions are resolved;
+# anything else returns None and is left to the LLM.
+
+NUMBERS = {"a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8,
+           "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "couple of": 2, "a couple of": 2}
+WEEKDAYS = {name.lower(): index for index, name in enumerate(calendar.day_name)}
+MONTHS = {name.lower(): index for index, name in enumerate(calendar.month_name) if name}
+MONTHS.update({name.lower(): index for index, name in enumerate(calendar.month_abbr) if name})
+DAY_OFFSETS = {"today": 0, "today's date": 0, "now": 0, "tonight": 0, "tomorrow": 1, "yesterday": -1, "the day after tomorrow": 2,
+               "day after tomorrow": 2, "the day before yesterday": -2, "day before yesterday": -2}
+
+NUMBER = r"(?P<count>\d+|" + "|".join(sorted(map(re.escape, NUMBERS), key=len, reverse=True)) + ")"
+UNIT = r"(?P<unit>day|week|fortnight|month|year)s?"
+WEEKDAY = r"(?P<weekday>" + "|".join(WEEKDAYS) + ")"
+MONTH = r"(?P<month>" + "|".join(sorted(MONTHS, key=len, reverse=True)) + r")\.?"
+FROM_NOW = r"(?:from (?:now|today)|later|after today|from this day)"
+
+# Filler around the expression: "what is the date", "what date is it", "the date of", trailing punctuation
+FILLER = re.compile(r"^(?:(?:what|which) (?:is|was|will be) (?:the )?(?:date|day)(?: (?:of|for))?|(?:what|which) "
+                    r"(?:date|day) (?:is|was|will be)(?: it)?|(?:the )?date(?: (?:of|for|is|will be))?)\s*"
+                    r"|\s*(?:in long date format)?\s*[?.!]*$")
+WHITESPACE = re.compile(r"\s+")
+
+PATTERNS = [
+    ("offset_future", re.compile(rf"(?:in|after) {NUMBER} {UNIT}(?: {FROM_NOW})?")),
+    ("offset_future", re.compile(rf"{NUMBER} {UNIT} {FROM_NOW}")),
+    ("offset_past", re.compile(rf"{NUMBER} {UNIT} (?:ago|before today|back)")),
+    ("relative_weekday", re.compile(rf"(?P<which>next|last|this|coming|this coming|on|previous)? ?{WEEKDAY}")),
+    ("relative_period", re.compile(r"(?P<which>next|last|previous) (?P<unit>week|month|year)")),
+    ("iso", re.compile(r"(?P<year>\d{4})-(?P<month>\d{1,2})-(?P<day>\d{1,2})")),
+    ("month_day", re.compile(rf"(?:on )?{MONTH} (?P<day>\d{{1,2}})(?:st|nd|rd|th)?(?:,? (?P<year>\d{{4}}))?")),
+    ("day_month", re.compile(rf"(?:on )?(?:the )?(?P<day>\d{{1,2}})(?:st|nd|rd|th)? (?:of )?{MONTH}"
+                             rf"(?:,? (?P<year>\d{{4}}))?")),
+]
+
+
+def add_months(day: date, months: int) -> date:
+    """
+    Move a date by whole months, keeping the day of the month where the target month has it and taking the last day
+    of the month otherwise (January 31 plus one month is the end of February).
+    """
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def _offset(today: date, count: int, unit: str) -> date:
+    if unit == "day":
+        return today + timedelta(days=count)
+    if unit == "week":
+        return today + timedelta(weeks=count)
+    if unit == "fortnight":
+        return today + timedelta(weeks=2 * count)
+    if unit == "month":
+        return add_months(today, count)
+    return add_months(today, 12 * count)
+
+
+def _count(value: str) -> int:
+    return int(value) if value.isdigit() else NUMBERS[value]
+
+
+def _resolve(kind: str, match: re.Match, today: date) -> Optional[date]:
+    groups = match.groupdict()
+    if kind in ("offset_future", "offset_past"):
+        return _offset(today, _count(groups["count"]) * (1 if kind == "offset_future" else -1), groups["unit"])
+    if kind == "relative_weekday":
+        days_ahead = (WEEKDAYS[groups["weekday"]] - today.weekday()) % 7
+        which = groups["which"]
+        if which in ("last", "previous"):
+            return today - timedelta(days=(today.weekday() - WEEKDAYS[groups["weekday"]]) % 7 or 7)
+        # "next Friday" on a Friday is a week away, "this Friday" or "Friday" is today
+        if which == "next" and days_ahead == 0:
+            days_ahead = 7
+        return today + timedelta(days=days_ahead)
+    if kind == "relative_period":
+        sign = 1 if groups["which"] == "next" else -1
+        return _offset(today, sign, groups["unit"])
+    month = int(groups["month"]) if groups["month"].isdigit() else MONTHS[groups["month"]]
+    year = int(groups["year"]) if groups["year"] else today.year
+    return date(year, month, int(groups["day"]))
+
+
+def parse_relative_date(text: str, today: Optional[date] = None) -> Optional[date]:
+    """
+    Resolve a date expression relative to today without calling the LLM.
+    :param text: the expression, e.g. "a month from today", "next Friday", "2 weeks ago" or "May 18, 2023"
+    :param today: reference date, defaults to date.today()
+    :return: the date, or None when the text is not one of the supported expressions
+    """
+    today = today if today is not None else date.today()
+    text = FILLER.sub("", WHITESPACE.sub(" ", text.strip().lower().replace(",", ", ")).replace(" ,", ","))
+    text = WHITESPACE.sub(" ", text).strip().strip('"').strip()
+    if text in DAY_OFFSETS:
+        return today + timedelta(days=DAY_OFFSETS[text])
+    for kind, pattern in PATTERNS:
+        match = pattern.fullmatch(text)
+        if match:
+            try:
+                return _resolve(kind, match, today)
+            except ValueError:
+                # e.g. February 30
+                return None
+    return None
+
+
+def long_date(day: date) -> str:
+    """
+    Format a date like the Date Parser's answers: "Wednesday, November 18, 2026".
+    """
+    return f"{day:%A, %B} {day.day}, {day.year}"
+
+
+def parse_date(value: str) -> date:
+    """
+    Read back a date formatted by long_date().
+    """
+    return datetime.strptime(value, "%A, %B %d, %Y").date()
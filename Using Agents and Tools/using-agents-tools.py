@@ -1,72 +1,106 @@
+import asyncio
 import configparser
 import os
-from datetime import date
-from typing import List
-from langchain import OpenAI, SerpAPIWrapper, PromptTemplate, LLMChain
-from langchain.agents import AgentType, Tool, initialize_agent
+import sys
+from typing import List, Optional
+
+import aiohttp
+import openai
+from langchain import OpenAI, SerpAPIWrapper
 from langchain.tools import BaseTool
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from agent_tools import DateParserTool, create_agent, search_tool
+from common.instrumentation import configure_metrics_from_config, finish_metrics, record_error, timed
+from common.resilience import ResilientClient, resilient_client_from_config, use_resilient_client
+from common.tool_cache import CachedTool, ToolResultCache, expires_at_midnight
 
-class DateParserTool(BaseTool):
-    """
-    Custom Tool by subclassing the BaseTool class.
-    DateParserTool constructs another OpenAI call with the date context.
-    This is a great example of how you can inject context into OpenAI through chaining.
-    """
-    name = 'Date Parser'
-    description = 'Useful to infer dates from natural language strings.'
+TOOL_CACHE_FILE = "tool_cache.sqlite"
 
-    def _run(self, tool_input: str) -> str:
-        prompt_template = 'Today is {date_today}. Answer the following in Long Date format: {input}'
-        prompt = PromptTemplate(template=prompt_template, input_variables=['date_today', 'input'])
-        date_today = date.today()
-        llm_chain = LLMChain(prompt=prompt,
-                             llm=OpenAI(temperature=0.3, max_tokens=100),
-                             verbose=True)
-        return llm_chain.run(date_today=date_today.today(),
-                             input=tool_input)
 
-    async def _arun(self, tool_input: str) -> str:
-        raise NotImplementedError('DateParser does not support async')
+def create_tool_cache(config: configparser.ConfigParser) -> Optional[ToolResultCache]:
+    """
+    Create the cache of tool results from the [SETTINGS] of config.ini, or None when it is disabled.
+    :param config: parsed config.ini
+    :return: the tool result cache
+    """
+    if not config.getboolean('SETTINGS', 'TOOL_CACHE', fallback=True):
+        return None
+    return ToolResultCache(max_entries=config.getint('SETTINGS', 'TOOL_CACHE_SIZE', fallback=1000),
+                           path=TOOL_CACHE_FILE)
 
 
-def get_tools() -> List[BaseTool]:
+def get_tools(session: Optional[aiohttp.ClientSession] = None, cache: Optional[ToolResultCache] = None,
+              search_cache_hours: float = 6, resilient: Optional[ResilientClient] = None) -> List[BaseTool]:
     """
     Set up and return the tools
+    :param session: HTTP session shared by the asynchronous searches
+    :param cache: cache serving repeated tool calls, None to always call the tools
+    :param search_cache_hours: hours a cached search result stays valid. Dates are valid until midnight
+    :param resilient: client retrying and cutting off the Date Parser's LLM calls, None for LangChain's own retries
     :return: a list of tools
     """
-    search = SerpAPIWrapper()
+    search = SerpAPIWrapper(aiosession=session)
     date_parser_tool = DateParserTool()
+    if resilient is not None:
+        use_resilient_client(date_parser_tool.llm_chain.llm, resilient)
 
     # We load two tools. Our DateParser and a SerpApi search tool
     tools: List[BaseTool] = [
         date_parser_tool,
-        Tool(name='Search', description='Useful if you want to search internet.', func=search.run)
+        search_tool(search)
     ]
+    if cache is not None:
+        tools = [CachedTool(date_parser_tool, cache, ttl=expires_at_midnight),
+                 CachedTool(tools[1], cache, ttl=search_cache_hours * 3600)]
     return tools
 
 
-def execute_agent():
+async def execute_agent(config: configparser.ConfigParser):
     """
-    Initialize and execute the agent
+    Initialize and execute the agent. The agent runs asynchronously, so the tool calls it asks for in one step
+    (like the date and a movie search) run concurrently, and all the OpenAI and SerpApi requests go through one
+    HTTP session. Tool results are cached, so running the same question again does not repeat its searches.
+    :param config: parsed config.ini
     """
-    llm = OpenAI(temperature=0.3, max_tokens=200)
-    agent = initialize_agent(get_tools(), llm, agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION, verbose=True)
-    agent.run('Charlie bought his phone today. His phone will be out of warranty in a month. Reply when the warranty '
-              'expires along with a Hollywood movie name releasing on that day.')
+    metrics = configure_metrics_from_config(config)
+    cache = create_tool_cache(config)
+    # Retries, circuit breaker, deadline and hedging of the requests to OpenAI
+    resilient = resilient_client_from_config(config)
+    try:
+        async with aiohttp.ClientSession() as session:
+            openai.aiosession.set(session)
+            llm = use_resilient_client(OpenAI(temperature=0.3, max_tokens=200), resilient)
+            tools = get_tools(session, cache, config.getfloat('SETTINGS', 'SEARCH_CACHE_HOURS', fallback=6), resilient)
+            agent = create_agent(llm, tools)
+            with timed("request"):
+                await agent.arun('Charlie bought his phone today. His phone will be out of warranty in a month. '
+                                 'Reply when the warranty expires along with a Hollywood movie name releasing on '
+                                 'that day.')
+        for tool in tools:
+            if isinstance(tool, CachedTool):
+                print(f"{tool.name} cache: {tool.stats}")
+    except Exception as e:
+        record_error(e)
+        raise
+    finally:
+        if cache is not None:
+            cache.close()
+        finish_metrics(metrics)
 
 
-def initialize() -> None:
+def initialize() -> configparser.ConfigParser:
     """
     Load the config file and set the OpenAI and SerpApi API key.
     Get your SerpApi key here: https://serpapi.com/
+    :return: parsed config.ini
     """
     config = configparser.ConfigParser()
     config.read('config.ini')
     os.environ['OPENAI_API_KEY'] = config.get('API_KEYS', 'OPENAI_API_KEY')
     os.environ['SERPAPI_API_KEY'] = config.get('API_KEYS', 'SERPAPI_API_KEY')
+    return config
 
 
 if __name__ == '__main__':
-    initialize()
-    execute_agent()
+    asyncio.run(execute_agent(initialize()))
@@ -0,0 +1,115 @@
+"""
+Agent of the Using Agents and Tools sample with local stand-ins: a fake LLM that asks for the Date Parser and a
+Search in the same step and then answers, a fake date LLM and a fake search, each waiting `--latency` seconds like
+the real APIs. Compares the synchronous agent, which calls the tools one after the other, with the asynchronous one,
+which calls them concurrently, and then `--agents` asynchronous agents at once on one event loop.
+    python bench_agent_tools.py --latency 0.2 --agents 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List, Optional
+
+from bench_utils import latency_summary, print_row
+
+AGENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Using Agents and Tools')
+sys.path.append(AGENTS_DIR)
+
+PLAN = ("I need the date in a month and the movies released then.\n"
+        "Action 1: Date Parser\n"
+        "Action Input 1: a month from today\n"
+        "Action 2: Search\n"
+        "Action Input 2: Hollywood movies released next month")
+ANSWER = "I now know the final answer\nFinal Answer: The warranty expires next month, when a movie is released."
+
+
+def fake_llm(latency: float, respond):
+    from langchain.llms.base import LLM
+
+    class FakeLLM(LLM):
+        calls: int = 0
+
+        @property
+        def _llm_type(self) -> str:
+            return "fake"
+
+        def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+            self.calls += 1
+            time.sleep(latency)
+            return respond(prompt)
+
+        async def _acall(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+            self.calls += 1
+            await asyncio.sleep(latency)
+            return respond(prompt)
+
+    return FakeLLM()
+
+
+class FakeSearch:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def run(self, query: str) -> str:
+        time.sleep(self.latency)
+        return "Top result: a Hollywood movie."
+
+    async def arun(self, query: str) -> str:
+        await asyncio.sleep(self.latency)
+        return "Top result: a Hollywood movie."
+
+
+def build_agent(latency: float):
+    from agent_tools import DateParserTool, create_agent, search_tool
+
+    # Plan until the scratchpad, after the format instructions, holds the observations
+    agent_llm = fake_llm(latency, lambda prompt: ANSWER if "Observation 2:" in prompt.split("Begin!")[-1] else PLAN)
+    date_llm = fake_llm(latency, lambda prompt: "Wednesday, November 18, 2026")
+    date_parser = DateParserTool(llm=date_llm)
+    date_parser.llm_chain.verbose = False
+    tools = [date_parser, search_tool(FakeSearch(latency))]
+    return create_agent(agent_llm, tools, verbose=False), date_llm
+
+
+def main(args):
+    question = "When does a warranty of one month starting today expire, and which movie is released that day?"
+    agent, date_llm = build_agent(args.latency)
+
+    latencies = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        answer = agent.run(question)
+        latencies.append(time.perf_counter() - started)
+    print(f"Answer: {answer}")
+    print_row("sync agent", latency_summary(latencies))
+
+    async def timed():
+        started = time.perf_counter()
+        await agent.arun(question)
+        return time.perf_counter() - started
+
+    async def one_by_one():
+        return [await timed() for _ in range(args.runs)]
+
+    print_row("async agent", latency_summary(asyncio.run(one_by_one())))
+
+    async def many():
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(timed() for _ in range(args.agents)))
+        return latencies, time.perf_counter() - started
+
+    latencies, seconds = asyncio.run(many())
+    print_row(f"{args.agents} async agents at once", latency_summary(latencies), seconds=seconds)
+    # One DateParserTool, so one chain and one LLM client, served every call. "a month from today" is parsed by the
+    # rules of date_rules.py, so the date LLM is not called at all
+    print(f"Date Parser LLM calls: {date_llm.calls}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per LLM call and search')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--agents', type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,96 @@
+"""
+Answer cache in front of the PDF QA session. A stream of questions with Zipf-distributed repeats, half of them
+reworded (case, punctuation, word order), is answered by a QASession with and without an AnswerCache. The LLM is
+a local fake that waits `--llm-latency` seconds, and questions are embedded with a bag-of-words fake, so reworded
+questions land close to the original like they would with real embeddings. Halfway through, the index version
+changes to show the invalidation.
+    python bench_answer_cache.py --questions 300 --distinct 40 --threshold 0.95
+"""
+import argparse
+import hashlib
+import math
+import random
+import time
+from typing import List
+
+from bench_qa_session import build_vectordb, fake_llm
+from bench_utils import latency_summary, print_row
+from common.answer_cache import AnswerCache
+
+
+def bag_of_words_embeddings(size: int = 256):
+    from langchain.embeddings.base import Embeddings
+
+    class BagOfWordsEmbeddings(Embeddings):
+        def _embed(self, text: str) -> List[float]:
+            vector = [0.0] * size
+            for word in text.lower().replace('?', ' ').replace('.', ' ').split():
+                vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % size] += 1.0
+            return vector
+
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            return [self._embed(text) for text in texts]
+
+        def embed_query(self, text: str) -> List[float]:
+            return self._embed(text)
+
+    return BagOfWordsEmbeddings()
+
+
+def reword(rng: random.Random, question: str) -> str:
+    words = question.rstrip('?').split()
+    rng.shuffle(words)
+    return " ".join(words).upper() + rng.choice(["?", "??", " ?", ""])
+
+
+def workload(rng: random.Random, questions: int, distinct: int) -> List[str]:
+    topics = ["instruction tuning", "dialogue data", "evaluation", "training cost", "licensing", "model size",
+              "self-chat", "human feedback", "benchmarks", "tokenization"]
+    originals = [f"What does paper {index} say about {topics[index % len(topics)]}?" for index in range(distinct)]
+    weights = [1 / (rank + 1) for rank in range(distinct)]
+    stream = []
+    for _ in range(questions):
+        question = rng.choices(originals, weights)[0]
+        stream.append(reword(rng, question) if rng.random() < 0.5 else question)
+    return stream
+
+
+def run(name, session, questions, change_version_at):
+    latencies = []
+    for index, question in enumerate(questions):
+        if index == change_version_at:
+            session.index_version = "v2"
+        started = time.perf_counter()
+        session.query(question)
+        latencies.append(time.perf_counter() - started)
+    cache = session.answer_cache
+    extra = {"hit_rate": cache.stats.hit_rate, "invalidated": cache.stats.invalidated} if cache else {}
+    print_row(name, latency_summary(latencies), **extra)
+    if cache:
+        print(f"  {cache.stats}")
+
+
+def main(args):
+    from qa_session import QASession
+
+    vectordb = build_vectordb(args.chunks, bag_of_words_embeddings())
+    llm = fake_llm(args.llm_latency)
+    questions = workload(random.Random(42), args.questions, args.distinct)
+    print(f"{len(questions)} questions, {len(set(questions))} distinct strings, "
+          f"{args.llm_latency * 1000:.0f} ms per LLM call")
+
+    run("no cache", QASession(vectordb, llm=llm, index_version="v1"), questions, math.inf)
+    cache = AnswerCache(similarity_threshold=args.threshold, max_entries=args.max_entries)
+    run("AnswerCache", QASession(vectordb, llm=llm, answer_cache=cache, index_version="v1"), questions,
+        len(questions) // 2)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=300)
+    parser.add_argument('--distinct', type=int, default=40, help='distinct questions before rewording')
+    parser.add_argument('--threshold', type=float, default=0.95, help='cosine similarity of a near repeat')
+    parser.add_argument('--max-entries', type=int, default=1000)
+    parser.add_argument('--chunks', type=int, default=500, help='chunks in the vector database')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='seconds per fake LLM call')
+    main(parser.parse_args())
@@ -0,0 +1,97 @@
+"""
+Run openai-batch-sample.py's batch against the local mock API while the mock injects 429s, 500s and slow requests,
+and check the results: one line per prompt, in input order, every prompt answered or reported as failed. Reports the
+prompts per second, the attempts per prompt and the most results the writer held back for the output order, which
+--max-backlog bounds however slow the stragglers are. Exits with 1 when the results are wrong.
+    python bench_batch_sample.py --prompts 500 --concurrency 16 --error-rate 0.1 --server-error-rate 0.05
+"""
+import argparse
+import asyncio
+import importlib.util
+import io
+import json
+import os
+import time
+
+from bench_utils import print_row
+from mock_openai_server import MockOpenAIServer
+
+SAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'OpenAI Python Sample',
+                      'openai-batch-sample.py')
+
+
+def load_sample():
+    spec = importlib.util.spec_from_file_location("openai_batch_sample", SAMPLE)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def check(lines, prompts, completion: str):
+    """
+    :return: what is wrong with the output lines, empty when they are right
+    """
+    problems = []
+    if len(lines) != len(prompts):
+        problems.append(f"{len(lines)} results for {len(prompts)} prompts")
+    for index, (line, prompt) in enumerate(zip(lines, prompts)):
+        result = json.loads(line)
+        if result["index"] != index or result.get("prompt") != prompt:
+            problems.append(f"line {index} holds the result of prompt {result['index']}")
+        elif "error" not in result and result.get("completion") != completion.strip():
+            problems.append(f"line {index} has a wrong completion and no error")
+    return problems
+
+
+async def run(sample, args, server: MockOpenAIServer, max_backlog: int):
+    prompts = [f"Prompt {index}" for index in range(args.prompts)]
+    batch_args = argparse.Namespace(concurrency=args.concurrency, max_backlog=max_backlog, rpm=None, tpm=None,
+                                    max_retries=args.max_retries, model='text-davinci-003', max_tokens=16,
+                                    temperature=0.5, api_base=server.base_url)
+    input_file = io.StringIO("".join(json.dumps(prompt) + "\n" for prompt in prompts))
+    output_file = io.StringIO()
+    requests_before, errors_before = server.requests, server.errors
+    started = time.perf_counter()
+    total, writer = await sample.run_batch('mock', input_file, output_file, batch_args)
+    elapsed = time.perf_counter() - started
+    lines = output_file.getvalue().splitlines()
+    attempts = sum(json.loads(line)["attempts"] for line in lines)
+    print_row(f"max_backlog={max_backlog}", {"prompts": total, "failed": writer.errors, "seconds": elapsed},
+              prompts_per_s=total / elapsed if elapsed else 0.0, attempts_per_prompt=attempts / (total or 1),
+              injected_errors=server.errors - errors_before, requests=server.requests - requests_before,
+              most_held_back=writer.max_pending)
+    problems = check(lines, prompts, server.completion)
+    if writer.max_pending > max_backlog:
+        problems.append(f"the writer held back {writer.max_pending} results with max_backlog={max_backlog}")
+    return problems
+
+
+async def main(args):
+    sample = load_sample()
+    async with MockOpenAIServer(latency=args.latency, error_rate=args.error_rate, retry_after=0.05,
+                                server_error_rate=args.server_error_rate, slow_rate=args.slow_rate,
+                                slow_latency=args.slow_latency) as server:
+        print(f"{args.prompts} prompts, concurrency {args.concurrency}, 429 rate {args.error_rate}, "
+              f"500 rate {args.server_error_rate}, {args.slow_rate:.0%} of requests take {args.slow_latency}s")
+        problems = []
+        for max_backlog in args.max_backlog:
+            problems += await run(sample, args, server, max_backlog)
+    for problem in problems:
+        print(f"FAILED: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--prompts', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--max-backlog', type=int, nargs='+', default=[16, 64, 1000000],
+                        help='backlog bounds to compare; a huge one is the unbounded writer')
+    parser.add_argument('--max-retries', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds the mock waits before answering')
+    parser.add_argument('--error-rate', type=float, default=0.1, help='fraction of requests rejected with a 429')
+    parser.add_argument('--server-error-rate', type=float, default=0.05,
+                        help='fraction of requests failed with a 500')
+    parser.add_argument('--slow-rate', type=float, default=0.02, help='fraction of requests answered slowly')
+    parser.add_argument('--slow-latency', type=float, default=1.0, help='seconds a slow request takes')
+    raise SystemExit(asyncio.run(main(parser.parse_args())))
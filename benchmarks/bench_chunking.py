@@ -0,0 +1,72 @@
+"""
+Chunking throughput in MB/s of the character splitter used before (RecursiveCharacterTextSplitter with 1000
+characters) and of TokenTextChunker, on the Kindle highlights repeated to `--mb` megabytes, and the spread of the
+chunk sizes in tokens. TokenTextChunker also streams the text from a file, which is reported with its peak memory.
+Token counts are exact with tiktoken installed and estimated otherwise.
+    python bench_chunking.py --mb 20 --chunk-tokens 256
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from bench_utils import percentile, print_row
+from common.chunking import TokenTextChunker
+from common.tokens import get_token_counter, tiktoken
+
+CLIPPINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Question Answering over Docs',
+                         'My Clippings.txt')
+
+
+def report(name: str, size_mb: float, seconds: float, chunks, count_tokens, **extra):
+    tokens = [count_tokens(chunk) for chunk in chunks]
+    print_row(name, {"mb_per_s": size_mb / seconds}, chunks=len(chunks), p50_tokens=percentile(tokens, 50),
+              p95_tokens=percentile(tokens, 95), max_tokens=max(tokens), **extra)
+
+
+def main(args):
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    with open(CLIPPINGS, encoding="utf-8-sig") as f:
+        sample = f.read()
+    text = sample * max(1, int(args.mb * 1024 * 1024 / len(sample.encode("utf-8"))))
+    size_mb = len(text.encode("utf-8")) / 1024 / 1024
+    count_tokens = get_token_counter()
+    print(f"{size_mb:.1f} MB of text, token counts {'exact' if tiktoken is not None else 'estimated'}")
+
+    started = time.perf_counter()
+    chunks = RecursiveCharacterTextSplitter(chunk_size=1000).split_text(text)
+    report("RecursiveCharacter 1000", size_mb, time.perf_counter() - started, chunks, count_tokens)
+
+    chunker = TokenTextChunker(chunk_size=args.chunk_tokens, chunk_overlap=args.chunk_tokens // 8)
+    started = time.perf_counter()
+    chunks = chunker.split_text(text)
+    report(f"TokenTextChunker {args.chunk_tokens}", size_mb, time.perf_counter() - started, chunks, count_tokens)
+
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", delete=False) as f:
+        f.write(text)
+    del text, chunks
+    try:
+        started = time.perf_counter()
+        with open(f.name, encoding="utf-8") as stream:
+            # Only count the chunks, as an embedding stage consuming them would not keep them either
+            streamed = sum(1 for _ in chunker.iter_chunks(stream))
+        seconds = time.perf_counter() - started
+        # Once more to trace the memory, which slows the run down
+        tracemalloc.start()
+        with open(f.name, encoding="utf-8") as stream:
+            for _ in chunker.iter_chunks(stream):
+                pass
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+        print_row("TokenTextChunker streamed", {"mb_per_s": size_mb / seconds}, chunks=streamed, peak_mb=peak_mb)
+    finally:
+        os.remove(f.name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mb', type=float, default=20, help='megabytes of text')
+    parser.add_argument('--chunk-tokens', type=int, default=256)
+    main(parser.parse_args())
@@ -0,0 +1,72 @@
+"""
+Context of the PDF QA questions with a fixed number of chunks (the original k=2, and k=4) and packed by
+ContextPacker into a token budget. The corpus is the sample papers chunked like the ingest, with every paper indexed
+twice under two names, as happens when the same PDF is saved twice, so the nearest chunks of a question come in
+identical pairs. Embeddings are local fakes (HashEmbeddings) and the questions are chunks of the papers.
+Reports the context tokens per question and how many of the chunks in the context are distinct.
+    python bench_context_packing.py --questions 100 --budget 1500
+"""
+import argparse
+import os
+import random
+import sys
+
+from bench_utils import print_row
+from common.context_packing import ContextPacker, search_with_vectors
+from common.embeddings import HashEmbeddings
+from common.tokens import get_token_counter
+from common.vectorstore import MemmapVectorStore
+
+PDF_QA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PDF QA')
+sys.path.append(PDF_QA_DIR)
+
+
+def load_chunks():
+    from pdf_extract import extract_page_texts, split_document
+
+    papers = os.path.join(PDF_QA_DIR, 'papers')
+    file_paths = [os.path.join(papers, file_name) for file_name in sorted(os.listdir(papers))
+                  if file_name.lower().endswith('.pdf')]
+    texts = extract_page_texts(file_paths, num_pages=None, workers=0)
+    return [chunk.page_content for file_path, text in zip(file_paths, texts)
+            for chunk in split_document(file_path, [text])]
+
+
+def report(name: str, contexts, count_tokens, **extra):
+    tokens = [sum(count_tokens(text) for text in context) for context in contexts]
+    chunks = sum(len(context) for context in contexts)
+    distinct = sum(len(set(context)) for context in contexts)
+    print_row(name, {"tokens_per_question": sum(tokens) / len(tokens), "chunks_per_question": chunks / len(contexts),
+                     "distinct_per_question": distinct / len(contexts)}, max_tokens=max(tokens), **extra)
+
+
+def main(args):
+    chunks = load_chunks()
+    embeddings = HashEmbeddings(size=64)
+    vectordb = MemmapVectorStore.from_texts(chunks * 2, embeddings)
+    count_tokens = get_token_counter()
+    questions = random.Random(0).sample(chunks, min(args.questions, len(chunks)))
+    print(f"{len(questions)} questions over {2 * len(chunks)} chunks ({len(chunks)} distinct), "
+          f"budget {args.budget} tokens")
+
+    for k in (2, 4):
+        contexts = [[doc.page_content for doc in vectordb.similarity_search(question, k=k)] for question in questions]
+        report(f"fixed k={k}", contexts, count_tokens)
+
+    packer = ContextPacker(token_budget=args.budget)
+    contexts, duplicates = [], 0
+    for question in questions:
+        embedding = embeddings.embed_query(question)
+        candidates = search_with_vectors(vectordb, embedding, args.fetch_k)
+        context = packer.pack([doc for doc, _ in candidates], [vector for _, vector in candidates], embedding)
+        contexts.append([doc.page_content for doc in context.documents])
+        duplicates += context.duplicates
+    report(f"packed fetch_k={args.fetch_k}", contexts, count_tokens, duplicates_dropped=duplicates)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=100)
+    parser.add_argument('--budget', type=int, default=1500, help='context tokens per question')
+    parser.add_argument('--fetch-k', type=int, default=20)
+    main(parser.parse_args())
@@ -0,0 +1,61 @@
+"""
+Prompt size per turn of the Conversation Bot over a long synthetic conversation, with the original
+ConversationBufferMemory and with TokenBudgetMemory. No LLM is called: the prompt is rendered the way the bot's
+LLMChain renders it, and the budgeted memory summarizes evicted turns without an LLM.
+    python bench_conversation_memory.py --turns 500 --budget 1000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+from bench_utils import latency_summary, print_row
+from common.tokens import get_token_counter
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Conversation Bot')
+sys.path.append(BOT_DIR)
+
+
+def synthetic_turn(rng: random.Random, index: int):
+    words = ["seattle", "weather", "hiking", "coffee", "museum", "ferry", "rain", "mountain", "market", "music"]
+    question = f"Question {index}: " + " ".join(rng.choice(words) for _ in range(rng.randint(5, 25))) + "?"
+    answer = f"Answer {index}: " + " ".join(rng.choice(words) for _ in range(rng.randint(15, 60))) + "."
+    return question, answer
+
+
+def run(name, memory, prompt, turns, count_tokens):
+    rng = random.Random(42)
+    prompt_tokens, save_times = [], []
+    for index in range(turns):
+        question, answer = synthetic_turn(rng, index)
+        history = memory.load_memory_variables({})["history"]
+        prompt_tokens.append(count_tokens(prompt.format(history=history, human_input=question)))
+        started = time.perf_counter()
+        memory.save_context({"human_input": question}, {"text": answer})
+        save_times.append(time.perf_counter() - started)
+
+    checkpoints = {f"turn_{n}": prompt_tokens[n - 1] for n in sorted({10, 100, turns // 2, turns}) if n <= turns}
+    print_row(name, {"max_prompt_tokens": max(prompt_tokens), **checkpoints},
+              save_p99_ms=latency_summary(save_times)["p99_ms"])
+
+
+def main(args):
+    from langchain.memory import ConversationBufferMemory
+    from chatbot import create_prompt
+    from token_budget_memory import TokenBudgetMemory
+
+    prompt = create_prompt()
+    count_tokens = get_token_counter()
+    print(f"{args.turns} turns, history budget {args.budget} tokens (prompt tokens per turn)")
+    run("ConversationBufferMemory", ConversationBufferMemory(), prompt, args.turns, count_tokens)
+    run("TokenBudgetMemory", TokenBudgetMemory(max_token_limit=args.budget, summary_token_limit=args.budget // 4,
+                                               ai_prefix="Assistant"),
+        prompt, args.turns, count_tokens)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=500)
+    parser.add_argument('--budget', type=int, default=1000, help='history token budget of TokenBudgetMemory')
+    main(parser.parse_args())
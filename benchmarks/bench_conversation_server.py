@@ -0,0 +1,92 @@
+"""
+Load test of the multi-session Conversation Bot server (conversation-server.py). The OpenAI API is replaced by the
+local mock server, so the numbers show the server's own overhead: sessions held, memory per session and turn
+latency percentiles.
+    python bench_conversation_server.py --sessions 500 --turns 10 --concurrency 100 --latency 0.05
+"""
+import argparse
+import asyncio
+import importlib.util
+import os
+import random
+import resource
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from bench_utils import latency_summary, print_row
+from mock_openai_server import MockOpenAIServer
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Conversation Bot')
+sys.path.append(BOT_DIR)
+
+
+def load_server_module():
+    spec = importlib.util.spec_from_file_location('conversation_server',
+                                                  os.path.join(BOT_DIR, 'conversation-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+async def drive_session(http, base_url, session_id, turns, semaphore, latencies, rng):
+    for turn in range(turns):
+        message = f"Turn {turn}: tell me about " + " ".join(rng.choice(["seattle", "rain", "ferries", "coffee"])
+                                                           for _ in range(rng.randint(3, 12)))
+        async with semaphore:
+            started = time.perf_counter()
+            async with http.post(f"{base_url}/sessions/{session_id}/messages", json={"message": message}) as resp:
+                await resp.json()
+                resp.raise_for_status()
+            latencies.append(time.perf_counter() - started)
+
+
+async def main(args):
+    os.environ.setdefault("OPENAI_API_KEY", "mock")
+    import openai
+    server_module = load_server_module()
+
+    async with MockOpenAIServer(latency=args.latency) as mock:
+        openai.api_base = mock.base_url
+        store = server_module.create_store(history_token_limit=args.budget, max_sessions=args.max_sessions,
+                                           idle_ttl=3600)
+        runner = web.AppRunner(server_module.create_app(store), access_log=None)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        base_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        latencies = []
+        semaphore = asyncio.Semaphore(args.concurrency)
+        rng = random.Random(7)
+        started = time.perf_counter()
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as http:
+            await asyncio.gather(*(drive_session(http, base_url, f"session-{index}", args.turns, semaphore,
+                                                 latencies, rng)
+                                   for index in range(args.sessions)))
+            async with http.get(f"{base_url}/stats") as resp:
+                stats = await resp.json()
+        elapsed = time.perf_counter() - started
+        rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        await runner.cleanup()
+
+    print(f"{args.sessions} sessions x {args.turns} turns, concurrency {args.concurrency}, "
+          f"mock latency {args.latency * 1000:.0f}ms")
+    print_row("client turn latency", latency_summary(latencies), turns_per_s=len(latencies) / elapsed)
+    print_row("server", {key: round(value, 2) if isinstance(value, float) else value for key, value in stats.items()})
+    print_row("process", {"max_rss_growth_kb_per_session": (rss_after - rss_before) / max(1, stats["sessions"]),
+                          "openai_connections": len(mock.connections)})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sessions', type=int, default=500)
+    parser.add_argument('--turns', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.05, help='mock OpenAI latency in seconds')
+    parser.add_argument('--budget', type=int, default=1000, help='history token budget per session')
+    parser.add_argument('--max-sessions', type=int, default=10000)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,91 @@
+"""
+Date Parser of the Using Agents and Tools sample with its rule-based fast path. Times the rules, then runs a mix of
+agent-style inputs through the tool with a fake date LLM waiting `--latency` seconds, with and without the fast path,
+and reports the latency and the fast-path hit rate. The rules themselves are tested in tests/test_date_rules.py.
+    python bench_date_parser.py --latency 0.5 --runs 20
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import date
+from typing import List, Optional
+
+from bench_utils import latency_summary, print_row
+
+AGENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Using Agents and Tools')
+sys.path.append(AGENTS_DIR)
+
+# Inputs the agent sends to the Date Parser, most of them common expressions
+WORKLOAD = ["a month from today", "today", "next Friday", "in 2 weeks", "tomorrow", "3 days ago",
+            "the date Charlie's warranty expires", "next month", "last Monday", "the first Monday of next month"]
+
+
+def time_rules():
+    from date_rules import parse_relative_date
+
+    today = date.today()
+    started = time.perf_counter()
+    rounds = 2000
+    for _ in range(rounds):
+        for text in WORKLOAD:
+            parse_relative_date(text, today)
+    print(f"rules: {1e6 * (time.perf_counter() - started) / (rounds * len(WORKLOAD)):.1f} us per input")
+
+
+def fake_llm(latency: float):
+    from langchain.llms.base import LLM
+
+    class FakeLLM(LLM):
+        calls: int = 0
+
+        @property
+        def _llm_type(self) -> str:
+            return "fake"
+
+        def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+            self.calls += 1
+            time.sleep(latency)
+            return "Wednesday, November 18, 2026"
+
+        async def _acall(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+            self.calls += 1
+            await asyncio.sleep(latency)
+            return "Wednesday, November 18, 2026"
+
+    return FakeLLM()
+
+
+def run_tool(args, fast_path: bool):
+    from agent_tools import DateParserTool
+
+    llm = fake_llm(args.latency)
+    tool = DateParserTool(llm=llm)
+    tool.llm_chain.verbose = False
+    latencies = []
+    for _ in range(args.runs):
+        for text in WORKLOAD:
+            started = time.perf_counter()
+            if fast_path:
+                tool.run(text, verbose=False)
+            else:
+                tool.llm_chain.run(date_today=date.today(), input=text)
+            latencies.append(time.perf_counter() - started)
+    name = "rules + LLM fallback" if fast_path else "LLM only"
+    print_row(name, latency_summary(latencies), llm_calls=llm.calls)
+    if fast_path:
+        print(tool.stats)
+
+
+def main(args):
+    time_rules()
+    run_tool(args, fast_path=False)
+    run_tool(args, fast_path=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds per date LLM call')
+    parser.add_argument('--runs', type=int, default=5, help='passes over the workload')
+    main(parser.parse_args())
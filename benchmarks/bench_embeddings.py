@@ -0,0 +1,76 @@
+"""
+Embedding throughput with and without CachedEmbeddings, on the highlights of the Kindle sample. The embedder is a
+local, deterministic fake (HashEmbeddings) that sleeps like a call to the embeddings API: `--latency` seconds per
+request plus `--latency-per-text` seconds per input, so no API key is needed. The baseline sends every text in
+sequential requests of 1000, like OpenAIEmbeddings.
+    python bench_embeddings.py --copies 3 --latency 0.2 --batch-size 64 --concurrency 4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from bench_utils import print_row
+from common.embeddings import CachedEmbeddings, HashEmbeddings
+
+CLIPPINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Question Answering over Docs',
+                         'My Clippings.txt')
+
+
+def load_highlights(copies: int):
+    with open(CLIPPINGS, encoding='utf-8-sig') as f:
+        highlights = [entry.strip() for entry in f.read().split('==========') if entry.strip()]
+    # Rebuilding an index, or the same highlight exported twice, sends the same texts again
+    return highlights * copies
+
+
+def embed_sequentially(embeddings, texts, chunk_size=1000):
+    return [vector for start in range(0, len(texts), chunk_size)
+            for vector in embeddings.embed_documents(texts[start:start + chunk_size])]
+
+
+def run(name, embed, texts, fake, embeddings=None):
+    calls_before = fake.calls
+    started = time.perf_counter()
+    vectors = embed(texts)
+    elapsed = time.perf_counter() - started
+    assert len(vectors) == len(texts)
+    stats = getattr(embeddings, 'stats', None)
+    print_row(name, {"texts": len(texts), "seconds": elapsed},
+              embeddings_per_s=len(texts) / elapsed if elapsed else 0.0,
+              api_requests=fake.calls - calls_before,
+              hit_rate=stats.hit_rate if stats is not None else 0.0)
+    return vectors
+
+
+def main(args):
+    texts = load_highlights(args.copies)
+    fake = HashEmbeddings(size=args.size, latency=args.latency, latency_per_text=args.latency_per_text)
+    print(f"{len(texts)} texts ({len(set(texts))} unique), {args.latency * 1000:.0f} ms per request "
+          f"+ {args.latency_per_text * 1000:.1f} ms per text")
+
+    baseline = run("uncached, sequential", lambda batch: embed_sequentially(fake, batch), texts, fake)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        cache_path = os.path.join(cache_dir, 'embedding_cache.sqlite')
+        cached = CachedEmbeddings.from_path(fake, cache_path, batch_size=args.batch_size,
+                                            max_concurrency=args.concurrency)
+        cold = run("cached, cold", cached.embed_documents, texts, fake, cached)
+        # A new instance on the same file: what a rebuild in a later run sees
+        warm_embeddings = CachedEmbeddings.from_path(fake, cache_path, batch_size=args.batch_size,
+                                                     max_concurrency=args.concurrency)
+        warm = run("cached, warm", warm_embeddings.embed_documents, texts, fake, warm_embeddings)
+
+    # float32 storage: cached vectors match the embedder's to about 1e-7
+    drift = max(abs(a - b) for vectors in (cold, warm) for x, y in zip(baseline, vectors) for a, b in zip(x, y))
+    print(f"max difference from the uncached vectors: {drift:.1e}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--copies', type=int, default=3, help='times every highlight is embedded')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per embeddings request')
+    parser.add_argument('--latency-per-text', type=float, default=0.002, help='seconds per input of a request')
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--size', type=int, default=1536, help='embedding dimensions')
+    main(parser.parse_args())
@@ -0,0 +1,62 @@
+"""
+Compare the original one-session-per-request behaviour of openai-chat-sample.py with the pooled OpenAIHTTPClient,
+against a local mock completions server.
+    python bench_http_client.py --requests 500 --concurrency 10 --latency 0.005
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+
+from bench_utils import latency_summary, print_row
+from common.http_client import OpenAIHTTPClient
+from mock_openai_server import MockOpenAIServer
+
+PAYLOAD = {"model": "text-davinci-003", "prompt": "Hello\n", "max_tokens": 50, "temperature": 0.5}
+
+
+async def session_per_request(base_url: str) -> str:
+    # Mirrors the original generate_response: a new session (and connection) for every message
+    async with aiohttp.ClientSession() as session:
+        headers = {"Authorization": "Bearer mock", "Content-Type": "application/json"}
+        async with session.post(f"{base_url}/completions", data=json.dumps(PAYLOAD), headers=headers) as resp:
+            result = await resp.json()
+            return result['choices'][0]['text'].strip()
+
+
+async def run(name: str, call, total: int, concurrency: int, server: MockOpenAIServer):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    server.connections.clear()
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+    print_row(name, latency_summary(latencies), req_per_s=total / elapsed, connections=len(server.connections))
+
+
+async def main(args):
+    async with MockOpenAIServer(latency=args.latency) as server:
+        for concurrency in sorted({1, args.concurrency}):
+            print(f"\n{args.requests} requests, concurrency {concurrency}, server latency {args.latency * 1000:.1f}ms")
+            await run("session per request", lambda: session_per_request(server.base_url),
+                      args.requests, concurrency, server)
+            async with OpenAIHTTPClient('mock', api_base=server.base_url) as client:
+                await run("pooled client", lambda: client.completion("Hello\n"),
+                          args.requests, concurrency, server)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.005, help='mock server latency in seconds')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,67 @@
+"""
+Retrieval over the Kindle highlights, parsed one document per highlight, with vector search only and with the
+HybridRetriever (BM25 fused with vector search, metadata pre-filtering on author and title). The query embedding
+comes from a local fake that waits `--embed-latency` seconds like a call to the embeddings API. Queries naming an
+author or book are answered without embedding the query, which shows in the embedding calls and the latency.
+    python bench_hybrid_retrieval.py --embed-latency 0.1
+"""
+import argparse
+import os
+import sys
+import time
+
+from bench_utils import latency_summary, print_row
+from common.embeddings import HashEmbeddings
+from common.hybrid_retrieval import HybridRetriever
+from common.vectorstore import MemmapVectorStore
+
+KINDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Question Answering over Docs')
+sys.path.append(KINDLE_DIR)
+
+QUERIES = [
+    "what did alberto savoia say about data?",
+    "What does Good Strategy Bad Strategy say about the kernel?",
+    "what does Olivia Fox Cabane say about presence",
+    "Rumelt on bad strategy",
+    "highlights from Working Backwards",
+    "how do I listen better",
+    "why do most new products fail",
+    "how to tell a story that changes minds",
+    "what makes a leader charismatic",
+    "how can I change other people's behavior",
+]
+
+
+def run(name, search, embeddings, repeats):
+    calls_before = embeddings.calls
+    latencies = []
+    for _ in range(repeats):
+        for query in QUERIES:
+            started = time.perf_counter()
+            search(query)
+            latencies.append(time.perf_counter() - started)
+    print_row(name, latency_summary(latencies), embedding_calls=embeddings.calls - calls_before)
+
+
+def main(args):
+    from clippings import load_clippings
+
+    docs = load_clippings(os.path.join(KINDLE_DIR, 'My Clippings.txt'))
+    embeddings = HashEmbeddings(size=256)
+    vectordb = MemmapVectorStore.from_documents(docs, embeddings, ids=[doc.metadata['id'] for doc in docs])
+    embeddings.latency = args.embed_latency
+    retriever = HybridRetriever(docs, vectordb, k=4)
+    lookups = sum(1 for query in QUERIES if retriever.metadata_filter(query))
+    print(f"{len(docs)} highlights, {len(QUERIES)} queries ({lookups} name an author or book), "
+          f"{args.embed_latency * 1000:.0f} ms per embedding call")
+
+    run("vector search", lambda query: vectordb.similarity_search(query, k=4), embeddings, args.repeats)
+    run("HybridRetriever", retriever.get_relevant_documents, embeddings, args.repeats)
+    print(f"HybridRetriever searches: {dict(retriever.searches)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--embed-latency', type=float, default=0.1, help='seconds per embedding call')
+    parser.add_argument('--repeats', type=int, default=3)
+    main(parser.parse_args())
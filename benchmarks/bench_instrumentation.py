@@ -0,0 +1,117 @@
+"""
+Cost and output of the shared instrumentation (common/instrumentation.py). First the overhead per timed block and
+decorated call with the metrics disabled and enabled, against no instrumentation; then questions answered by the PDF
+QA session over an in-memory Chroma collection, with cached HashEmbeddings and a fake LLM that streams its answer
+after `--llm-latency` seconds, without and with metrics. With metrics on, the timings go to a JSON log and to a
+Prometheus endpoint, which is scraped once, and the per-stage summary is printed.
+    python bench_instrumentation.py --questions 50 --llm-latency 0.02
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import List, Optional
+
+from bench_qa_session import build_vectordb
+from bench_utils import latency_summary, print_row
+from common.embeddings import CachedEmbeddings, HashEmbeddings
+from common.instrumentation import METRICS, JsonLogExporter, add_langchain_handler, serve_prometheus, timed
+
+PDF_QA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PDF QA')
+sys.path.append(PDF_QA_DIR)
+
+
+def streaming_llm(latency: float):
+    from langchain.llms.base import LLM
+
+    class StreamingLLM(LLM):
+        @property
+        def _llm_type(self) -> str:
+            return "fake"
+
+        def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+            time.sleep(latency)
+            tokens = ["The", " answer", "."]
+            for token in tokens:
+                self.callback_manager.on_llm_new_token(token, verbose=self.verbose)
+            return "".join(tokens)
+
+    return StreamingLLM()
+
+
+def nanoseconds_per_call(func, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return 1e9 * (time.perf_counter() - started) / calls
+
+
+def overhead(calls: int):
+    def bare():
+        pass
+
+    def block():
+        with timed("bench"):
+            pass
+
+    decorated = timed("bench")(bare)
+    base = nanoseconds_per_call(bare, calls)
+    for enabled in (False, True):
+        METRICS.enable(enabled)
+        state = "enabled" if enabled else "disabled"
+        print(f"{state:<9} timed block: {nanoseconds_per_call(block, calls) - base:7.0f} ns, "
+              f"decorated call: {nanoseconds_per_call(decorated, calls) - base:7.0f} ns over a bare call")
+    METRICS.enable(False)
+    METRICS.reset()
+
+
+def answer(session, questions: List[str]) -> List[float]:
+    latencies = []
+    for question in questions:
+        started = time.perf_counter()
+        with timed("request"):
+            session.query(question)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main(args):
+    from qa_session import QASession
+
+    overhead(args.calls)
+
+    embeddings = CachedEmbeddings.from_path(HashEmbeddings(size=256), ":memory:")
+    vectordb = build_vectordb(args.chunks, embeddings)
+    session = QASession(vectordb, llm=streaming_llm(args.llm_latency))
+    questions = [f"What does paper {index} say about instruction tuning?" for index in range(args.questions)]
+    print(f"\n{args.questions} questions over {args.chunks} chunks, fake streaming LLM")
+    print_row("metrics off", latency_summary(answer(session, questions)))
+
+    with tempfile.TemporaryDirectory() as directory:
+        log_path = os.path.join(directory, "metrics.jsonl")
+        exporter = JsonLogExporter(log_path)
+        METRICS.exporters.append(exporter)
+        METRICS.enable()
+        add_langchain_handler()
+        server = serve_prometheus(port=0)
+        print_row("metrics on", latency_summary(answer(session, questions)))
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            exposition = response.read().decode("utf-8")
+        server.shutdown()
+        server.server_close()
+        exporter.close()
+        with open(log_path) as f:
+            events = sum(1 for _ in f)
+    print(f"JSON log: {events} events, Prometheus exposition: {len(exposition.splitlines())} lines")
+    print(METRICS.summary())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200000, help='calls measured for the overhead')
+    parser.add_argument('--questions', type=int, default=50)
+    parser.add_argument('--chunks', type=int, default=500)
+    parser.add_argument('--llm-latency', type=float, default=0.02, help='seconds before the fake LLM answers')
+    main(parser.parse_args())
@@ -0,0 +1,64 @@
+"""
+PDF extraction and chunking throughput of the PDF QA ingest pipeline, in this process and on a pool of worker
+processes. The sample papers are copied several times into a temporary folder to get a larger corpus.
+    python bench_pdf_extract.py --copies 10 --workers 0 2 4
+"""
+import argparse
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from bench_utils import print_row
+
+PDF_QA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PDF QA')
+sys.path.append(PDF_QA_DIR)
+
+
+def build_corpus(target_dir: str, copies: int):
+    papers_dir = os.path.join(PDF_QA_DIR, 'papers')
+    for copy in range(copies):
+        for file_name in os.listdir(papers_dir):
+            if file_name.lower().endswith('.pdf'):
+                shutil.copy(os.path.join(papers_dir, file_name), os.path.join(target_dir, f"{copy}_{file_name}"))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux; the children are the pool's worker processes
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024
+
+
+def run(file_paths, workers: int, pages_per_task: int):
+    from pdf_extract import ExtractionPipeline
+
+    pipeline = ExtractionPipeline(file_paths, workers=workers, pages_per_task=pages_per_task)
+    started = time.perf_counter()
+    chunks = sum(len(docs) for _, docs in pipeline)
+    elapsed = time.perf_counter() - started
+    stats = pipeline.stats
+    per_worker = stats.pages_per_second().values()
+    print_row(f"workers={workers}", {"pages": stats.total_pages, "chunks": chunks, "seconds": elapsed},
+              pages_per_s=stats.total_pages / elapsed if elapsed else 0.0,
+              min_worker_pages_per_s=min(per_worker, default=0.0),
+              peak_rss_mb=peak_rss_mb())
+
+
+def main(args):
+    with tempfile.TemporaryDirectory() as corpus_dir:
+        build_corpus(corpus_dir, args.copies)
+        file_paths = sorted(os.path.join(corpus_dir, file_name) for file_name in os.listdir(corpus_dir))
+        print(f"{len(file_paths)} PDFs, {os.cpu_count()} CPUs, {args.pages_per_task} pages per task")
+        for workers in args.workers:
+            run(file_paths, workers, args.pages_per_task)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--copies', type=int, default=5, help='copies of the sample papers in the corpus')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, os.cpu_count() or 1],
+                        help='worker process counts to compare, 0 extracts in this process')
+    parser.add_argument('--pages-per-task', type=int, default=8)
+    main(parser.parse_args())
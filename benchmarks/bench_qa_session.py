@@ -0,0 +1,105 @@
+"""
+Per-question overhead of the PDF QA chat, excluding network time: the original code built the prompt, retriever,
+OpenAI client and RetrievalQA chain for every question, QASession builds them once. The LLM is a local fake and the
+vector database an in-memory Chroma collection of synthetic chunks embedded with HashEmbeddings.
+With `--llm-latency`, the fake LLM waits like an API call, to compare answering questions one after the other with
+QASession.aquery_many().
+    python bench_qa_session.py --questions 200 --llm-latency 0.05 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import List, Optional
+
+from bench_utils import latency_summary, print_row
+from common.embeddings import HashEmbeddings
+
+PDF_QA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PDF QA')
+sys.path.append(PDF_QA_DIR)
+
+# Only constructed, never called, to measure the cost of a new OpenAI client
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+
+def fake_llm(latency: float):
+    from langchain.llms.base import LLM
+
+    class FakeLLM(LLM):
+        @property
+        def _llm_type(self) -> str:
+            return "fake"
+
+        def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+            if latency:
+                time.sleep(latency)
+            return "The answer."
+
+        async def _acall(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+            if latency:
+                await asyncio.sleep(latency)
+            return "The answer."
+
+    return FakeLLM()
+
+
+def build_vectordb(chunks: int, embeddings=None):
+    from langchain.vectorstores import Chroma
+
+    rng = random.Random(42)
+    words = ["model", "dialogue", "training", "dataset", "instruction", "evaluation", "chat", "language", "tokens"]
+    texts = [" ".join(rng.choice(words) for _ in range(150)) for _ in range(chunks)]
+    return Chroma.from_texts(texts, embeddings if embeddings is not None else HashEmbeddings(size=256),
+                             collection_name="bench_qa_session")
+
+
+def main(args):
+    from langchain import OpenAI
+    from qa_session import QASession
+
+    vectordb = build_vectordb(args.chunks)
+    llm = fake_llm(0.0)
+    questions = [f"What does paper {index} say about instruction tuning?" for index in range(args.questions)]
+    print(f"{args.questions} questions over {args.chunks} chunks, fake LLM")
+
+    per_question = []
+    for question in questions:
+        started = time.perf_counter()
+        # What process_input() did for every question
+        OpenAI(temperature=0, max_tokens=400)
+        QASession(vectordb, llm=llm).query(question)
+        per_question.append(time.perf_counter() - started)
+    print_row("rebuilt per question", latency_summary(per_question))
+
+    session = QASession(vectordb, llm=llm)
+    reused = []
+    for question in questions:
+        started = time.perf_counter()
+        session.query(question)
+        reused.append(time.perf_counter() - started)
+    print_row("QASession reused", latency_summary(reused))
+
+    if args.llm_latency:
+        session = QASession(vectordb, llm=fake_llm(args.llm_latency), max_concurrency=args.concurrency)
+        batch = questions[:args.concurrency * 4]
+        started = time.perf_counter()
+        for question in batch:
+            session.query(question)
+        sequential = time.perf_counter() - started
+        started = time.perf_counter()
+        asyncio.run(session.aquery_many(batch))
+        concurrent = time.perf_counter() - started
+        print_row("query() one by one", {"questions": len(batch), "seconds": sequential})
+        print_row("aquery_many()", {"questions": len(batch), "seconds": concurrent},
+                  concurrency=args.concurrency)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--questions', type=int, default=200)
+    parser.add_argument('--chunks', type=int, default=500, help='chunks in the vector database')
+    parser.add_argument('--llm-latency', type=float, default=0.05, help='seconds per fake LLM call, 0 to skip')
+    parser.add_argument('--concurrency', type=int, default=8)
+    main(parser.parse_args())
@@ -0,0 +1,242 @@
+"""
+End-to-end replay of the sample apps against the local mock of the OpenAI API, without network access or an API key.
+Every sample runs as its own process, in a scratch directory with a config.ini that turns the JSON metrics log on,
+and with OPENAI_API_BASE pointing at the mock, which serves both completions and embeddings. The scripted
+conversation is fed on stdin. Each sample runs twice in the same directory: a cold run that builds the summaries,
+indexes and caches, and a warm run that reuses them.
+From the metrics log of every run this reports the wall time, the requests per second and the latency percentiles
+of every stage (request, llm, embed, vector_search, ...), plus the tokens, retries and errors counted.
+    python bench_replay.py --turns 10 --latency 0.02 --error-rate 0.05 --output replay.json
+With `--baseline` the results are compared with an earlier `--output` file and the script exits with 1 when a stage's
+p95 got slower than `--tolerance` times its baseline, or when a sample failed, so a CI job can catch regressions.
+The PDF QA and Kindle samples embed through langchain's OpenAIEmbeddings, which needs tiktoken and its cached
+encoding files. A sample whose requirements.txt packages are not installed, or whose tiktoken encoding cannot be
+loaded, is skipped with the reason.
+"""
+import argparse
+import asyncio
+import configparser
+import importlib.util
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+from bench_utils import latency_summary, print_row
+from mock_openai_server import MockOpenAIServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+METRICS_FILE = "metrics.jsonl"
+QUESTIONS = [
+    "What is instruction tuning?",
+    "Which datasets were used for the evaluation?",
+    "How does the model compare with GPT-3?",
+    "What are the limitations the authors mention?",
+    "Summarize the main contribution in one sentence.",
+]
+# Sample name -> folder, script, files the script reads from its working directory, whether it takes questions on
+# stdin, and the answers to the prompts of a warm run (the Conversation Bot offers to resume its transcript)
+SAMPLES = {
+    "chat": ("OpenAI Python Sample", "openai-chat-sample.py", [], True, []),
+    "bot": ("Conversation Bot", "conversation-bot.py", [], True, ["y"]),
+    "pdf": ("PDF QA", "pdf-qa-chat.py", ["papers"], True, []),
+    "kindle": ("Question Answering over Docs", "kindle_highlights_sample.py", ["My Clippings.txt"], False, []),
+}
+
+
+def missing_dependencies(folder: str) -> List[str]:
+    """
+    :return: the packages of the sample's requirements.txt that cannot be imported, and tiktoken's encoding when it
+             cannot be loaded (it is downloaded on first use, which fails without network access)
+    """
+    path = os.path.join(ROOT, folder, 'requirements.txt')
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        packages = [re.split(r'[\s<>=~!;\[]', line.strip(), 1)[0] for line in f if line.strip()]
+    missing = [package for package in packages if importlib.util.find_spec(package.replace('-', '_')) is None]
+    if 'tiktoken' in packages and 'tiktoken' not in missing and not tiktoken_encoding_available():
+        missing.append("tiktoken's cl100k_base encoding (not cached and cannot be downloaded)")
+    return missing
+
+
+def tiktoken_encoding_available() -> bool:
+    # In a subprocess with a timeout, since loading it may wait on the network
+    try:
+        return subprocess.run([sys.executable, '-c', 'import tiktoken; tiktoken.get_encoding("cl100k_base")'],
+                              capture_output=True, timeout=60).returncode == 0
+    except subprocess.TimeoutExpired:
+        return False
+
+
+def questions(turns: int) -> List[str]:
+    # Distinct questions, so the answer cache does not answer the later turns
+    return [QUESTIONS[turn % len(QUESTIONS)] + (f" ({turn // len(QUESTIONS)})" if turn >= len(QUESTIONS) else "")
+            for turn in range(turns)]
+
+
+def prepare(directory: str, folder: str, data: List[str], stream: bool, metrics: str = 'json'):
+    """
+    Give the scratch directory the sample's data files and a copy of its config.ini with a fake key and, by default,
+    the JSON metrics log on.
+    """
+    for name in data:
+        os.symlink(os.path.join(ROOT, folder, name), os.path.join(directory, name))
+    source = os.path.join(ROOT, folder, 'config.ini')
+    if not os.path.exists(source):
+        return
+    config = configparser.ConfigParser()
+    config.read(source)
+    for key in config['API_KEYS']:
+        config['API_KEYS'][key] = 'sk-replay'
+    if not config.has_section('SETTINGS'):
+        config.add_section('SETTINGS')
+    config['SETTINGS']['METRICS'] = metrics
+    config['SETTINGS']['METRICS_FILE'] = METRICS_FILE
+    config['SETTINGS']['STREAM'] = str(stream).lower()
+    with open(os.path.join(directory, 'config.ini'), 'w') as f:
+        config.write(f)
+
+
+def read_metrics(path: str) -> Dict[str, dict]:
+    """
+    :param path: JSON metrics log of one run
+    :return: per-stage latency summaries and counter totals. Stages with labels, like the tool name, are
+             reported per label value
+    """
+    timings = defaultdict(list)
+    counts = defaultdict(float)
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                event = json.loads(line)
+                labels = {key: value for key, value in event.items()
+                          if key not in ("type", "stage", "name", "seconds", "value", "time")}
+                suffix = ",".join(f"{key}={value}" for key, value in sorted(labels.items()))
+                if event["type"] == "timing":
+                    timings[event["stage"] + (f"[{suffix}]" if suffix else "")].append(event["seconds"])
+                else:
+                    counts[event["name"] + (f"[{suffix}]" if suffix else "")] += event["value"]
+    return {"stages": {stage: latency_summary(values) for stage, values in sorted(timings.items())},
+            "counts": dict(sorted(counts.items()))}
+
+
+async def run_sample(script: str, directory: str, stdin: str, env: Dict[str, str], timeout: float) -> dict:
+    """
+    Run one sample to completion and collect its metrics.
+    """
+    metrics_path = os.path.join(directory, METRICS_FILE)
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, script, cwd=directory, env=env,
+                                                   stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    try:
+        _, stderr = await asyncio.wait_for(process.communicate(stdin.encode('utf-8')), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        _, stderr = await process.communicate()
+    wall = time.perf_counter() - started
+    result = {"exit": process.returncode, "wall_s": wall, **read_metrics(metrics_path)}
+    requests = result["stages"].get("request", {}).get("count", 0)
+    result["requests"] = requests
+    result["requests_per_s"] = requests / wall if wall else 0.0
+    if process.returncode:
+        result["stderr"] = stderr.decode('utf-8', errors='replace').strip().splitlines()[-5:]
+    return result
+
+
+def report(name: str, run: str, result: dict, server_counts: Dict[str, int]):
+    print(f"\n{name} ({run}): exit={result['exit']}  wall={result['wall_s']:.2f}s  requests={result['requests']}  "
+          f"requests/s={result['requests_per_s']:.2f}  mock API calls: "
+          + ", ".join(f"{path}={count}" for path, count in sorted(server_counts.items())))
+    for stage, summary in result["stages"].items():
+        print_row(f"  {stage}", summary)
+    if result["counts"]:
+        print("  " + "  ".join(f"{key}={value:g}" for key, value in result["counts"].items()))
+    for line in result.get("stderr", []):
+        print(f"  ! {line}")
+
+
+def regressions(results: dict, baseline: dict, tolerance: float, slack_ms: float) -> List[str]:
+    """
+    :return: one line per sample that failed and per stage whose p95 is more than `tolerance` times, and more than
+             `slack_ms` above, its baseline
+    """
+    found = []
+    for name, runs in results.items():
+        for run, result in runs.items():
+            if result["exit"]:
+                found.append(f"{name} ({run}) exited with {result['exit']}")
+            base_stages = baseline.get(name, {}).get(run, {}).get("stages", {})
+            for stage, summary in result["stages"].items():
+                base = base_stages.get(stage)
+                if base and summary["p95_ms"] > max(base["p95_ms"] * tolerance, base["p95_ms"] + slack_ms):
+                    found.append(f"{name} ({run}) {stage}: p95 {summary['p95_ms']:.1f} ms, "
+                                 f"baseline {base['p95_ms']:.1f} ms")
+    return found
+
+
+async def main(args) -> int:
+    results = {}
+    async with MockOpenAIServer(latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate,
+                                server_error_rate=args.server_error_rate) as server:
+        env = {**os.environ, "OPENAI_API_BASE": server.base_url, "OPENAI_API_KEY": "sk-replay", "METRICS": "json",
+               "PYTHONUNBUFFERED": "1", "ANONYMIZED_TELEMETRY": "False"}
+        print(f"Mock API at {server.base_url}: latency={args.latency}s  token_delay={args.token_delay}s  "
+              f"429 rate={args.error_rate}  500 rate={args.server_error_rate}  stream={args.stream}")
+        for name in args.samples:
+            folder, script, data, interactive, warm_answers = SAMPLES[name]
+            missing = missing_dependencies(folder)
+            if missing:
+                print(f"\n{name}: skipped, {folder} needs {', '.join(missing)}")
+                continue
+            results[name] = {}
+            with tempfile.TemporaryDirectory() as directory:
+                prepare(directory, folder, data, args.stream)
+                for run in ("cold", "warm")[:args.runs]:
+                    lines = (warm_answers if run == "warm" else []) + questions(args.turns) + ["exit", ""]
+                    stdin = "\n".join(lines) if interactive else ""
+                    before = dict(server.endpoints)
+                    result = await run_sample(os.path.join(ROOT, folder, script), directory, stdin, env,
+                                              args.timeout)
+                    results[name][run] = result
+                    report(name, run, result, {path: count - before.get(path, 0)
+                                               for path, count in server.endpoints.items()})
+        print(f"\nMock API: {server.requests} requests, {server.errors} injected errors")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    found = [f"{name} ({run}) exited with {result['exit']}"
+             for name, runs in results.items() for run, result in runs.items() if result["exit"]]
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance, args.slack_ms)
+    for line in found:
+        print(f"REGRESSION: {line}" if "p95" in line else f"FAILED: {line}")
+    return 1 if found else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--samples', nargs='+', choices=list(SAMPLES), default=list(SAMPLES))
+    parser.add_argument('--turns', type=int, default=10, help='questions asked in each run of an interactive sample')
+    parser.add_argument('--runs', type=int, choices=(1, 2), default=2, help='1 for the cold run only')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the mock waits before answering')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='seconds between streamed tokens')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests rejected with a 429')
+    parser.add_argument('--server-error-rate', type=float, default=0.0, help='fraction of requests failed with a 500')
+    parser.add_argument('--stream', action='store_true', help='stream the chat and bot responses')
+    parser.add_argument('--timeout', type=float, default=600, help='seconds a sample may run before it is killed')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed p95 slowdown against the baseline')
+    parser.add_argument('--slack-ms', type=float, default=5.0, help='p95 increase always allowed, in milliseconds')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,149 @@
+"""
+The resilient request layer (common/resilience.py) against the local mock of the OpenAI API with injected faults.
+- faults: a fraction of the requests fails with a 429 or a 500. Compares the success rate and latency of the plain
+  pooled client, which fails with the first error, with the ResilientClient, which retries.
+- tail: a fraction of the requests is a straggler. Compares p95 and p99 without and with hedged requests, and the
+  extra requests hedging sent. Requests are hedged after the p95 latency, so this helps while stragglers are rarer
+  than 5% of the requests.
+- outage: every request fails for a while, then the API recovers. Shows the circuit breaker failing requests at once
+  instead of sending them, and closing again after its trial request.
+- deadline: every request is a straggler. Shows calls given up at the deadline instead of waiting for the answer.
+- langchain: the faults run through a LangChain OpenAI LLM with use_resilient_client(), synchronously and
+  asynchronously.
+    python bench_resilience.py --requests 300 --concurrency 10 --fault-rate 0.1
+"""
+import argparse
+import asyncio
+import time
+from typing import Awaitable, Callable, List
+
+import openai
+from langchain.llms import OpenAI
+
+from bench_utils import latency_summary, print_row
+from common.http_client import OpenAIHTTPClient
+from common.resilience import DeadlineExceeded, ResilientClient, use_resilient_client
+from mock_openai_server import MockOpenAIServer
+
+
+async def run(name: str, call: Callable[[], Awaitable], total: int, concurrency: int, server: MockOpenAIServer,
+              **extra):
+    """
+    Make `total` calls, `concurrency` at a time, and print the latencies of the successful ones and the failures by
+    type.
+    """
+    latencies: List[float] = []
+    failures = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    sent = server.requests
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call()
+                latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+
+    await asyncio.gather(*(one() for _ in range(total)))
+    print_row(name, latency_summary(latencies), success=f"{len(latencies) / total:.1%}",
+              sent=server.requests - sent, **extra, **failures)
+
+
+async def faults(args):
+    print(f"\nfaults: {args.fault_rate:.0%} 429s and {args.fault_rate:.0%} 500s, latency {args.latency * 1000:.0f}ms")
+    async with MockOpenAIServer(latency=args.latency, error_rate=args.fault_rate,
+                                server_error_rate=args.fault_rate) as server:
+        async with OpenAIHTTPClient('mock', api_base=server.base_url) as client:
+            await run("plain client", lambda: client.completion("Hello\n"), args.requests, args.concurrency, server)
+            # Scattered faults, not an outage: keep the circuit breaker out of the way
+            resilient = ResilientClient(base_delay=0.05, failure_threshold=args.requests)
+            await run("resilient client", lambda: resilient.call("/completions", lambda: client.completion("Hello\n")),
+                      args.requests, args.concurrency, server)
+            print(f"  {resilient.stats}")
+
+
+async def tail(args):
+    print(f"\ntail: {args.slow_rate:.0%} of the requests take {args.slow_latency * 1000:.0f}ms instead of "
+          f"{args.latency * 1000:.0f}ms")
+    async with MockOpenAIServer(latency=args.latency, slow_rate=args.slow_rate,
+                                slow_latency=args.slow_latency) as server:
+        async with OpenAIHTTPClient('mock', api_base=server.base_url) as client:
+            for hedge in (False, True):
+                resilient = ResilientClient(hedge=hedge, max_hedge_ratio=2 * args.slow_rate)
+                call = lambda: resilient.call("/completions", lambda: client.completion("Hello\n"))
+                # Warm up the latency percentiles hedging is based on
+                await run("warm-up", call, 50, 1, server)
+                await run("hedged" if hedge else "not hedged", call, args.requests, args.concurrency, server)
+                print(f"  {resilient.stats}")
+
+
+async def outage(args):
+    print(f"\noutage: every request fails with a 500 for {args.outage:.1f}s, then the API recovers")
+    async with MockOpenAIServer(latency=args.latency, server_error_rate=1.0) as server:
+        async with OpenAIHTTPClient('mock', api_base=server.base_url) as client:
+            resilient = ResilientClient(base_delay=0.05, max_retries=2, reset_timeout=args.outage / 2)
+            call = lambda: resilient.call("/completions", lambda: client.completion("Hello\n"))
+            started = time.perf_counter()
+            while time.perf_counter() - started < args.outage:
+                await run(f"t={time.perf_counter() - started:.1f}s", call, args.concurrency, args.concurrency,
+                          server, breaker=resilient.breaker("/completions").state)
+                await asyncio.sleep(args.outage / 10)
+            server.server_error_rate = 0.0
+            while resilient.breaker("/completions").state != "closed":
+                await run(f"t={time.perf_counter() - started:.1f}s recovered", call, args.concurrency,
+                          args.concurrency, server, breaker=resilient.breaker("/completions").state)
+                await asyncio.sleep(args.outage / 10)
+            print(f"  {resilient.stats}")
+
+
+async def deadline(args):
+    print(f"\ndeadline: every request takes {args.slow_latency * 1000:.0f}ms, the deadline is "
+          f"{args.slow_latency / 4 * 1000:.0f}ms")
+    async with MockOpenAIServer(slow_rate=1.0, slow_latency=args.slow_latency) as server:
+        async with OpenAIHTTPClient('mock', api_base=server.base_url) as client:
+            resilient = ResilientClient(deadline=args.slow_latency / 4, base_delay=0.01)
+            started = time.perf_counter()
+            try:
+                await resilient.call("/completions", lambda: client.completion("Hello\n"))
+            except DeadlineExceeded as e:
+                print(f"{'given up':<28} after {(time.perf_counter() - started) * 1000:.0f}ms: {e} "
+                      f"(last error {type(e.__cause__).__name__})")
+
+
+async def langchain(args):
+    print(f"\nlangchain: OpenAI LLM with {args.fault_rate:.0%} 429s and {args.fault_rate:.0%} 500s")
+    async with MockOpenAIServer(latency=args.latency, error_rate=args.fault_rate,
+                                server_error_rate=args.fault_rate) as server:
+        openai.api_base = server.base_url
+        resilient = ResilientClient(base_delay=0.05, failure_threshold=args.requests)
+        llm = use_resilient_client(OpenAI(openai_api_key='mock', max_tokens=50), resilient)
+        total = args.requests // 10
+        await run("agenerate", lambda: llm.agenerate(["Hello"]), total, args.concurrency, server)
+        await run("generate", lambda: asyncio.get_running_loop().run_in_executor(None, llm.generate, ["Hello"]),
+                  total, 1, server)
+        print(f"  {resilient.stats}")
+
+
+SCENARIOS = {"faults": faults, "tail": tail, "outage": outage, "deadline": deadline, "langchain": langchain}
+
+
+async def main(args):
+    for name in args.scenarios:
+        await SCENARIOS[name](args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds the mock waits before answering')
+    parser.add_argument('--fault-rate', type=float, default=0.1, help='fraction of requests failed with a 429, '
+                                                                      'and again with a 500')
+    parser.add_argument('--slow-rate', type=float, default=0.02,
+                        help='fraction of straggler requests; hedging at p95 helps when it is below 5%%')
+    parser.add_argument('--slow-latency', type=float, default=0.5, help='seconds a straggler takes')
+    parser.add_argument('--outage', type=float, default=2.0, help='seconds every request fails for')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,148 @@
+"""
+Startup time of the Conversation Bot and the PDF QA chat, against the local mock of the OpenAI API.
+Cold: the app runs on its own, importing LangChain and loading its chain or vector database in the background while it
+waits for the first question. Warm: the app connects to a resident daemon started with `serve`, which has everything
+loaded. For both, the time from starting the process to its prompt and to the answer to a first question is measured
+over `--runs` runs, with the time `import langchain` alone takes (which the apps used to pay before their prompt) for
+reference.
+    python bench_startup.py --runs 5
+The PDF QA index is built once before the runs; like the chat itself, that needs tiktoken for OpenAIEmbeddings.
+"""
+import argparse
+import asyncio
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from bench_replay import QUESTIONS, ROOT, SAMPLES, prepare
+from bench_utils import latency_summary, print_row
+from mock_openai_server import MockOpenAIServer
+
+# Sample name -> prompt of the app, and the answers to the other questions it may ask
+APPS = {
+    "bot": ("Your message: ", {"(Y/N): ": "n"}),
+    "pdf": ("Your question: ", {}),
+}
+SOCKETS = {"bot": "conversation-bot.sock", "pdf": "pdf-qa.sock"}
+
+
+async def read_until(stream: asyncio.StreamReader, marker: str, buffer: List[str], answers: Dict[str, str],
+                     stdin: asyncio.StreamWriter, timeout: float):
+    # Read the output until `marker` shows up, answering the other prompts on the way
+    deadline = time.perf_counter() + timeout
+    while True:
+        text = "".join(buffer)
+        if marker in text:
+            buffer[:] = [text[text.index(marker) + len(marker):]]
+            return
+        for prompt, answer in answers.items():
+            if text.endswith(prompt):
+                stdin.write(f"{answer}\n".encode('utf-8'))
+                buffer[:] = []
+        chunk = await asyncio.wait_for(stream.read(4096), max(0.0, deadline - time.perf_counter()))
+        if not chunk:
+            raise RuntimeError(f"The app exited before printing {marker!r}:\n{text[-2000:]}")
+        buffer.append(chunk.decode('utf-8', errors='replace'))
+
+
+async def time_to_answer(script: str, directory: str, env: Dict[str, str], question: str, answer_marker: str,
+                         prompt: str, answers: Dict[str, str], timeout: float) -> Tuple[float, float]:
+    """
+    :return: seconds from starting the app to its prompt, and to the answer to `question`
+    """
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, script, cwd=directory, env=env,
+                                                   stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.STDOUT)
+    buffer: List[str] = []
+    try:
+        await read_until(process.stdout, prompt, buffer, answers, process.stdin, timeout)
+        prompted = time.perf_counter() - started
+        process.stdin.write(f"{question}\n".encode('utf-8'))
+        await read_until(process.stdout, answer_marker, buffer, answers, process.stdin, timeout)
+        answered = time.perf_counter() - started
+        process.stdin.write(b"exit\n")
+        await process.communicate()
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+    return prompted, answered
+
+
+async def start_daemon(script: str, directory: str, env: Dict[str, str], socket_name: str,
+                       timeout: float) -> Tuple[subprocess.Popen, float]:
+    started = time.perf_counter()
+    daemon = subprocess.Popen([sys.executable, script, "serve"], cwd=directory, env=env, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE)
+    socket_path = os.path.join(directory, socket_name)
+    while not os.path.exists(socket_path):
+        if daemon.poll() is not None:
+            raise RuntimeError(f"The daemon exited: {daemon.stderr.read().decode('utf-8', errors='replace')[-2000:]}")
+        if time.perf_counter() - started > timeout:
+            daemon.kill()
+            raise RuntimeError("The daemon did not start in time")
+        await asyncio.sleep(0.01)
+    return daemon, time.perf_counter() - started
+
+
+def import_time(module: str) -> float:
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+    return time.perf_counter() - started
+
+
+def report(name: str, runs: List[Tuple[float, float]], **extra):
+    print_row(f"{name} to prompt", latency_summary([prompted for prompted, _ in runs]))
+    print_row(f"{name} to answer", latency_summary([answered for _, answered in runs]), **extra)
+
+
+async def bench_app(name: str, server: MockOpenAIServer, env: Dict[str, str], args):
+    folder, script_name, data, _, _ = SAMPLES[name]
+    prompt, answers = APPS[name]
+    script = os.path.join(ROOT, folder, script_name)
+    # The mock answers every question with this text
+    answer_marker = server.completion.split()[-1]
+    with tempfile.TemporaryDirectory() as directory:
+        prepare(directory, folder, data, stream=False, metrics='off')
+        if name == "pdf":
+            # Summaries and index are built once; the runs measure loading them
+            build = subprocess.run([sys.executable, script, "ingest"], cwd=directory, env=env, capture_output=True)
+            if build.returncode:
+                print(f"{name}: building the index failed, skipped\n"
+                      + build.stderr.decode('utf-8', errors='replace').strip().splitlines()[-1])
+                return
+        cold = [await time_to_answer(script, directory, env, f"{QUESTIONS[run % len(QUESTIONS)]} ({run})",
+                                     answer_marker, prompt, answers, args.timeout) for run in range(args.runs)]
+        report(f"{name} cold", cold)
+
+        daemon, started = await start_daemon(script, directory, env, SOCKETS[name], args.timeout)
+        try:
+            warm = [await time_to_answer(script, directory, env, f"{QUESTIONS[run % len(QUESTIONS)]} [{run}]",
+                                         answer_marker, prompt, answers, args.timeout) for run in range(args.runs)]
+        finally:
+            daemon.send_signal(signal.SIGINT)
+            daemon.wait(args.timeout)
+        report(f"{name} warm", warm, daemon_start_s=started)
+
+
+async def main(args):
+    print_row("import langchain", latency_summary([import_time("langchain") for _ in range(args.runs)]))
+    async with MockOpenAIServer(latency=args.latency) as server:
+        env = {**os.environ, "OPENAI_API_BASE": server.base_url, "OPENAI_API_KEY": "sk-startup",
+               "PYTHONUNBUFFERED": "1", "ANONYMIZED_TELEMETRY": "False"}
+        for name in args.apps:
+            await bench_app(name, server, env, args)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--apps', nargs='+', choices=list(APPS), default=list(APPS))
+    parser.add_argument('--runs', type=int, default=5, help='starts measured per app and mode')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds the mock waits before answering')
+    parser.add_argument('--timeout', type=float, default=300, help='seconds to wait for a prompt or an answer')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,43 @@
+"""
+Time to first visible output with and without streaming, against the local mock server's SSE endpoint.
+Without streaming nothing can be shown until the whole completion has arrived.
+    python bench_streaming.py --requests 20 --latency 0.2 --token-delay 0.03
+"""
+import argparse
+import asyncio
+import time
+
+from bench_utils import latency_summary, print_row
+from common.http_client import OpenAIHTTPClient
+from common.streaming import ListSink, StreamStats, stream_to_sink
+from mock_openai_server import MockOpenAIServer
+
+
+async def main(args):
+    async with MockOpenAIServer(latency=args.latency, token_delay=args.token_delay) as server:
+        async with OpenAIHTTPClient('mock', api_base=server.base_url) as client:
+            whole, first_tokens, totals = [], [], []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                await client.completion("Hello\n")
+                whole.append(time.perf_counter() - started)
+
+                stats = StreamStats()
+                sink = ListSink()
+                await stream_to_sink(client.stream_completion("Hello\n"), sink, stats)
+                first_tokens.append(stats.time_to_first_token)
+                totals.append(stats.total_time)
+
+    print(f"{args.requests} requests, server latency {args.latency * 1000:.0f}ms, "
+          f"{len(server.tokens())} tokens {args.token_delay * 1000:.0f}ms apart")
+    print_row("whole response", latency_summary(whole))
+    print_row("streaming: first token", latency_summary(first_tokens))
+    print_row("streaming: last token", latency_summary(totals))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.2, help='mock server latency before the first token')
+    parser.add_argument('--token-delay', type=float, default=0.03, help='seconds between streamed tokens')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,77 @@
+"""
+Map-reduce summarization of the PDFs in `PDF QA/papers` with a local fake LLM that waits `--llm-latency` seconds per
+call like the completions API. Compares one LLM call at a time with concurrent calls, and a run resuming from the
+checkpoint, where only a changed file is summarized again.
+    python bench_summarize.py --llm-latency 0.5 --concurrency 8
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+from bench_utils import print_row
+
+PDF_QA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'PDF QA')
+sys.path.append(PDF_QA_DIR)
+
+
+def fake_llm(latency: float):
+    from langchain.llms.base import LLM
+
+    class FakeLLM(LLM):
+        @property
+        def _llm_type(self) -> str:
+            return "fake"
+
+        def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+            time.sleep(latency)
+            return "A summary was written."
+
+        async def _acall(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+            await asyncio.sleep(latency)
+            return "A summary was written."
+
+    return FakeLLM()
+
+
+def run(name: str, file_paths: List[str], output_file: str, latency: float, concurrency: int):
+    from summarize import PDFSummarizer, SummaryCheckpoint
+
+    summarizer = PDFSummarizer(fake_llm(latency), max_concurrency=concurrency)
+    started = time.perf_counter()
+    summarizer.summarize_files(file_paths, SummaryCheckpoint(output_file))
+    stats = summarizer.stats
+    print_row(name, {"seconds": time.perf_counter() - started}, summarized=stats.summarized, resumed=stats.resumed,
+              chunks=stats.chunks, llm_calls=stats.llm_calls)
+
+
+def main(args):
+    papers = os.path.join(PDF_QA_DIR, 'papers')
+    work_dir = tempfile.mkdtemp()
+    try:
+        file_paths = []
+        for file_name in sorted(os.listdir(papers)):
+            if file_name.lower().endswith(".pdf"):
+                file_paths.append(os.path.join(work_dir, file_name))
+                shutil.copy(os.path.join(papers, file_name), file_paths[-1])
+        output_file = os.path.join(work_dir, "summaries.json")
+
+        run("one call at a time", file_paths, output_file, args.llm_latency, 1)
+        os.remove(output_file)
+        run(f"{args.concurrency} concurrent calls", file_paths, output_file, args.llm_latency, args.concurrency)
+        with open(file_paths[0], "ab") as f:
+            f.write(b"\n% changed\n")
+        run("resume, one file changed", file_paths, output_file, args.llm_latency, args.concurrency)
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--llm-latency', type=float, default=0.5, help='seconds per LLM call')
+    parser.add_argument('--concurrency', type=int, default=8)
+    main(parser.parse_args())
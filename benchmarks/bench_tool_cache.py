@@ -0,0 +1,88 @@
+"""
+Repeated runs of the Using Agents and Tools agent with and without the tool result cache, with the fake LLM, date
+LLM and search of bench_agent_tools.py waiting `--latency` seconds each. The agent asks for a date the rules of the
+Date Parser do not cover, so both tools reach their backend on a miss. Reports the latency per run, the calls that
+reached the date LLM and the search, and the cache's hits, misses and time saved; then reopens the SQLite file the
+cache was persisted to and runs again, as a new process would.
+    python bench_tool_cache.py --latency 0.2 --runs 10
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from bench_agent_tools import ANSWER, FakeSearch, fake_llm
+from bench_utils import latency_summary, print_row
+
+PLAN = ("I need the date the warranty expires and the movies released then.\n"
+        "Action 1: Date Parser\n"
+        "Action Input 1: the date one month after Charlie bought his phone today\n"
+        "Action 2: Search\n"
+        "Action Input 2: Hollywood movies released next month")
+QUESTION = "When does a warranty of one month starting today expire, and which movie is released that day?"
+
+
+class CountingSearch(FakeSearch):
+    calls = 0
+
+    def run(self, query: str) -> str:
+        self.calls += 1
+        return super().run(query)
+
+    async def arun(self, query: str) -> str:
+        self.calls += 1
+        return await super().arun(query)
+
+
+def build(latency: float, cache):
+    from agent_tools import DateParserTool, create_agent, search_tool
+    from common.tool_cache import CachedTool, expires_at_midnight
+
+    agent_llm = fake_llm(latency, lambda prompt: ANSWER if "Observation 2:" in prompt.split("Begin!")[-1] else PLAN)
+    date_llm = fake_llm(latency, lambda prompt: "Wednesday, November 18, 2026")
+    date_parser = DateParserTool(llm=date_llm)
+    date_parser.llm_chain.verbose = False
+    search = CountingSearch(latency)
+    tools = [date_parser, search_tool(search)]
+    if cache is not None:
+        tools = [CachedTool(tools[0], cache, ttl=expires_at_midnight), CachedTool(tools[1], cache, ttl=6 * 3600)]
+    return create_agent(agent_llm, tools, verbose=False), tools, date_llm, search
+
+
+def run(name: str, args, cache):
+    agent, tools, date_llm, search = build(args.latency, cache)
+
+    async def runs():
+        latencies = []
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            await agent.arun(QUESTION)
+            latencies.append(time.perf_counter() - started)
+        return latencies
+
+    print_row(name, latency_summary(asyncio.run(runs())), date_llm_calls=date_llm.calls, searches=search.calls)
+    for tool in tools:
+        if hasattr(tool, "stats") and hasattr(tool, "cache"):
+            print(f"  {tool.name}: {tool.stats}")
+
+
+def main(args):
+    from common.tool_cache import ToolResultCache
+
+    run("no cache", args, None)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "tool_cache.sqlite")
+        cache = ToolResultCache(path=path)
+        run("cache", args, cache)
+        cache.close()
+        cache = ToolResultCache(path=path)
+        run("cache reopened", args, cache)
+        cache.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per LLM call and search')
+    parser.add_argument('--runs', type=int, default=10)
+    main(parser.parse_args())
@@ -0,0 +1,48 @@
+"""
+Small helpers shared by the benchmark scripts.
+"""
+import os
+import sys
+from typing import Dict, List
+
+# Make the `common` package importable when a benchmark is run from this folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """
+    Nearest-rank percentile of a list of values.
+    :param values: samples
+    :param pct: percentile between 0 and 100
+    :return: the percentile value, or 0.0 for an empty list
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """
+    Summarize latencies given in seconds as milliseconds.
+    :param latencies: per-request latencies in seconds
+    :return: dict with the count, mean, p50, p95 and p99 in milliseconds
+    """
+    count = len(latencies)
+    return {
+        "count": count,
+        "mean_ms": 1000 * sum(latencies) / count if count else 0.0,
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+    }
+
+
+def print_row(name: str, summary: Dict[str, float], **extra):
+    """
+    Print one benchmark result line.
+    """
+    fields = [f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}"
+              for key, value in {**summary, **extra}.items()]
+    print(f"{name:<28} " + "  ".join(fields))
@@ -0,0 +1,104 @@
+"""
+Recall@k and queries per second of MemmapVectorStore (exact NumPy search and HNSW) against Chroma, on synthetic
+clustered vectors. Recall is measured against the exact top-k computed with NumPy. Build and open times are
+reported too, since opening the index is part of the startup of the samples.
+    python bench_vectorstore.py --vectors 20000 --dim 384 --queries 200 --k 10
+"""
+import argparse
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+
+from bench_utils import print_row
+from common.vectorstore import MemmapVectorStore
+
+
+def synthetic_vectors(rng: np.random.Generator, centers: np.ndarray, count: int) -> np.ndarray:
+    # Points scattered around topic centers, like the embeddings of chunks about a handful of subjects
+    vectors = centers[rng.integers(0, len(centers), count)] + 0.5 * rng.normal(size=(count, centers.shape[1]))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def lookup_embeddings(vectors: np.ndarray):
+    # Texts are row numbers, so every store gets exactly the same vectors without calling a model
+    from langchain.embeddings.base import Embeddings
+
+    class LookupEmbeddings(Embeddings):
+        def embed_documents(self, texts: List[str]) -> List[List[float]]:
+            return vectors[[int(text) for text in texts]].tolist()
+
+        def embed_query(self, text: str) -> List[float]:
+            return vectors[int(text)].tolist()
+
+    return LookupEmbeddings()
+
+
+def run(name, search, queries: np.ndarray, truth: List[set], k: int, build_seconds: float, open_seconds: float):
+    recalls = []
+    started = time.perf_counter()
+    for query, expected in zip(queries, truth):
+        found = {int(document.page_content) for document in search(query.tolist(), k)}
+        recalls.append(len(found & expected) / k)
+    elapsed = time.perf_counter() - started
+    print_row(name, {f"recall@{k}": float(np.mean(recalls)), "qps": len(queries) / elapsed},
+              build_s=build_seconds, open_s=open_seconds)
+
+
+def main(args):
+    rng = np.random.default_rng(42)
+    centers = rng.normal(size=(args.clusters, args.dim))
+    vectors = synthetic_vectors(rng, centers, args.vectors)
+    queries = synthetic_vectors(rng, centers, args.queries)
+    scores = queries @ vectors.T
+    truth = [set(np.argsort(-row)[:args.k].tolist()) for row in scores]
+    embeddings = lookup_embeddings(vectors)
+    texts = [str(row) for row in range(args.vectors)]
+    print(f"{args.vectors} vectors of {args.dim} dimensions, {args.queries} queries, k={args.k}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        MemmapVectorStore.from_texts(texts, embeddings, persist_directory=directory, index="exact")
+        build_seconds = time.perf_counter() - started
+        for index in ("exact", "hnsw"):
+            started = time.perf_counter()
+            store = MemmapVectorStore(directory, embeddings, index=index, hnsw_ef_search=args.ef_search)
+            open_seconds = time.perf_counter() - started
+            extra_build = 0.0
+            if index == "hnsw":
+                # The graph is built by the first search and saved by persist()
+                started = time.perf_counter()
+                store.similarity_search_by_vector(queries[0].tolist(), args.k)
+                store.persist()
+                extra_build = time.perf_counter() - started
+            run(f"MemmapVectorStore {index}", store.similarity_search_by_vector, queries, truth, args.k,
+                build_seconds + extra_build, open_seconds)
+
+    if not args.skip_chroma:
+        from langchain.vectorstores import Chroma
+
+        with tempfile.TemporaryDirectory() as directory:
+            started = time.perf_counter()
+            store = Chroma.from_texts(texts, embeddings, persist_directory=directory,
+                                      collection_name="bench_vectorstore")
+            store.persist()
+            build_seconds = time.perf_counter() - started
+            del store
+            started = time.perf_counter()
+            store = Chroma(persist_directory=directory, embedding_function=embeddings,
+                           collection_name="bench_vectorstore")
+            open_seconds = time.perf_counter() - started
+            run("Chroma", store.similarity_search_by_vector, queries, truth, args.k, build_seconds, open_seconds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vectors', type=int, default=20000)
+    parser.add_argument('--dim', type=int, default=384)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--clusters', type=int, default=50, help='topic centers of the synthetic vectors')
+    parser.add_argument('--ef-search', type=int, default=64, help='HNSW query-time search width')
+    parser.add_argument('--skip-chroma', action='store_true')
+    main(parser.parse_args())
@@ -0,0 +1,209 @@
+"""
+A local stand-in for the OpenAI REST API, used by the benchmarks so they can run without network access or an API key.
+Run it on its own with:
+    python mock_openai_server.py --port 8080 --latency 0.05
+and point a client at http://127.0.0.1:8080/v1
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+from aiohttp import web
+
+
+class MockOpenAIServer:
+    """
+    Minimal OpenAI look-alike. Every completion request waits for `latency` seconds and then echoes a fixed answer.
+    Requests with `"stream": true` get the answer as server-sent events, one token every `token_delay` seconds.
+    Embedding requests get one unit vector per input, derived from a hash of the input, so the same text always has
+    the same embedding.
+    A fraction `error_rate` of the requests is answered with a 429 and a Retry-After header instead, and a fraction
+    `server_error_rate` with a 500. A fraction `slow_rate` waits `slow_latency` seconds instead of `latency`, like the
+    stragglers that make up the tail latency of the real API.
+    The server counts the requests, by endpoint, and the distinct TCP connections it has seen, which is how the
+    benchmarks show connection reuse.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0, token_delay: float = 0.0,
+                 completion: str = "\n\nThis is a mock completion streamed one token at a time.",
+                 error_rate: float = 0.0, retry_after: float = 0.1, server_error_rate: float = 0.0,
+                 dimensions: int = 1536, slow_rate: float = 0.0, slow_latency: float = 1.0):
+        """
+        :param host: interface to bind to
+        :param port: port to bind to. 0 picks a free port, read it back from `base_url` after start()
+        :param latency: seconds each request waits before answering (before the first token when streaming)
+        :param token_delay: seconds between streamed tokens
+        :param completion: text returned for every completion
+        :param error_rate: fraction of requests rejected with a 429
+        :param retry_after: Retry-After value, in seconds, sent with the 429 responses
+        :param server_error_rate: fraction of requests failed with a 500
+        :param dimensions: size of the embedding vectors
+        :param slow_rate: fraction of requests answered after `slow_latency` seconds
+        :param slow_latency: seconds a slow request waits before answering
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.token_delay = token_delay
+        self.completion = completion
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.server_error_rate = server_error_rate
+        self.dimensions = dimensions
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.errors = 0
+        self.requests = 0
+        self.endpoints = Counter()
+        self.connections = set()
+        self._runner: Optional[web.AppRunner] = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v1/completions', self.completions)
+        app.router.add_post('/v1/embeddings', self.embeddings)
+        # The openai package calls the per-engine path when it is given an engine, as langchain's embeddings do
+        app.router.add_post('/v1/engines/{engine}/embeddings', self.embeddings)
+        return app
+
+    def _track(self, request: web.Request):
+        self.requests += 1
+        self.endpoints[request.path] += 1
+        self.connections.add(id(request.transport))
+
+    def _fault(self) -> Optional[web.Response]:
+        """
+        :return: the injected error response for this request, or None to answer it
+        """
+        if self.error_rate and random.random() < self.error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"message": "Rate limit reached", "type": "requests"}},
+                                     status=429, headers={"Retry-After": str(self.retry_after)})
+        if self.server_error_rate and random.random() < self.server_error_rate:
+            self.errors += 1
+            return web.json_response({"error": {"message": "The server had an error", "type": "server_error"}},
+                                     status=500)
+        return None
+
+    async def _wait(self):
+        latency = self.slow_latency if self.slow_rate and random.random() < self.slow_rate else self.latency
+        if latency:
+            await asyncio.sleep(latency)
+
+    async def completions(self, request: web.Request) -> web.Response:
+        self._track(request)
+        payload = await request.json()
+        fault = self._fault()
+        if fault is not None:
+            return fault
+        await self._wait()
+        if payload.get("stream"):
+            return await self.stream_completion(request, payload)
+        tokens = self.tokens()
+        if self.token_delay:
+            # The whole answer is only sent once every token has been "generated"
+            await asyncio.sleep(self.token_delay * (len(tokens) - 1))
+        return web.json_response({
+            "id": f"cmpl-mock-{self.requests}",
+            "object": "text_completion",
+            "model": payload.get("model", "mock"),
+            "choices": [{"text": self.completion, "index": 0, "logprobs": None, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 5, "completion_tokens": len(tokens), "total_tokens": 5 + len(tokens)}
+        })
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        self._track(request)
+        payload = await request.json()
+        fault = self._fault()
+        if fault is not None:
+            return fault
+        await self._wait()
+        inputs = payload.get("input", [])
+        # A single string, or a single list of token ids, is one input
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        tokens = sum(len(item) if isinstance(item, list) else len(item.split()) for item in inputs)
+        return web.json_response({
+            "object": "list",
+            "model": payload.get("model", "mock"),
+            "data": [{"object": "embedding", "index": index, "embedding": self.embedding(item)}
+                     for index, item in enumerate(inputs)],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        })
+
+    def embedding(self, item) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(json.dumps(item).encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def tokens(self) -> List[str]:
+        # Split the completion into word-sized tokens that keep their leading whitespace, like the real API
+        return re.findall(r'\s*\S+', self.completion)
+
+    async def stream_completion(self, request: web.Request, payload: dict) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        await response.prepare(request)
+        for index, token in enumerate(self.tokens()):
+            if index and self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            event = {
+                "id": f"cmpl-mock-{self.requests}",
+                "object": "text_completion",
+                "model": payload.get("model", "mock"),
+                "choices": [{"text": token, "index": 0, "logprobs": None, "finish_reason": None}]
+            }
+            await response.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    async def start(self):
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local mock of the OpenAI API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds each request waits before answering')
+    parser.add_argument('--token-delay', type=float, default=0.0, help='seconds between streamed tokens')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests rejected with a 429')
+    parser.add_argument('--server-error-rate', type=float, default=0.0, help='fraction of requests failed with a 500')
+    parser.add_argument('--slow-rate', type=float, default=0.0,
+                        help='fraction of requests answered after --slow-latency')
+    parser.add_argument('--slow-latency', type=float, default=1.0, help='seconds a slow request waits before answering')
+    args = parser.parse_args()
+    server = MockOpenAIServer(args.host, args.port, args.latency, args.token_delay, error_rate=args.error_rate,
+                              server_error_rate=args.server_error_rate, slow_rate=args.slow_rate,
+                              slow_latency=args.slow_latency)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+"""
+Helpers shared by the sample apps in this repository.
+The samples add the repository root to sys.path so they can import this package while still being run from their
+own folder (each one reads its config.ini from the current working directory).
+"""
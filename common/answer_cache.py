@@ -0,0 +1,227 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+PUNCTUATION = re.compile(r'[\s?.!]+$')
+WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_question(question: str) -> str:
+    """
+    Key of a question for exact matches: case, repeated whitespace and trailing punctuation are ignored.
+    """
+    return PUNCTUATION.sub('', WHITESPACE.sub(' ', question.strip().lower()))
+
+
+def document_keys(documents) -> List[str]:
+    """
+    Identify retrieved chunks by a hash of their content, which is stable across rebuilds of the index.
+    :param documents: langchain documents
+    :return: one key per document
+    """
+    return [hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()[:32] for document in documents]
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    embedding: np.ndarray
+    """Unit-length query embedding, empty when the question was not embedded."""
+    source_ids: List[str]
+    answer: str
+    index_version: str
+    created: float = field(default_factory=time.time)
+    last_used: float = field(default_factory=time.time)
+
+
+@dataclass
+class AnswerCacheStats:
+    exact_hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    evicted: int = 0
+    expired: int = 0
+    invalidated: int = 0
+
+    @property
+    def lookups(self) -> int:
+        return self.exact_hits + self.semantic_hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return (self.exact_hits + self.semantic_hits) / self.lookups if self.lookups else 0.0
+
+    def __str__(self):
+        return (f"{self.lookups} lookups, hit rate {self.hit_rate:.1%} ({self.exact_hits} exact, "
+                f"{self.semantic_hits} similar, {self.misses} misses), {self.evicted} evicted, {self.expired} expired, "
+                f"{self.invalidated} invalidated")
+
+
+class AnswerCache:
+    """
+    Answers of earlier questions, keyed by question and query embedding.
+
+    lookup() returns a cached answer when the question is an exact repeat (after normalize_question()) or when its
+    embedding has a cosine similarity of at least `similarity_threshold` with a cached one. Questions answered
+    without an embedding (e.g. by keyword search) only match exact repeats. Every entry records the
+    version of the index it was answered from; as soon as a lookup or put comes with another version, the whole
+    cache is dropped, since the answers may no longer match the documents. Entries expire after `ttl` seconds and
+    the least recently used ones are evicted beyond `max_entries`.
+
+    With `path`, entries are also kept in a SQLite file and loaded back on start, so repeated questions are served
+    across runs.
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 1000, ttl: Optional[float] = 24 * 3600,
+                 path: Optional[str] = None):
+        """
+        :param similarity_threshold: minimum cosine similarity of a near repeat, above 1 to only serve exact repeats
+        :param max_entries: maximum number of cached answers
+        :param ttl: seconds an answer stays valid, None to keep answers until they are evicted
+        :param path: SQLite file to persist the cache to, None to keep it in memory only
+        """
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = AnswerCacheStats()
+        self.index_version: Optional[str] = None
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        # Embeddings of all entries as one matrix for the similarity search, rebuilt after the entries change
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[str] = []
+        self._lock = threading.RLock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS answers (key TEXT PRIMARY KEY, question TEXT, "
+                             "embedding BLOB, source_ids TEXT, answer TEXT, index_version TEXT, created REAL, "
+                             "last_used REAL)")
+            self._db.commit()
+            self._load()
+
+    def _load(self):
+        rows = self._db.execute("SELECT key, question, embedding, source_ids, answer, index_version, created, "
+                                "last_used FROM answers ORDER BY last_used")
+        for key, question, embedding, source_ids, answer, index_version, created, last_used in rows:
+            self._entries[key] = CachedAnswer(question, np.array(array('f', embedding), dtype=np.float32),
+                                              json.loads(source_ids), answer, index_version, created, last_used)
+            self.index_version = index_version
+
+    def _expired(self, entry: CachedAnswer, now: float) -> bool:
+        return self.ttl is not None and now - entry.created > self.ttl
+
+    def _remove(self, keys: List[str]):
+        if not keys:
+            return
+        for key in keys:
+            del self._entries[key]
+        self._matrix = None
+        if self._db is not None:
+            self._db.executemany("DELETE FROM answers WHERE key = ?", [(key,) for key in keys])
+            self._db.commit()
+
+    def _check_version(self, index_version: str):
+        if index_version != self.index_version:
+            self.stats.invalidated += len(self._entries)
+            self._remove(list(self._entries))
+            self.index_version = index_version
+
+    def _search(self, embedding: np.ndarray) -> Optional[str]:
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry.embedding.size]
+            self._matrix = (np.vstack([self._entries[key].embedding for key in self._matrix_keys])
+                            if self._matrix_keys else np.zeros((0, 0), dtype=np.float32))
+        if not self._matrix_keys or embedding.size != self._matrix.shape[1]:
+            return None
+        similarities = self._matrix @ embedding
+        best = int(np.argmax(similarities))
+        return self._matrix_keys[best] if similarities[best] >= self.similarity_threshold else None
+
+    def _touch(self, key: str, entry: CachedAnswer):
+        entry.last_used = time.time()
+        self._entries.move_to_end(key)
+        if self._db is not None:
+            self._db.execute("UPDATE answers SET last_used = ? WHERE key = ?", (entry.last_used, key))
+            self._db.commit()
+
+    def lookup(self, question: str, embedding: Optional[List[float]], index_version: str) -> Optional[CachedAnswer]:
+        """
+        Find the answer of the same or a similar question, asked against the same index.
+        :param question: the new question
+        :param embedding: embedding of the new question, None to only look for an exact repeat
+        :param index_version: current version of the vector index
+        :return: the cached answer, or None
+        """
+        with self._lock:
+            self._check_version(index_version)
+            now = time.time()
+            expired = [key for key, entry in self._entries.items() if self._expired(entry, now)]
+            self.stats.expired += len(expired)
+            self._remove(expired)
+
+            key = normalize_question(question)
+            if key in self._entries:
+                self.stats.exact_hits += 1
+            else:
+                key = self._search(_unit(embedding)) if embedding is not None else None
+                if key is None:
+                    self.stats.misses += 1
+                    return None
+                self.stats.semantic_hits += 1
+            entry = self._entries[key]
+            self._touch(key, entry)
+            return entry
+
+    def put(self, question: str, embedding: Optional[List[float]], source_ids: List[str], answer: str,
+            index_version: str):
+        """
+        Cache the answer to a question.
+        :param question: the question
+        :param embedding: embedding of the question, None if it was not embedded
+        :param source_ids: keys of the chunks the answer was based on (see document_keys())
+        :param answer: the answer
+        :param index_version: version of the vector index the answer comes from
+        """
+        with self._lock:
+            self._check_version(index_version)
+            key = normalize_question(question)
+            entry = CachedAnswer(question, _unit(embedding if embedding is not None else []), list(source_ids), answer,
+                                 index_version)
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._matrix = None
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                 (key, question, entry.embedding.astype(np.float32).tobytes(),
+                                  json.dumps(entry.source_ids), answer, index_version, entry.created,
+                                  entry.last_used))
+                self._db.commit()
+            overflow = list(self._entries)[:max(0, len(self._entries) - self.max_entries)]
+            self.stats.evicted += len(overflow)
+            self._remove(overflow)
+
+    def clear(self):
+        with self._lock:
+            self._remove(list(self._entries))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+
+def _unit(embedding) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
@@ -0,0 +1,202 @@
+import re
+from bisect import bisect_left, bisect_right
+from itertools import accumulate
+from operator import add
+from typing import Generator, Iterable, Iterator, List, Optional, Tuple
+
+from langchain.text_splitter import TextSplitter
+
+from common.tokens import DEFAULT_MODEL, _encoding, get_token_counter, tiktoken
+
+PARAGRAPH = re.compile(r'\n[ \t\r\f\v]*\n\s*')
+# Space after the end of a sentence, with the closing quote or bracket kept in the sentence
+SENTENCE_END = re.compile(r'([.!?]["\')\]]?) ')
+
+
+class TokenTextChunker(TextSplitter):
+    """
+    Split text into chunks of at most `chunk_size` model tokens, on sentence and paragraph boundaries.
+
+    Text is cut into paragraphs (at blank lines) and sentences, with whitespace collapsed inside every sentence, and
+    every sentence is counted once. Sentences are packed into chunks as long as they fit; sentences of one paragraph
+    are joined by a space and paragraphs by a blank line. A new chunk starts with the last sentences of the previous
+    one, up to `chunk_overlap` tokens. A sentence longer than a whole chunk is cut at token boundaries.
+
+    Counts are exact with tiktoken installed: a sentence is counted as it appears in the chunk, after its separator,
+    and tiktoken never merges tokens across a space, so a chunk has no more tokens than the sum of its parts.
+    Without tiktoken, counts are estimated at four characters per token.
+
+    iter_chunks() works on a stream of text pieces (pages, lines of a file) and only holds `read_size` characters,
+    or the longest sentence when it is longer, and the current chunk in memory; split_text() and the TextSplitter
+    methods take whole texts. Both give the same chunks, since the stream is only cut between sentences.
+    """
+
+    def __init__(self, chunk_size: int = 256, chunk_overlap: int = 32, model: str = DEFAULT_MODEL,
+                 read_size: int = 64 * 1024):
+        """
+        :param chunk_size: maximum tokens per chunk
+        :param chunk_overlap: maximum tokens repeated from the end of a chunk at the start of the next one
+        :param model: OpenAI model whose tokenizer measures the chunks
+        :param read_size: characters of the input segmented at once by iter_chunks()
+        """
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap,
+                         length_function=get_token_counter(model))
+        self.read_size = read_size
+        self._encoding = _encoding(model) if tiktoken is not None else None
+        self._paragraph_tokens = self._length_function("\n\n")
+
+    def _count(self, sentence: str) -> int:
+        # The sentence as it appears after a space in a chunk; the first one of a chunk has no more tokens
+        return self._length_function(" " + sentence)
+
+    def _count_all(self, sentences: List[str]) -> List[int]:
+        # _count() of every sentence of a block. tiktoken encodes a batch in several threads
+        if self._encoding is None:
+            return [self._length_function(" " + sentence) for sentence in sentences]
+        return [len(tokens) for tokens in self._encoding.encode_ordinary_batch([" " + sentence
+                                                                                for sentence in sentences])]
+
+    def _cut(self, sentence: str) -> Iterator[Tuple[str, int]]:
+        # Pieces of a sentence that is too long for a chunk, and their token counts
+        if self._encoding is None:
+            size = 4 * self._chunk_size - 4
+            for start in range(0, len(sentence), size):
+                piece = sentence[start:start + size].strip()
+                if piece:
+                    yield piece, self._count(piece)
+            return
+        tokens = self._encoding.encode(" " + sentence, disallowed_special=())
+        for start in range(0, len(tokens), self._chunk_size):
+            piece = self._encoding.decode(tokens[start:start + self._chunk_size]).strip()
+            if piece:
+                yield piece, self._count(piece)
+
+    def _sentences(self, text: str, new_paragraph: bool) -> Tuple[List[str], List[int], List[bool]]:
+        # The sentences of a block of text, their tokens and whether they start a paragraph, counted in one batch.
+        # str.split() collapses whitespace several times faster than a regex. That leaves no newline in a paragraph,
+        # so paragraphs are joined by a blank line, sentence ends are marked with a newline, and the empty strings
+        # between the lines are the paragraph breaks
+        text = "\n\n".join(" ".join(paragraph.split()) for paragraph in PARAGRAPH.split(text))
+        sentences: List[str] = []
+        starts: List[bool] = []
+        for sentence in SENTENCE_END.sub('\\1\n', text).split('\n'):
+            if sentence:
+                sentences.append(sentence)
+                starts.append(new_paragraph)
+                new_paragraph = False
+            else:
+                new_paragraph = True
+        counts = self._count_all(sentences)
+        if max(counts, default=0) <= self._chunk_size:
+            return sentences, counts, starts
+        # Sentences too long for a chunk are replaced by their pieces
+        pieces: List[str] = []
+        piece_counts: List[int] = []
+        piece_starts: List[bool] = []
+        for sentence, tokens, starts_paragraph in zip(sentences, counts, starts):
+            for piece, piece_tokens in self._cut(sentence) if tokens > self._chunk_size else [(sentence, tokens)]:
+                pieces.append(piece)
+                piece_counts.append(piece_tokens)
+                piece_starts.append(starts_paragraph)
+                starts_paragraph = False
+        return pieces, piece_counts, piece_starts
+
+    @staticmethod
+    def _block_end(buffer: str) -> Optional[Tuple[int, bool]]:
+        # The last paragraph break of the second half of the buffer, or else its last sentence end, or else the last
+        # of either in the first half; (end, whether a paragraph follows), None when there is neither
+        for start in (len(buffer) // 2, 0):
+            breaks = list(PARAGRAPH.finditer(buffer, start))
+            if breaks:
+                return breaks[-1].end(), True
+            ends = list(SENTENCE_END.finditer(buffer, start))
+            if ends:
+                return ends[-1].end(), False
+        return None
+
+    def _blocks(self, texts: Iterable[str]) -> Iterator[Tuple[str, bool]]:
+        # Cut the stream into blocks of about read_size characters that end on a paragraph break or a sentence end;
+        # (block, whether it starts a paragraph). A block without either grows until one comes, doubling the size
+        # it is looked for at, so a sentence is never split between blocks
+        pieces, size = [], 0
+        limit = self.read_size
+        new_paragraph = True
+        for text in texts:
+            pieces.append(text)
+            size += len(text)
+            if size < limit:
+                continue
+            buffer = "".join(pieces)
+            end = self._block_end(buffer)
+            if end is None:
+                pieces, limit = [buffer], 2 * size
+                continue
+            cut, next_paragraph = end
+            yield buffer[:cut], new_paragraph
+            pieces, new_paragraph = [buffer[cut:]], next_paragraph
+            size, limit = len(pieces[0]), self.read_size
+        buffer = "".join(pieces)
+        if buffer:
+            yield buffer, new_paragraph
+
+    def iter_chunks(self, texts: Iterable[str]) -> Iterator[str]:
+        """
+        Stream the chunks of a text given in pieces.
+        :param texts: consecutive pieces of the text, e.g. an open file
+        :return: iterator over the chunks
+        """
+        # The sentences of the chunk under way, followed by those of the next block
+        sentences: List[str] = []
+        counts: List[int] = []
+        starts: List[bool] = []
+        for block, new_paragraph in self._blocks(texts):
+            block_sentences, block_counts, block_starts = self._sentences(block, new_paragraph)
+            sentences += block_sentences
+            counts += block_counts
+            starts += block_starts
+            first = yield from self._pack(sentences, counts, starts, last=False)
+            del sentences[:first], counts[:first], starts[:first]
+        yield from self._pack(sentences, counts, starts, last=True)
+
+    def _pack(self, sentences: List[str], counts: List[int], starts: List[bool],
+              last: bool) -> Generator[str, None, int]:
+        # Yield the chunks of the sentences and return the first sentence of the chunk left under way, which the next
+        # block may add to; the last chunk too when `last` is set.
+        # A sentence costs its tokens and those of the paragraph break before it, unless it starts the chunk, so the
+        # sentences i to j - 1 have ends[j] - ends[i] - breaks[i] tokens. Both ends[i] and ends[i] + breaks[i] grow with
+        # i, so where a chunk and its overlap start and end is found by bisection instead of sentence by sentence
+        breaks = [self._paragraph_tokens if starts_paragraph else 0 for starts_paragraph in starts]
+        ends = [0, *accumulate(map(add, counts, breaks))]
+        first_tokens = list(map(add, ends, breaks))
+        first = 0
+        while first < len(sentences):
+            end = bisect_right(ends, self._chunk_size + first_tokens[first], first + 1) - 1
+            if end == len(sentences):
+                if last:
+                    yield self._join(sentences[first:end], starts[first:end])
+                break
+            yield self._join(sentences[first:end], starts[first:end])
+            # The next chunk repeats the last sentences of this one, up to chunk_overlap tokens and leaving room for
+            # the sentence that did not fit
+            overlap = min(self._chunk_overlap, self._chunk_size - counts[end] - breaks[end])
+            first = bisect_left(first_tokens, ends[end] - overlap, first, end)
+        return first
+
+    @staticmethod
+    def _join(sentences: List[str], starts: List[bool]) -> str:
+        if True not in starts[1:]:
+            return " ".join(sentences)
+        parts = [sentences[0]]
+        for sentence, starts_paragraph in zip(sentences[1:], starts[1:]):
+            parts.append("\n\n" if starts_paragraph else " ")
+            parts.append(sentence)
+        return "".join(parts)
+
+    def split_text(self, text: str) -> List[str]:
+        # In blocks of read_size characters, which is faster than one block of the whole text
+        return list(self.iter_chunks(text[start:start + self.read_size]
+                                     for start in range(0, len(text), self.read_size)))
+
+    def count_tokens(self, text: str) -> int:
+        return self._length_function(text)
+
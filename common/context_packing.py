@@ -0,0 +1,233 @@
+import asyncio
+import threading
+from dataclasses import dataclass, field
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.schema import BaseRetriever
+from langchain.vectorstores.base import VectorStore
+
+from common.instrumentation import timed
+from common.tokens import DEFAULT_MODEL, get_token_counter
+from common.vectorstore import MemmapVectorStore
+
+
+@dataclass
+class PackedContext:
+    """
+    Chunks chosen for the context of one question.
+    """
+    documents: List[Document]
+    tokens: int
+    budget: int
+    candidates: int
+    duplicates: int = 0
+    irrelevant: int = 0
+    oversized: int = 0
+    truncated: int = 0
+
+    def __str__(self):
+        return (f"{self.tokens}/{self.budget} context tokens from {len(self.documents)} of {self.candidates} chunks "
+                f"({self.duplicates} near-duplicates, {self.irrelevant} below the minimum similarity and "
+                f"{self.oversized} too large dropped, {self.truncated} cut to fit)")
+
+
+@dataclass
+class ContextStats:
+    """
+    Context sizes over many questions.
+    """
+    queries: int = 0
+    tokens: int = 0
+    documents: int = 0
+    duplicates: int = 0
+    irrelevant: int = 0
+    oversized: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, context: PackedContext):
+        with self._lock:
+            self.queries += 1
+            self.tokens += context.tokens
+            self.documents += len(context.documents)
+            self.duplicates += context.duplicates
+            self.irrelevant += context.irrelevant
+            self.oversized += context.oversized
+
+    def __str__(self):
+        queries = self.queries or 1
+        return (f"{self.queries} questions, {self.tokens / queries:.0f} context tokens and "
+                f"{self.documents / queries:.1f} chunks per question, {self.duplicates} near-duplicates, "
+                f"{self.irrelevant} irrelevant and {self.oversized} too large chunks dropped")
+
+
+class ContextPacker:
+    """
+    Choose the chunks that go into the prompt of a question, up to a token budget.
+
+    Candidates are taken in maximal marginal relevance order: the next chunk is the one with the best mix of
+    similarity to the question and difference from the chunks already chosen, weighted by `lambda_mult`. A chunk less
+    than `min_similarity` similar to the question is dropped as irrelevant, so a question the documents do not cover
+    gets a small context instead of a full one. A chunk at least `duplicate_threshold` similar to a chosen one is
+    dropped as a near-duplicate, and a chunk that does not fit in what is left of the budget is passed over for
+    smaller ones; the counts of both are in the PackedContext. The most relevant chunk is cut to the budget rather
+    than dropped when it is larger than the whole budget. Token counts include the separators the "stuff" chain puts
+    between documents.
+    """
+
+    def __init__(self, token_budget: int = 2000, lambda_mult: float = 0.7, duplicate_threshold: float = 0.95,
+                 min_similarity: Optional[float] = None, separator: str = "\n\n", model: str = DEFAULT_MODEL):
+        """
+        :param token_budget: default maximum tokens of the packed context
+        :param lambda_mult: 1 ranks by similarity to the question only, 0 by diversity only
+        :param duplicate_threshold: cosine similarity from which two chunks are near-duplicates
+        :param min_similarity: minimum cosine similarity of a chunk to the question, None to keep every chunk. Only
+                               applies when pack() is given the question's embedding
+        :param separator: text between two documents in the prompt
+        :param model: OpenAI model whose tokenizer measures the chunks
+        """
+        self.token_budget = token_budget
+        self.lambda_mult = lambda_mult
+        self.duplicate_threshold = duplicate_threshold
+        self.min_similarity = min_similarity
+        self.count_tokens = get_token_counter(model)
+        self.separator_tokens = self.count_tokens(separator)
+
+    def pack(self, documents: Sequence[Document], embeddings: Sequence[Sequence[float]],
+             query_embedding: Optional[Sequence[float]] = None, token_budget: Optional[int] = None) -> PackedContext:
+        """
+        :param documents: candidate chunks, best first
+        :param embeddings: embedding of every candidate
+        :param query_embedding: embedding of the question. Without it, the candidates' relevance follows their order
+        :param token_budget: maximum tokens of the context, defaults to `token_budget`
+        :return: the chosen chunks in the order they were chosen, and their token count
+        """
+        budget = self.token_budget if token_budget is None else token_budget
+        if not documents:
+            return PackedContext([], 0, budget, 0)
+        vectors = _unit_rows(np.asarray(embeddings, dtype=np.float32))
+        remaining = np.ones(len(documents), dtype=bool)
+        if query_embedding is not None:
+            relevance = vectors @ _unit_rows(np.asarray([query_embedding], dtype=np.float32))[0]
+            if self.min_similarity is not None:
+                remaining = relevance >= self.min_similarity
+        else:
+            relevance = 1.0 - np.arange(len(documents), dtype=np.float32) / len(documents)
+        irrelevant = len(documents) - int(remaining.sum())
+        costs = [self.count_tokens(document.page_content) for document in documents]
+
+        chosen: List[int] = []
+        chosen_documents: List[Document] = []
+        tokens = duplicates = oversized = truncated = 0
+        # Highest similarity of every candidate to a chosen chunk
+        redundancy = np.full(len(documents), -1.0, dtype=np.float32)
+        while remaining.any():
+            scores = self.lambda_mult * relevance - (1 - self.lambda_mult) * (redundancy if chosen else 0.0)
+            index = int(np.argmax(np.where(remaining, scores, -np.inf)))
+            remaining[index] = False
+            if chosen and redundancy[index] >= self.duplicate_threshold:
+                duplicates += 1
+                continue
+            document = documents[index]
+            cost = costs[index] + (self.separator_tokens if chosen else 0)
+            if tokens + cost > budget:
+                if chosen or budget <= 0:
+                    oversized += 1
+                    continue
+                # The most relevant chunk does not fit in the whole budget: keep as much of it as fits
+                text = self._truncate(document.page_content, budget)
+                if not text:
+                    oversized += 1
+                    continue
+                document = Document(page_content=text, metadata=document.metadata)
+                cost = self.count_tokens(text)
+                truncated += 1
+            chosen.append(index)
+            chosen_documents.append(document)
+            tokens += cost
+            redundancy = np.maximum(redundancy, vectors @ vectors[index])
+        return PackedContext(chosen_documents, tokens, budget, len(documents), duplicates, irrelevant, oversized,
+                             truncated)
+
+    def _truncate(self, text: str, budget: int) -> str:
+        # The longest prefix of whole words within the budget, found by bisection on the number of words
+        words = text.split(" ")
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.count_tokens(" ".join(words[:middle])) <= budget:
+                low = middle
+            else:
+                high = middle - 1
+        return " ".join(words[:low])
+
+
+def search_with_vectors(vectordb: VectorStore, embedding: List[float],
+                        k: int) -> Optional[List[Tuple[Document, Sequence[float]]]]:
+    """
+    Similarity search returning the stored embeddings of the chunks along with them, for MemmapVectorStore and
+    Chroma.
+    :param vectordb: vector database
+    :param embedding: query embedding
+    :param k: number of chunks
+    :return: (document, embedding) pairs, most similar first, or None for other vector stores
+    """
+    if isinstance(vectordb, MemmapVectorStore):
+        return vectordb.similarity_search_with_vectors_by_vector(embedding, k)
+    collection = getattr(vectordb, "_collection", None)
+    if collection is None:
+        return None
+    k = min(k, collection.count())
+    if k == 0:
+        return []
+    results = collection.query(query_embeddings=[embedding], n_results=k,
+                               include=["documents", "metadatas", "embeddings"])
+    return [(Document(page_content=text, metadata=metadata or {}), vector) for text, metadata, vector
+            in zip(results["documents"][0], results["metadatas"][0], results["embeddings"][0])]
+
+
+class PackingRetriever(BaseRetriever):
+    """
+    Retriever packing the candidates of another retriever into a token budget with a ContextPacker.
+    The candidates are embedded with `embeddings`, which should be cached (see common.embeddings.CachedEmbeddings)
+    since they are the indexed chunks. With `embed_query` false, the question is not embedded and the candidates
+    keep the other retriever's order.
+    """
+
+    def __init__(self, retriever: BaseRetriever, packer: ContextPacker, embeddings: Embeddings,
+                 embed_query: bool = True):
+        """
+        :param retriever: retriever over-fetching the candidates
+        :param packer: packer choosing among them
+        :param embeddings: embeddings of the candidates and the question
+        :param embed_query: whether to rank the candidates by similarity to the question
+        """
+        self.retriever = retriever
+        self.packer = packer
+        self.embeddings = embeddings
+        self.embed_query = embed_query
+        self.stats = ContextStats()
+        self.last_context: Optional[PackedContext] = None
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        with timed("vector_search"):
+            candidates = self.retriever.get_relevant_documents(query)
+        if not candidates:
+            return []
+        vectors = self.embeddings.embed_documents([document.page_content for document in candidates])
+        query_embedding = self.embeddings.embed_query(query) if self.embed_query else None
+        context = self.packer.pack(candidates, vectors, query_embedding)
+        self.stats.record(context)
+        self.last_context = context
+        return context.documents
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_relevant_documents, query)
+
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
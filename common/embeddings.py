@@ -0,0 +1,248 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List
+
+from langchain.embeddings.base import Embeddings
+from pydantic import BaseModel
+
+from common.instrumentation import timed
+from common.tokens import approximate_token_count
+
+
+class EmbeddingCache:
+    """
+    Persistent text -> embedding store in a SQLite file.
+    Vectors are stored as packed float32 values, keyed by a hash of the model name and the text, so the same text
+    embedded with another model is a different entry.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: SQLite file, created if it does not exist. ':memory:' keeps the cache in memory
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        # WAL lets a reader (e.g. a query running in another process) go on while a rebuild writes
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._db.commit()
+
+    @staticmethod
+    def key(namespace: str, text: str) -> str:
+        return hashlib.sha256(f"{namespace}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        :param keys: cache keys to look up
+        :return: the vectors found, by key
+        """
+        found = {}
+        with self._lock:
+            # SQLite limits the number of bound parameters of a statement
+            for start in range(0, len(keys), 500):
+                part = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})", part)
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """
+        Store vectors in one transaction.
+        :param items: vectors by key
+        """
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                                 [(key, array('f', vector).tobytes()) for key, vector in items.items()])
+            self._db.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+@dataclass
+class EmbeddingStats:
+    """
+    Counters of a CachedEmbeddings instance.
+    """
+    texts: int = 0
+    unique_texts: int = 0
+    hits: int = 0
+    misses: int = 0
+    batches: int = 0
+    seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of the unique texts served from the cache."""
+        return self.hits / self.unique_texts if self.unique_texts else 0.0
+
+    @property
+    def embeddings_per_second(self) -> float:
+        """Texts returned per second spent in embed_documents() and embed_query()."""
+        return self.texts / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f"{self.texts} texts ({self.unique_texts} unique), cache hit rate {self.hit_rate:.1%}, "
+                f"{self.misses} embedded in {self.batches} batches, {self.embeddings_per_second:.1f} embeddings/s")
+
+
+class CachedEmbeddings(Embeddings, BaseModel):
+    """
+    Embeddings wrapper that embeds every distinct text only once.
+
+    Texts are deduplicated by hash within a call, looked up in a persistent EmbeddingCache and only the misses are
+    sent to the wrapped embeddings, in batches of at most `batch_size` texts and `batch_tokens` estimated tokens,
+    with up to `max_concurrency` batches in flight. Repeated highlights, boilerplate shared across documents and
+    rebuilt indexes therefore cost nothing after the first time.
+
+        embeddings = CachedEmbeddings.from_path(OpenAIEmbeddings(), "embedding_cache.sqlite")
+    """
+
+    embeddings: Embeddings
+    cache: EmbeddingCache
+    namespace: str
+    batch_size: int = 256
+    batch_tokens: int = 100000
+    max_concurrency: int = 4
+    stats: EmbeddingStats = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def __init__(self, **data):
+        super().__init__(**data)
+        if self.stats is None:
+            self.stats = EmbeddingStats()
+
+    @classmethod
+    def from_path(cls, embeddings: Embeddings, cache_path: str, **kwargs) -> "CachedEmbeddings":
+        """
+        Wrap embeddings with a cache stored in `cache_path`.
+        :param embeddings: embeddings to call on cache misses
+        :param cache_path: SQLite file of the cache
+        :param kwargs: batch_size, batch_tokens and max_concurrency
+        :return: the cached embeddings
+        """
+        return cls(embeddings=embeddings, cache=EmbeddingCache(cache_path),
+                   namespace=embedding_namespace(embeddings), **kwargs)
+
+    def _batches(self, texts: Iterable[str]) -> Iterator[List[str]]:
+        batch, tokens = [], 0
+        for text in texts:
+            text_tokens = approximate_token_count(text)
+            if batch and (len(batch) >= self.batch_size or tokens + text_tokens > self.batch_tokens):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(text)
+            tokens += text_tokens
+        if batch:
+            yield batch
+
+    def _embed_misses(self, texts: List[str]) -> Dict[str, List[float]]:
+        batches = list(self._batches(texts))
+        self.stats.batches += len(batches)
+        if len(batches) == 1 or self.max_concurrency <= 1:
+            results = [self.embeddings.embed_documents(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                results = list(pool.map(self.embeddings.embed_documents, batches))
+        return {text: vector for batch, vectors in zip(batches, results) for text, vector in zip(batch, vectors)}
+
+    @timed("embed")
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed documents, serving the texts seen before from the cache.
+        :param texts: texts to embed
+        :return: one embedding per text, in order
+        """
+        started = time.perf_counter()
+        keys = {text: self.cache.key(f"{self.namespace}:document", text) for text in dict.fromkeys(texts)}
+        cached = self.cache.get_many(list(keys.values()))
+        vectors = {text: cached[key] for text, key in keys.items() if key in cached}
+        misses = [text for text in keys if text not in vectors]
+        if misses:
+            embedded = self._embed_misses(misses)
+            self.cache.put_many({keys[text]: vector for text, vector in embedded.items()})
+            vectors.update(embedded)
+
+        self.stats.texts += len(texts)
+        self.stats.unique_texts += len(keys)
+        self.stats.hits += len(keys) - len(misses)
+        self.stats.misses += len(misses)
+        self.stats.seconds += time.perf_counter() - started
+        return [vectors[text] for text in texts]
+
+    @timed("embed")
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query, serving repeated queries from the cache.
+        :param text: query text
+        :return: the embedding
+        """
+        started = time.perf_counter()
+        key = self.cache.key(f"{self.namespace}:query", text)
+        vector = self.cache.get_many([key]).get(key)
+        self.stats.texts += 1
+        self.stats.unique_texts += 1
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many({key: vector})
+            self.stats.misses += 1
+            self.stats.batches += 1
+        else:
+            self.stats.hits += 1
+        self.stats.seconds += time.perf_counter() - started
+        return vector
+
+
+class HashEmbeddings(Embeddings, BaseModel):
+    """
+    Deterministic local embeddings for tests and benchmarks: the vector of a text is derived from its hash, so the
+    same text always gets the same vector and no API is called. `latency` simulates the round trip of a request and
+    `latency_per_text` the time the API spends on every input of a batch.
+    """
+
+    size: int = 64
+    latency: float = 0.0
+    latency_per_text: float = 0.0
+    calls: int = 0
+
+    def _embed(self, text: str) -> List[float]:
+        vector, counter = [], 0
+        while len(vector) < self.size:
+            digest = hashlib.sha256(f"{counter}\0{text}".encode("utf-8")).digest()
+            vector.extend(byte / 127.5 - 1.0 for byte in digest)
+            counter += 1
+        return vector[:self.size]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        if self.latency or self.latency_per_text:
+            time.sleep(self.latency + self.latency_per_text * len(texts))
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def embedding_namespace(embeddings: Embeddings) -> str:
+    """
+    Name the cache entries of an embeddings object after its class and model, so switching models never serves
+    vectors of the old one.
+    """
+    model = getattr(embeddings, "model", None) or getattr(embeddings, "size", None)
+    return f"{type(embeddings).__name__}:{model}"
@@ -0,0 +1,225 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+import aiohttp
+
+from common.instrumentation import METRICS, increment, record_usage, timed
+from common.streaming import parse_sse
+from common.tokens import count_tokens
+
+# Same environment variable as the openai package, so one setting points every sample at a local server
+OPENAI_API_BASE = os.environ.get('OPENAI_API_BASE', 'https://api.openai.com/v1')
+
+
+class APIError(Exception):
+    """
+    Raised when the OpenAI API answers with a non-200 status code.
+    `retry_after` holds the delay in seconds the server asked for in its Retry-After header, if any.
+    """
+
+    def __init__(self, status_code, message, retry_after=None):
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+        super().__init__(self.message)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header given in seconds. HTTP dates are not used by the OpenAI API and are ignored.
+    :param value: header value
+    :return: delay in seconds, or None
+    """
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+async def api_error(resp: aiohttp.ClientResponse) -> APIError:
+    """
+    The APIError for a non-200 response. The body is only used as the message: a proxy in front of the API can answer
+    a 502 or 503 with an HTML page instead of the JSON error of the API.
+    :param resp: the response
+    :return: the error to raise
+    """
+    body = await resp.text(errors='replace')
+    try:
+        message = json.loads(body).get('error', 'Unknown error')
+    except (ValueError, AttributeError):
+        message = body.strip()[:200] or resp.reason or 'Unknown error'
+    return APIError(resp.status, message, parse_retry_after(resp.headers.get('Retry-After')))
+
+
+class OpenAIHTTPClient:
+    """
+    Long-lived HTTP client for the OpenAI REST API.
+    A single aiohttp session (and its keep-alive connection pool) is created lazily on first use and reused for every
+    request, so only the first call pays for the TCP and TLS handshakes. Call close() once, before the event loop is
+    shut down, to release the pooled connections.
+    """
+
+    def __init__(self,
+                 api_key: str,
+                 api_base: str = OPENAI_API_BASE,
+                 limit: int = 100,
+                 limit_per_host: int = 20,
+                 keepalive_timeout: float = 30.0,
+                 ttl_dns_cache: int = 300,
+                 timeout: float = 60.0):
+        """
+        :param api_key: OpenAI API key sent as a Bearer token
+        :param api_base: base URL of the API. Point it at a local server for tests and benchmarks
+        :param limit: maximum number of open connections in the pool
+        :param limit_per_host: maximum number of open connections to a single host
+        :param keepalive_timeout: seconds an idle pooled connection is kept open
+        :param ttl_dns_cache: seconds a resolved host name is cached
+        :param timeout: total timeout in seconds for a single request
+        """
+        self.api_key = api_key
+        self.api_base = api_base.rstrip('/')
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.ttl_dns_cache = ttl_dns_cache
+        self.timeout = timeout
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def session(self) -> aiohttp.ClientSession:
+        """
+        Return the shared session, creating it (and its connection pool) on first use.
+        Must be called from within a running event loop.
+        :return: the pooled aiohttp session
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit,
+                                             limit_per_host=self.limit_per_host,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             use_dns_cache=True,
+                                             ttl_dns_cache=self.ttl_dns_cache)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  headers=self.headers,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                  json_serialize=json.dumps)
+        return self._session
+
+    async def post_json(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POST a JSON payload to the API and return the decoded JSON response.
+        :param path: endpoint path relative to the API base, e.g. '/completions'
+        :param payload: request body
+        :return: decoded response body
+        """
+        async with self.session().post(f"{self.api_base}{path}", json=payload) as resp:
+            if resp.status != 200:
+                raise await api_error(resp)
+            return await resp.json(content_type=None)
+
+    async def completion(self,
+                         prompt: str,
+                         model: str = "text-davinci-003",
+                         max_tokens: int = 50,
+                         temperature: float = 0.5) -> str:
+        """
+        Call the Completions API and return the text of the first choice.
+        :param prompt: prompt text
+        :param model: completion model name
+        :param max_tokens: maximum number of tokens to generate
+        :param temperature: sampling temperature
+        :return: generated text, stripped of surrounding whitespace
+        """
+        result = await self.create_completion(prompt, model, max_tokens, temperature)
+        return result['choices'][0]['text'].strip()
+
+    async def create_completion(self,
+                                prompt: str,
+                                model: str = "text-davinci-003",
+                                max_tokens: int = 50,
+                                temperature: float = 0.5) -> Dict[str, Any]:
+        """
+        Call the Completions API and return the whole response, including the token usage.
+        :param prompt: prompt text
+        :param model: completion model name
+        :param max_tokens: maximum number of tokens to generate
+        :param temperature: sampling temperature
+        :return: decoded response body
+        """
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature
+        }
+        with timed("llm"):
+            result = await self.post_json('/completions', payload)
+        record_usage(result.get('usage'))
+        return result
+
+    async def stream_completion(self,
+                                prompt: str,
+                                model: str = "text-davinci-003",
+                                max_tokens: int = 50,
+                                temperature: float = 0.5) -> AsyncIterator[str]:
+        """
+        Call the Completions API with `stream` enabled and yield text tokens as the server sends them.
+        :param prompt: prompt text
+        :param model: completion model name
+        :param max_tokens: maximum number of tokens to generate
+        :param temperature: sampling temperature
+        :return: async iterator over the generated tokens
+        """
+        payload = {
+            "model": model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True
+        }
+        started = time.perf_counter()
+        texts = []
+        try:
+            async with self.session().post(f"{self.api_base}/completions", json=payload) as resp:
+                if resp.status != 200:
+                    raise await api_error(resp)
+                async for data in parse_sse(resp.content.iter_any()):
+                    if data == '[DONE]':
+                        break
+                    event = json.loads(data)
+                    if event.get('choices'):
+                        if not texts:
+                            METRICS.observe("llm_ttft", time.perf_counter() - started)
+                        text = event['choices'][0].get('text', '')
+                        texts.append(text)
+                        yield text
+            METRICS.observe("llm", time.perf_counter() - started)
+        finally:
+            # A streamed response has no usage, and an event is not always one token: count the text received,
+            # also when the stream broke off
+            if METRICS.enabled and texts:
+                increment("tokens", count_tokens(''.join(texts), model), kind="completion")
+
+    async def close(self):
+        """
+        Close the shared session and every pooled connection.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            # Give the transports a chance to finish their shutdown before the loop is closed
+            await asyncio.sleep(0)
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
@@ -0,0 +1,211 @@
+import asyncio
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain.docstore.document import Document
+from langchain.schema import BaseRetriever
+from langchain.vectorstores.base import VectorStore
+
+TOKEN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+STOPWORDS = frozenset("""
+a about after all also an and any are as at be been but by can could did do does for from had has have he her his
+how i if in into is it its me my no not of on or our she so than that the their them then there these they this to
+up was we were what when where which who why will with would you your say said says tell told think thinks
+""".split())
+# Words asking for the highlights of an author or book rather than about a topic, e.g. "highlights from Inspired"
+LOOKUP_WORDS = frozenset("book books highlight highlights note notes quote quotes passage passages".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens of a text, without stopwords.
+    """
+    return [token for token in TOKEN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """
+    Inverted index scoring documents with Okapi BM25.
+    Postings map every term to the documents containing it and the term's frequency there, so a query only
+    touches the documents sharing at least one term with it.
+    """
+
+    def __init__(self, documents: Sequence[Document], k1: float = 1.5, b: float = 0.75):
+        """
+        :param documents: documents to index
+        :param k1: term frequency saturation
+        :param b: document length normalization
+        """
+        self.documents = list(documents)
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self.lengths: List[int] = []
+        for index, document in enumerate(self.documents):
+            tokens = tokenize(document.page_content)
+            self.lengths.append(len(tokens))
+            for term, frequency in Counter(tokens).items():
+                self.postings[term][index] = frequency
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+
+    def idf(self, term: str) -> float:
+        frequency = len(self.postings.get(term, ()))
+        return math.log(1 + (len(self.documents) - frequency + 0.5) / (frequency + 0.5))
+
+    def search(self, query: str, k: int = 4, candidates: Optional[Iterable[int]] = None) -> List[Tuple[int, float]]:
+        """
+        Score the documents matching the query's terms.
+        :param query: query text
+        :param k: number of results
+        :param candidates: indexes of the documents allowed in the results, None for all
+        :return: (document index, score) pairs, best first
+        """
+        allowed = set(candidates) if candidates is not None else None
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf(term)
+            for index, frequency in postings.items():
+                if allowed is not None and index not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[index] / (self.average_length or 1))
+                scores[index] += idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+
+def reciprocal_rank_fusion(rankings: Iterable[List[Any]], k: int = 60) -> List[Any]:
+    """
+    Merge rankings of the same items: every item scores 1 / (k + rank) in every ranking it appears in.
+    :param rankings: lists of items, best first
+    :param k: damping of the top ranks
+    :return: all items, best first
+    """
+    scores: Dict[Any, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            scores[item] += 1 / (k + rank + 1)
+    return sorted(scores, key=lambda item: -scores[item])
+
+
+def name_variants(value: str) -> List[str]:
+    """
+    Ways a query may refer to a metadata value: "Cagan, Marty" is matched by "marty cagan", "cagan, marty" or
+    "cagan"; a title by itself or by the part before its subtitle.
+    """
+    value = value.lower().strip()
+    variants = {value}
+    if "," in value:
+        last, first = [part.strip() for part in value.split(",", 1)]
+        variants.update({f"{first} {last}", last})
+    if ":" in value:
+        variants.add(value.split(":", 1)[0].strip())
+    return [variant for variant in variants if len(variant) >= 4 and variant not in STOPWORDS]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing BM25 keyword search with vector search, with metadata pre-filtering.
+
+    When the query names a value of one of the `filter_fields` (e.g. an author or a book title), only the documents
+    with that value are considered and they are ranked by BM25 on the rest of the query, without embedding it. A
+    single word names a value of the `name_fields` only (an author's last name); other values are named by at least
+    two words, so a common word that happens to be a title does not filter the query. When none of the filtered
+    documents matches the rest of the query, the filter is dropped.
+    Otherwise the BM25 and vector search rankings of the top `fetch_k` documents are merged by reciprocal rank
+    fusion, which reranks documents found by both first.
+
+    Vector search results are matched back to the documents by the `id_key` metadata field.
+    """
+
+    def __init__(self, documents: Sequence[Document], vectorstore: Optional[VectorStore] = None, k: int = 4,
+                 fetch_k: int = 20, filter_fields: Sequence[str] = ("author", "title"),
+                 name_fields: Sequence[str] = ("author",), id_key: str = "id"):
+        """
+        :param documents: documents to retrieve from, the same as in the vector store
+        :param vectorstore: vector store of the documents, None for BM25 only
+        :param k: number of documents returned
+        :param fetch_k: number of documents taken from each ranking before fusion
+        :param filter_fields: metadata fields a query can be pre-filtered on
+        :param name_fields: filter fields holding names, whose values a query can name by a single word
+        :param id_key: metadata field identifying a document in the vector store
+        """
+        self.bm25 = BM25Index(documents)
+        self.documents = self.bm25.documents
+        self.vectorstore = vectorstore
+        self.k = k
+        self.fetch_k = fetch_k
+        self.id_key = id_key
+        self.positions = {document.metadata.get(id_key): index for index, document in enumerate(self.documents)}
+        # (field, value, variant) of every metadata value, longest variants first so "the right it" wins over "it"
+        values = {(field, document.metadata[field]) for document in self.documents
+                  for field in filter_fields if document.metadata.get(field)}
+        self.variants = sorted(((field, value, variant) for field, value in values
+                                for variant in name_variants(value)
+                                if field in name_fields or len(TOKEN.findall(variant)) > 1),
+                               key=lambda item: -len(item[2]))
+        self.searches = Counter()
+
+    def metadata_filter(self, query: str) -> Dict[str, str]:
+        """
+        Metadata values named in the query, at most one per field, that the query is searched within.
+        :param query: query text
+        :return: e.g. {"author": "Savoia, Alberto"}, empty if the query names none or if none of the documents with
+                 the values matches the rest of the query
+        """
+        metadata_filter, filtered = self._match(query)
+        return metadata_filter if filtered is not None else {}
+
+    def _named(self, query: str) -> Dict[str, str]:
+        text = " ".join(TOKEN.findall(query.lower()))
+        found = {}
+        for field, value, variant in self.variants:
+            if field not in found and re.search(rf"\b{re.escape(' '.join(TOKEN.findall(variant)))}\b", text):
+                found[field] = value
+        return found
+
+    def _match(self, query: str) -> Tuple[Dict[str, str], Optional[List[Document]]]:
+        # (metadata values named in the query, the documents found within them). The documents are None when no
+        # value is named, or when the rest of the query matches none of the documents with the values
+        metadata_filter = self._named(query)
+        if not metadata_filter:
+            return metadata_filter, None
+        candidates = [index for index, document in enumerate(self.documents)
+                      if all(document.metadata.get(field) == value for field, value in metadata_filter.items())]
+        # The words naming the author or title would match most of the candidates; rank on the rest of the query
+        naming = {token for value in metadata_filter.values() for token in tokenize(value)}
+        rest = " ".join(token for token in tokenize(query) if token not in naming and token not in LOOKUP_WORDS)
+        ranked = [index for index, _ in self.bm25.search(rest, self.k, candidates)]
+        if not ranked and rest:
+            return metadata_filter, None
+        # A pure lookup ("what did Alberto Savoia say?") has no other terms: fill up in document order
+        ranked += [index for index in candidates if index not in ranked][:self.k - len(ranked)]
+        return metadata_filter, [self.documents[index] for index in ranked]
+
+    def _fuse(self, keyword: List[Tuple[int, float]], similar: List[Document]) -> List[Document]:
+        vector_ranking = [self.positions[document.metadata.get(self.id_key)] for document in similar
+                          if document.metadata.get(self.id_key) in self.positions]
+        fused = reciprocal_rank_fusion([[index for index, _ in keyword], vector_ranking])
+        return [self.documents[index] for index in fused[:self.k]]
+
+    def get_relevant_documents(self, query: str) -> List[Document]:
+        metadata_filter, filtered = self._match(query)
+        if filtered is not None:
+            self.searches["filtered"] += 1
+            return filtered
+        if metadata_filter:
+            # The query is not about the named author or title after all, e.g. "what does Cagan's book say about
+            # habits?" when none of his highlights mentions habits
+            self.searches["unfiltered"] += 1
+        keyword = self.bm25.search(query, self.fetch_k)
+        if self.vectorstore is None:
+            self.searches["keyword"] += 1
+            return [self.documents[index] for index, _ in keyword[:self.k]]
+        self.searches["hybrid"] += 1
+        return self._fuse(keyword, self.vectorstore.similarity_search(query, k=self.fetch_k))
+
+    async def aget_relevant_documents(self, query: str) -> List[Document]:
+        return await asyncio.get_running_loop().run_in_executor(None, self.get_relevant_documents, query)
@@ -0,0 +1,424 @@
+"""
+Stage timings, token counts, retries and errors of the samples, exported as a JSON log or to Prometheus.
+
+Code measures its stages with `timed`, as a context manager or a decorator, and counts things with `increment`:
+
+    with timed("vector_search"):
+        docs = vectordb.similarity_search(query)
+
+    @timed("embed")
+    def embed_documents(texts): ...
+
+    increment("tokens", 120, kind="prompt")
+
+Everything records to the METRICS registry, which is disabled until configure_metrics() (or METRICS.enable()) turns
+it on. While it is disabled, a timed block or decorated function and `increment` only check a flag, so instrumented
+code costs well under a microsecond per call.
+
+Stages used by the samples: pdf_extract, chunk, embed, vector_search, llm (total time of an LLM call), llm_ttft (time
+to the first streamed token), tool (agent tools) and request (a whole question or message). Counters: tokens (by
+kind: prompt, completion), retries (by reason) and errors (by exception type). The LLM calls and tools of LangChain
+are timed by the callback handlers in common.langchain_metrics, which add_langchain_handler() installs.
+"""
+import asyncio
+import bisect
+import functools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = "openai_samples"
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    Cumulative-bucket histogram of durations, like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf bucket, not cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile by linear interpolation inside its bucket, as Prometheus' histogram_quantile() does.
+        Values in the +Inf bucket are reported as the highest bound.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                return lower + (self.buckets[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class _NullTimer:
+    # Shared by every timed() call while the metrics are disabled
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+
+    def __init__(self, metrics: "Metrics", stage: str, labels: Dict[str, str]):
+        self.metrics = metrics
+        self.stage = stage
+        self.labels = labels
+        self.started = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+class Metrics:
+    """
+    Registry of stage histograms and counters. Thread-safe; exporters are called with every observation.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        """
+        :param buckets: upper bounds of the histogram buckets, in seconds
+        """
+        self.buckets = buckets
+        self.enabled = False
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.exporters: List[Callable[[Dict[str, Any]], None]] = []
+        self._lock = threading.Lock()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def timer(self, stage: str, **labels: str) -> Union[_Timer, _NullTimer]:
+        """
+        Context manager recording the time spent in its block to the histogram of `stage`.
+        """
+        return _Timer(self, stage, labels) if self.enabled else _NULL_TIMER
+
+    def observe(self, stage: str, seconds: float, **labels: str):
+        """
+        Record a duration measured elsewhere, e.g. in a worker process.
+        """
+        if not self.enabled:
+            return
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+        self._export({"type": "timing", "stage": stage, "seconds": seconds, **labels})
+
+    def increment(self, name: str, value: float = 1, **labels: str):
+        """
+        Add `value` to the counter `name`.
+        """
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self._export({"type": "count", "name": name, "value": value, **labels})
+
+    def _export(self, event: Dict[str, Any]):
+        if self.exporters:
+            event["time"] = time.time()
+            for exporter in self.exporters:
+                exporter(event)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def snapshot(self) -> Dict[str, Any]:
+        """
+        :return: count, total seconds and estimated p50/p95/p99 of every stage, and the value of every counter
+        """
+        with self._lock:
+            stages = [{"stage": stage, **dict(labels), "count": histogram.count, "seconds": histogram.sum,
+                       "p50": histogram.quantile(0.5), "p95": histogram.quantile(0.95),
+                       "p99": histogram.quantile(0.99)}
+                      for (stage, labels), histogram in sorted(self.histograms.items())]
+            counters = [{"name": name, **dict(labels), "value": value}
+                        for (name, labels), value in sorted(self.counters.items())]
+        return {"stages": stages, "counters": counters}
+
+    def prometheus_text(self) -> str:
+        """
+        :return: the histograms and counters in the Prometheus text exposition format
+        """
+        lines = [f"# TYPE {PREFIX}_stage_seconds histogram"]
+        with self._lock:
+            for (stage, labels), histogram in sorted(self.histograms.items()):
+                label_text = _label_text((("stage", stage),) + labels)
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{PREFIX}_stage_seconds_bucket{{{label_text},le="{le}"}} {cumulative}')
+                lines.append(f"{PREFIX}_stage_seconds_sum{{{label_text}}} {histogram.sum}")
+                lines.append(f"{PREFIX}_stage_seconds_count{{{label_text}}} {histogram.count}")
+            names = sorted({name for name, _ in self.counters})
+            for name in names:
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        label_text = _label_text(labels)
+                        lines.append(f"{PREFIX}_{name}_total{{{label_text}}} {value}" if label_text
+                                     else f"{PREFIX}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        :return: one line per stage and counter, for printing when an app exits
+        """
+        snapshot = self.snapshot()
+        lines = []
+        for stage in snapshot["stages"]:
+            labels = "".join(f" {key}={value}" for key, value in stage.items()
+                             if key not in ("stage", "count", "seconds", "p50", "p95", "p99"))
+            lines.append(f"{stage['stage']}{labels}: {stage['count']} calls, p50 {stage['p50'] * 1000:.0f}ms, "
+                         f"p95 {stage['p95'] * 1000:.0f}ms, total {stage['seconds']:.2f}s")
+        for counter in snapshot["counters"]:
+            labels = "".join(f" {key}={value}" for key, value in counter.items() if key not in ("name", "value"))
+            lines.append(f"{counter['name']}{labels}: {counter['value']:g}")
+        return "\n".join(lines)
+
+
+def _label_text(labels: Labels) -> str:
+    return ",".join(f'{key}="{str(value)}"'.replace("\n", " ") for key, value in labels)
+
+
+METRICS = Metrics()
+
+
+def timed(stage: str, **labels: str):
+    """
+    Time a block or a function into the histogram of `stage` of METRICS.
+    As a context manager: `with timed("embed"): ...`. As a decorator, on plain and async functions alike:
+    `@timed("embed")`. The decorator checks whether the metrics are enabled on every call.
+    """
+    return _Stage(stage, labels)
+
+
+class _Stage:
+    __slots__ = ("stage", "labels", "started")
+
+    def __init__(self, stage: str, labels: Dict[str, str]):
+        self.stage = stage
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        if METRICS.enabled:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.started is not None:
+            METRICS.observe(self.stage, time.perf_counter() - self.started, **self.labels)
+        return False
+
+    def __call__(self, func: Callable) -> Callable:
+        stage, labels = self.stage, self.labels
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not METRICS.enabled:
+                    return await func(*args, **kwargs)
+                with METRICS.timer(stage, **labels):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled:
+                return func(*args, **kwargs)
+            with METRICS.timer(stage, **labels):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+def increment(name: str, value: float = 1, **labels: str):
+    """
+    Add to a counter of METRICS, see Metrics.increment().
+    """
+    if METRICS.enabled:
+        METRICS.increment(name, value, **labels)
+
+
+def record_error(error: BaseException, stage: str = "request"):
+    """
+    Count an error by exception type and the stage it interrupted.
+    """
+    if METRICS.enabled:
+        METRICS.increment("errors", type=type(error).__name__, stage=stage)
+
+
+def record_usage(usage: Optional[Dict[str, int]]):
+    """
+    Count the prompt and completion tokens of an OpenAI `usage` object.
+    """
+    if METRICS.enabled and usage:
+        for kind in ("prompt", "completion"):
+            if usage.get(f"{kind}_tokens"):
+                METRICS.increment("tokens", usage[f"{kind}_tokens"], kind=kind)
+
+
+class JsonLogExporter:
+    """
+    Append every observation to a file as one JSON object per line.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: JSON lines file, appended to
+        """
+        self.path = path
+        self._file = open(path, "a", buffering=1)
+        self._lock = threading.Lock()
+
+    def __call__(self, event: Dict[str, Any]):
+        line = json.dumps(event)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def serve_prometheus(port: int = 9100, host: str = "127.0.0.1",
+                     metrics: Optional[Metrics] = None) -> ThreadingHTTPServer:
+    """
+    Serve the metrics at http://host:port/metrics from a daemon thread, for Prometheus to scrape.
+    :param port: TCP port, 0 for any free port (see server.server_address)
+    :param host: interface to listen on
+    :param metrics: registry to serve, defaults to METRICS
+    :return: the running server; call shutdown() to stop it
+    """
+    metrics = metrics if metrics is not None else METRICS
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus_text().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+def configure_metrics(mode: str = "off", path: str = "metrics.jsonl", port: int = 9100,
+                      callback_manager: Any = None) -> Optional[Union[JsonLogExporter, ThreadingHTTPServer]]:
+    """
+    Turn METRICS on from a sample's settings.
+    :param mode: "off", "json" to append every observation to `path`, or "prometheus" to serve them on `port`
+    :param path: JSON lines file of the json mode
+    :param port: port of the prometheus mode
+    :param callback_manager: LangChain callback manager to time the LLM calls and tools of. Defaults to the shared
+                             one every LLM, chain and tool uses unless given its own
+    :return: the exporter or server, to close or shut down at exit, or None when the metrics are off
+    """
+    mode = mode.strip().lower()
+    if mode in ("", "off", "false", "no"):
+        return None
+    if mode not in ("json", "prometheus"):
+        raise ValueError(f"Unknown METRICS mode {mode!r}, expected off, json or prometheus")
+    METRICS.enable()
+    add_langchain_handler(callback_manager)
+    if mode == "json":
+        exporter = JsonLogExporter(path)
+        METRICS.exporters.append(exporter)
+        return exporter
+    return serve_prometheus(port)
+
+
+def configure_metrics_from_config(config: Any, callback_manager: Any = None) -> Optional[Any]:
+    """
+    configure_metrics() from the METRICS, METRICS_FILE and METRICS_PORT keys of the [SETTINGS] of a config.ini.
+    :param config: parsed config.ini
+    :param callback_manager: see configure_metrics()
+    :return: the exporter or server, for finish_metrics()
+    """
+    return configure_metrics(config.get('SETTINGS', 'METRICS', fallback='off'),
+                             config.get('SETTINGS', 'METRICS_FILE', fallback='metrics.jsonl'),
+                             config.getint('SETTINGS', 'METRICS_PORT', fallback=9100), callback_manager)
+
+
+def finish_metrics(handle: Optional[Any]):
+    """
+    Print the summary of METRICS when they are on, and close the exporter or server configure_metrics() returned.
+    """
+    if METRICS.enabled:
+        print(f"\nMetrics:\n{METRICS.summary()}")
+    if isinstance(handle, JsonLogExporter):
+        METRICS.exporters.remove(handle)
+        handle.close()
+    elif handle is not None:
+        handle.shutdown()
+        handle.server_close()
+
+
+def add_langchain_handler(callback_manager: Any = None):
+    """
+    Time the LLM calls and tools of a LangChain callback manager, and count their tokens.
+    :param callback_manager: the manager, defaults to the shared one
+    """
+    # Imported here: LangChain takes over a second to import, and only samples using it get here
+    from common.langchain_metrics import AsyncMetricsCallbackHandler, MetricsCallbackHandler
+    if callback_manager is None:
+        from langchain.callbacks import get_callback_manager
+        callback_manager = get_callback_manager()
+    async_manager = getattr(callback_manager, "is_async", False)
+    handler_class = AsyncMetricsCallbackHandler if async_manager else MetricsCallbackHandler
+    # The shared manager keeps its handlers in a manager of its own
+    handlers = getattr(callback_manager, "_callback_manager", callback_manager).handlers
+    if not any(isinstance(handler, handler_class) for handler in handlers):
+        callback_manager.add_handler(handler_class())
@@ -0,0 +1,142 @@
+"""
+LangChain callback handlers recording the llm, llm_ttft and tool stages and the tokens of LLM calls to METRICS.
+Kept apart from common.instrumentation so that importing the instrumentation does not import LangChain; see
+add_langchain_handler().
+"""
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from langchain.callbacks.base import AsyncCallbackHandler, BaseCallbackHandler
+from langchain.schema import AgentAction, AgentFinish, LLMResult
+
+from common.instrumentation import METRICS, record_error, record_usage
+from common.tokens import count_tokens
+
+# Start of the current LLM call and the tokens it streamed so far, and the start of the current tool. Context
+# variables keep concurrent calls apart: every asyncio task and thread has its own values
+_llm_started: ContextVar[Optional[Tuple[float, List[str]]]] = ContextVar("llm_started", default=None)
+_tool_started: ContextVar[Optional[Tuple[float, str]]] = ContextVar("tool_started", default=None)
+
+
+class MetricsCallbackHandler(BaseCallbackHandler):
+    """
+    LangChain callback handler recording the llm, llm_ttft and tool stages and the tokens of LLM calls. Streamed
+    completions have no usage, so their completion tokens are counted in the streamed text: a streamed chunk is
+    not always one token.
+    """
+
+    @property
+    def always_verbose(self) -> bool:
+        return True
+
+    # Where the start of the current LLM call and tool are kept, see AsyncMetricsCallbackHandler
+    def _get(self, var: ContextVar) -> Any:
+        return var.get()
+
+    def _set(self, var: ContextVar, value: Any):
+        var.set(value)
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self._set(_llm_started, (time.perf_counter(), []))
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        started = self._get(_llm_started)
+        if started is not None:
+            if not started[1]:
+                METRICS.observe("llm_ttft", time.perf_counter() - started[0])
+            started[1].append(token)
+
+    def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        started = self._get(_llm_started)
+        usage = (response.llm_output or {}).get("token_usage")
+        if started is not None:
+            METRICS.observe("llm", time.perf_counter() - started[0])
+            self._set(_llm_started, None)
+            if started[1] and not (usage or {}).get("completion_tokens"):
+                METRICS.increment("tokens", count_tokens("".join(started[1])), kind="completion")
+        record_usage(usage)
+
+    def on_llm_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self._set(_llm_started, None)
+        record_error(error, "llm")
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], **kwargs: Any) -> None:
+        pass
+
+    def on_chain_end(self, outputs: Dict[str, Any], **kwargs: Any) -> None:
+        pass
+
+    def on_chain_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        pass
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        self._set(_tool_started, (time.perf_counter(), serialized.get("name", "tool")))
+
+    def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        started = self._get(_tool_started)
+        if started is not None:
+            METRICS.observe("tool", time.perf_counter() - started[0], tool=started[1])
+            self._set(_tool_started, None)
+
+    def on_tool_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self._set(_tool_started, None)
+        record_error(error, "tool")
+
+    def on_text(self, text: str, **kwargs: Any) -> None:
+        pass
+
+    def on_agent_action(self, action: AgentAction, **kwargs: Any) -> Any:
+        pass
+
+    def on_agent_finish(self, finish: AgentFinish, **kwargs: Any) -> None:
+        pass
+
+
+class _InstanceStateHandler(MetricsCallbackHandler):
+    # Keeps the starts on the handler instead of in context variables
+
+    def __init__(self):
+        self.state: Dict[ContextVar, Any] = {}
+
+    def _get(self, var: ContextVar) -> Any:
+        return self.state.get(var)
+
+    def _set(self, var: ContextVar, value: Any):
+        self.state[var] = value
+
+
+class AsyncMetricsCallbackHandler(AsyncCallbackHandler):
+    """
+    MetricsCallbackHandler for an AsyncCallbackManager. The manager runs every callback in a task of its own, where
+    context variables set by one callback are lost to the next, so the starts are kept on the handler: give every
+    LLM that makes concurrent calls its own manager and handler.
+    """
+
+    def __init__(self):
+        self.handler = _InstanceStateHandler()
+
+    @property
+    def always_verbose(self) -> bool:
+        return True
+
+    async def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self.handler.on_llm_start(serialized, prompts, **kwargs)
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.handler.on_llm_new_token(token, **kwargs)
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.handler.on_llm_end(response, **kwargs)
+
+    async def on_llm_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self.handler.on_llm_error(error, **kwargs)
+
+    async def on_tool_start(self, serialized: Dict[str, Any], input_str: str, **kwargs: Any) -> None:
+        self.handler.on_tool_start(serialized, input_str, **kwargs)
+
+    async def on_tool_end(self, output: str, **kwargs: Any) -> None:
+        self.handler.on_tool_end(output, **kwargs)
+
+    async def on_tool_error(self, error: Union[Exception, KeyboardInterrupt], **kwargs: Any) -> None:
+        self.handler.on_tool_error(error, **kwargs)
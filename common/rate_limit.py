@@ -0,0 +1,187 @@
+import asyncio
+import random
+import sys
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from common.instrumentation import increment
+
+T = TypeVar('T')
+
+
+class TokenBucket:
+    """
+    Token bucket that refills continuously at `rate_per_minute`.
+    acquire() waits until enough tokens are available, so callers are smoothed out instead of bursting into the
+    API's per-minute limits.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        """
+        :param rate_per_minute: tokens added to the bucket per minute
+        :param capacity: maximum number of tokens the bucket can hold. Defaults to one minute's worth
+        """
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        """
+        Take `amount` tokens from the bucket, waiting for the refill if needed.
+        Requests larger than the capacity are capped to it, otherwise they could never be served.
+        :param amount: number of tokens to take
+        """
+        amount = min(amount, self.capacity)
+        # The lock keeps waiters in arrival order, so a large request is not starved by small ones
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+
+class RateLimiter:
+    """
+    Combined requests-per-minute and tokens-per-minute limits, matching how the OpenAI API meters usage.
+    """
+
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None):
+        """
+        :param requests_per_minute: request limit, None for no limit
+        :param tokens_per_minute: token (prompt + completion) limit, None for no limit
+        """
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    async def acquire(self, tokens: int):
+        """
+        Wait until one request using about `tokens` tokens may be sent.
+        :param tokens: estimated prompt + completion tokens of the request
+        """
+        if self.requests is not None:
+            await self.requests.acquire(1)
+        if self.tokens is not None:
+            await self.tokens.acquire(tokens)
+
+
+def estimate_tokens(prompt: str, max_tokens: int) -> int:
+    """
+    Rough token count of a completion request: about four characters per prompt token, plus the completion budget.
+    :param prompt: prompt text
+    :param max_tokens: maximum number of tokens to generate
+    :return: estimated tokens
+    """
+    return len(prompt) // 4 + 1 + max_tokens
+
+
+# Error classes of classify_error(). Only the transient ones are retried
+RATE_LIMIT = "rate_limit"
+SERVER_ERROR = "server_error"
+TIMEOUT = "timeout"
+CONNECTION_ERROR = "connection_error"
+CLIENT_ERROR = "client_error"
+TRANSIENT_ERRORS = (RATE_LIMIT, SERVER_ERROR, TIMEOUT, CONNECTION_ERROR)
+
+
+def _classify_library_error(error: BaseException) -> Optional[str]:
+    # Errors of aiohttp, and openai's own errors raised through LangChain, that carry no status code. A library that
+    # was never imported raised none, so neither is imported here
+    aiohttp = sys.modules.get('aiohttp')
+    if aiohttp is not None and isinstance(error, aiohttp.ClientError):
+        return CONNECTION_ERROR
+    errors = sys.modules.get('openai.error')
+    if errors is None:
+        return None
+    if isinstance(error, errors.Timeout):
+        return TIMEOUT
+    if isinstance(error, errors.APIConnectionError):
+        return CONNECTION_ERROR
+    if isinstance(error, errors.RateLimitError):
+        return RATE_LIMIT
+    if isinstance(error, (errors.APIError, errors.ServiceUnavailableError, errors.TryAgain)):
+        return SERVER_ERROR
+    return None
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """
+    :param error: an APIError of common.http_client, or an openai.error.OpenAIError raised through LangChain
+    :return: the HTTP status code of the response the error comes from, or None
+    """
+    code = getattr(error, 'status_code', None)
+    return code if code is not None else getattr(error, 'http_status', None)
+
+
+def classify_error(error: BaseException) -> str:
+    """
+    Sort an error of a request to the OpenAI API by whether and why it is worth retrying.
+    :param error: the exception raised by the call
+    :return: RATE_LIMIT (429), SERVER_ERROR (5xx), TIMEOUT, CONNECTION_ERROR, or CLIENT_ERROR for errors a retry
+             would only repeat, like a bad request or an invalid key
+    """
+    code = status_code(error)
+    if code is not None:
+        return RATE_LIMIT if code == 429 else SERVER_ERROR if code >= 500 else CLIENT_ERROR
+    if isinstance(error, asyncio.TimeoutError):
+        return TIMEOUT
+    return _classify_library_error(error) or CLIENT_ERROR
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Rate limits, server errors, timeouts and dropped connections are worth retrying; other client errors are not.
+    :param error: the exception raised by the call
+    :return: True if the call should be retried
+    """
+    return classify_error(error) in TRANSIENT_ERRORS
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0, max_delay: float = 60.0) -> float:
+    """
+    Exponential backoff with full jitter.
+    :param attempt: number of failed attempts so far, starting at 1
+    :param base_delay: delay ceiling after the first failure, in seconds
+    :param max_delay: upper bound of the delay ceiling, in seconds
+    :return: seconds to wait before the next attempt
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+async def call_with_retries(call: Callable[[], Awaitable[T]],
+                            max_retries: int = 5,
+                            base_delay: float = 1.0,
+                            max_delay: float = 60.0,
+                            on_retry: Optional[Callable[[int, BaseException, float], None]] = None) -> T:
+    """
+    Await `call()`, retrying retryable errors with exponential backoff and jitter.
+    When the server sends a Retry-After header, that delay is used instead of the computed one.
+    :param call: function returning a new awaitable for every attempt
+    :param max_retries: number of retries after the first attempt
+    :param base_delay: backoff delay ceiling after the first failure, in seconds
+    :param max_delay: upper bound of the backoff delay, in seconds
+    :param on_retry: called with (attempt, error, delay) before sleeping
+    :return: the result of the first successful attempt
+    """
+    attempt = 0
+    while True:
+        try:
+            return await call()
+        except Exception as e:
+            attempt += 1
+            if attempt > max_retries or not is_retryable(e):
+                raise
+            retry_after = getattr(e, 'retry_after', None)
+            delay = retry_after if retry_after is not None else backoff_delay(attempt, base_delay, max_delay)
+            code = status_code(e)
+            increment("retries", reason=str(code) if code is not None else type(e).__name__)
+            if on_retry is not None:
+                on_retry(attempt, e, delay)
+            await asyncio.sleep(delay)
@@ -0,0 +1,432 @@
+"""
+Resilient requests to the OpenAI API.
+
+A ResilientClient runs every request of the samples through:
+- retries of transient errors only (rate limits, server errors, timeouts and dropped connections, see
+  rate_limit.classify_error()), with exponential backoff and jitter, or the delay of a Retry-After header;
+- a circuit breaker per endpoint: after `failure_threshold` server errors, timeouts or dropped connections in a row,
+  requests to the endpoint fail at once with CircuitOpenError for `reset_timeout` seconds, then a single trial
+  request decides whether they go through again;
+- a deadline for the whole call, retries included, which also bounds every attempt;
+- optionally, hedging: when an attempt takes longer than the 95th percentile of the endpoint's recent latencies, a
+  duplicate request is sent and the first answer is used. At most `max_hedge_ratio` of the calls are hedged, so a
+  slow API does not get twice the load.
+
+    client = ResilientClient(max_retries=3, deadline=60, hedge=True)
+    result = await client.call("/completions", lambda: http_client.create_completion(prompt))
+    use_resilient_client(llm, client)         # the same for the requests of a LangChain OpenAI LLM
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from common.instrumentation import increment
+from common.rate_limit import (CONNECTION_ERROR, SERVER_ERROR, TIMEOUT, TRANSIENT_ERRORS, backoff_delay,
+                               classify_error, status_code)
+
+T = TypeVar('T')
+
+# Errors that say the endpoint is unhealthy. A rate limit or a bad request gets an answer, so it does not count
+ENDPOINT_FAILURES = (SERVER_ERROR, TIMEOUT, CONNECTION_ERROR)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of sending a request to an endpoint whose circuit breaker is open.
+    `retry_after` is the number of seconds until a request is tried again.
+    """
+
+    def __init__(self, endpoint: str, retry_after: float):
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+        super().__init__(f"Requests to {endpoint} are suspended after repeated failures, "
+                         f"retrying in {retry_after:.0f}s")
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when a call did not succeed within its deadline, retries included. The error of the last attempt is its
+    __cause__.
+    """
+
+
+class CircuitBreaker:
+    """
+    Closed, requests pass and failures in a row are counted. After `failure_threshold` of them the breaker opens and
+    rejects requests for `reset_timeout` seconds. It is then half-open: one trial request passes, and closes the
+    breaker when it succeeds or opens it again when it fails.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        :param failure_threshold: failures in a row that open the breaker
+        :param reset_timeout: seconds the breaker stays open before a trial request
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def before_call(self, endpoint: str) -> bool:
+        """
+        Let a request through, or reject it.
+        :param endpoint: name of the endpoint, for the error message
+        :return: True when the request is the trial request of the half-open breaker. It must end with record(), or
+                 with release() when it ends without an outcome
+        :raises CircuitOpenError: when the breaker is open, or half-open with its trial request under way
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            waited = time.monotonic() - self.opened_at
+            if waited < self.reset_timeout or self._trial:
+                raise CircuitOpenError(endpoint, max(0.0, self.reset_timeout - waited))
+            self._trial = True
+            return True
+
+    def release(self):
+        """
+        End the trial request without an outcome, e.g. when it was cancelled, so that the next request is the trial.
+        """
+        with self._lock:
+            self._trial = False
+
+    def record(self, error: Optional[BaseException]):
+        """
+        Record the outcome of a request that was let through.
+        :param error: the error it raised, None when it succeeded
+        """
+        failed = error is not None and classify_error(error) in ENDPOINT_FAILURES
+        with self._lock:
+            if not failed:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self._trial or self.failures >= self.failure_threshold:
+                    self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class LatencyTracker:
+    """
+    Latencies of the last `window` successful requests to an endpoint.
+    """
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        """
+        :param window: number of latencies kept
+        :param min_samples: latencies needed before percentile() answers
+        """
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        :return: the given percentile of the recent latencies in seconds, None while there are too few of them
+        """
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return None
+            ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+@dataclass
+class ResilienceStats:
+    calls: int = 0
+    retries: int = 0
+    failed: int = 0
+    rejected: int = 0
+    past_deadline: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+
+    def __str__(self):
+        return (f"{self.calls} calls, {self.retries} retries, {self.failed} failed, {self.rejected} rejected by an "
+                f"open circuit, {self.past_deadline} past their deadline, {self.hedged} hedged "
+                f"({self.hedge_wins} answered by the duplicate)")
+
+
+class ResilientClient:
+    """
+    Retries, circuit breakers, deadlines and hedging for requests to the OpenAI API, see the module docstring.
+    call() runs a request from an event loop, call_sync() from a thread. Both can be used from several event loops
+    and threads at the same time; the breakers and latencies of an endpoint are shared by all of them.
+    """
+
+    def __init__(self,
+                 max_retries: int = 3,
+                 base_delay: float = 1.0,
+                 max_delay: float = 30.0,
+                 deadline: Optional[float] = 60.0,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30.0,
+                 hedge: bool = False,
+                 hedge_percentile: float = 95.0,
+                 max_hedge_ratio: float = 0.1):
+        """
+        :param max_retries: retries after the first attempt
+        :param base_delay: backoff delay ceiling after the first failure, in seconds
+        :param max_delay: upper bound of the backoff delay, in seconds
+        :param deadline: seconds a call may take, retries included, None for no limit
+        :param failure_threshold: failures in a row that open an endpoint's circuit breaker
+        :param reset_timeout: seconds a circuit breaker stays open
+        :param hedge: send a duplicate of an asynchronous request slower than `hedge_percentile`
+        :param hedge_percentile: percentile of the endpoint's recent latencies after which a request is hedged
+        :param max_hedge_ratio: maximum fraction of the calls that are hedged
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.max_hedge_ratio = max_hedge_ratio
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.latencies: Dict[str, LatencyTracker] = {}
+        self.stats = ResilienceStats()
+        self._lock = threading.Lock()
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            if endpoint not in self.breakers:
+                self.breakers[endpoint] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            return self.breakers[endpoint]
+
+    def latency(self, endpoint: str) -> LatencyTracker:
+        with self._lock:
+            if endpoint not in self.latencies:
+                self.latencies[endpoint] = LatencyTracker()
+            return self.latencies[endpoint]
+
+    def _count(self, name: str, endpoint: str):
+        with self._lock:
+            setattr(self.stats, name, getattr(self.stats, name) + 1)
+        if name not in ("calls", "retries"):
+            increment(f"requests_{name}", endpoint=endpoint)
+
+    def _remaining(self, started: float) -> Optional[float]:
+        return None if self.deadline is None else max(0.0, self.deadline - (time.monotonic() - started))
+
+    def _before_attempt(self, endpoint: str, breaker: CircuitBreaker, started: float,
+                        error: Optional[Exception]) -> bool:
+        # Raise instead of sending the next attempt when the breaker is open or the deadline has passed. Returns
+        # whether the attempt is the breaker's trial request
+        try:
+            trial = breaker.before_call(endpoint)
+        except CircuitOpenError:
+            self._count("rejected", endpoint)
+            raise
+        if self._remaining(started) == 0.0:
+            if trial:
+                breaker.release()
+            self._count("past_deadline", endpoint)
+            raise DeadlineExceeded(f"No answer from {endpoint} within {self.deadline:g}s") from error
+        return trial
+
+    def _retry_delay(self, endpoint: str, breaker: CircuitBreaker, attempt: int, error: Exception,
+                     started: float) -> Optional[float]:
+        """
+        Record the failed attempt and decide on the next one.
+        :return: seconds to wait before retrying, None when the error is not retried
+        :raises DeadlineExceeded: when the retry would start after the deadline
+        """
+        breaker.record(error)
+        # A failure that opened the breaker is not retried either: the retry would only be rejected
+        if classify_error(error) not in TRANSIENT_ERRORS or attempt > self.max_retries or breaker.state == "open":
+            self._count("failed", endpoint)
+            return None
+        retry_after = getattr(error, 'retry_after', None)
+        delay = retry_after if retry_after is not None else backoff_delay(attempt, self.base_delay, self.max_delay)
+        remaining = self._remaining(started)
+        if remaining is not None and delay >= remaining:
+            self._count("past_deadline", endpoint)
+            raise DeadlineExceeded(f"No answer from {endpoint} within {self.deadline:g}s") from error
+        self._count("retries", endpoint)
+        code = status_code(error)
+        increment("retries", reason=str(code) if code is not None else type(error).__name__)
+        return delay
+
+    async def call(self, endpoint: str, make_call: Callable[[], Awaitable[T]], hedge: bool = True) -> T:
+        """
+        Await `make_call()`, with retries, the endpoint's circuit breaker, the deadline and, when enabled, hedging.
+        :param endpoint: name of the endpoint, e.g. '/completions'; every endpoint has its own breaker and latencies
+        :param make_call: function returning a new awaitable for every attempt
+        :param hedge: False for requests that must not be sent twice, like streamed ones
+        :return: the result of the first successful attempt
+        :raises CircuitOpenError: when the endpoint's breaker is open
+        :raises DeadlineExceeded: when no attempt succeeded within the deadline
+        """
+        self._count("calls", endpoint)
+        breaker = self.breaker(endpoint)
+        started = time.monotonic()
+        attempt = 0
+        error = None
+        while True:
+            trial = self._before_attempt(endpoint, breaker, started, error)
+            try:
+                result = await self._attempt(endpoint, make_call, self._remaining(started), hedge and self.hedge)
+            except Exception as e:
+                attempt += 1
+                delay = self._retry_delay(endpoint, breaker, attempt, e, started)
+                if delay is None:
+                    raise
+                error = e
+                await asyncio.sleep(delay)
+            except BaseException:
+                # Cancelled: the attempt has no outcome, but a trial request must not hold the breaker half-open
+                if trial:
+                    breaker.release()
+                raise
+            else:
+                breaker.record(None)
+                return result
+
+    def call_sync(self, endpoint: str, make_call: Callable[[Optional[float]], T]) -> T:
+        """
+        call() for blocking requests, without hedging.
+        :param endpoint: name of the endpoint
+        :param make_call: function making one attempt, given the seconds it may take (None for no limit)
+        :return: the result of the first successful attempt
+        """
+        self._count("calls", endpoint)
+        breaker = self.breaker(endpoint)
+        started = time.monotonic()
+        attempt = 0
+        error = None
+        while True:
+            trial = self._before_attempt(endpoint, breaker, started, error)
+            attempt_started = time.monotonic()
+            try:
+                result = make_call(self._remaining(started))
+            except Exception as e:
+                attempt += 1
+                delay = self._retry_delay(endpoint, breaker, attempt, e, started)
+                if delay is None:
+                    raise
+                error = e
+                time.sleep(delay)
+            except BaseException:
+                # Interrupted, e.g. by Ctrl+C: as in call()
+                if trial:
+                    breaker.release()
+                raise
+            else:
+                breaker.record(None)
+                self.latency(endpoint).record(time.monotonic() - attempt_started)
+                return result
+
+    def _may_hedge(self) -> bool:
+        with self._lock:
+            return self.stats.hedged < self.max_hedge_ratio * self.stats.calls
+
+    async def _attempt(self, endpoint: str, make_call: Callable[[], Awaitable[T]], timeout: Optional[float],
+                       hedge: bool) -> T:
+        # One attempt, and its duplicate when it is slower than the endpoint's usual latency. The first to succeed
+        # wins and the other is cancelled; the attempt fails when both do, or when the timeout passes
+        latency = self.latency(endpoint)
+        hedge_after = latency.percentile(self.hedge_percentile) if hedge else None
+        deadline = None if timeout is None else time.monotonic() + timeout
+        tasks: Dict[asyncio.Future, float] = {asyncio.ensure_future(make_call()): time.monotonic()}
+        try:
+            if hedge_after is not None and (timeout is None or hedge_after < timeout):
+                done, _ = await asyncio.wait(list(tasks), timeout=hedge_after)
+                if not done and self._may_hedge():
+                    self._count("hedged", endpoint)
+                    tasks[asyncio.ensure_future(make_call())] = time.monotonic()
+            winner = await self._first_success(list(tasks), deadline)
+            latency.record(time.monotonic() - tasks[winner])
+            if len(tasks) > 1 and winner is not next(iter(tasks)):
+                self._count("hedge_wins", endpoint)
+            return winner.result()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    @staticmethod
+    async def _first_success(tasks: List[asyncio.Future], deadline: Optional[float]) -> asyncio.Future:
+        pending = set(tasks)
+        error = None
+        while pending:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                raise asyncio.TimeoutError()
+            for task in sorted(done, key=tasks.index):
+                if task.exception() is None:
+                    return task
+                error = error or task.exception()
+        raise error
+
+
+class ResilientOpenAIResource:
+    """
+    Stands in for openai.Completion (or another openai API resource) as the `client` of a LangChain OpenAI LLM, so
+    that the requests of the LLM go through a ResilientClient. See use_resilient_client().
+    """
+
+    def __init__(self, resource: Any, client: ResilientClient):
+        self.resource = resource
+        self.client = client
+        self.endpoint = f"/{getattr(resource, 'OBJECT_NAME', 'completions')}"
+
+    def create(self, **kwargs: Any) -> Any:
+        # The deadline left bounds every attempt
+        def attempt(timeout: Optional[float]) -> Any:
+            return self.resource.create(**kwargs if timeout is None else {**kwargs, "request_timeout": timeout})
+
+        return self.client.call_sync(self.endpoint, attempt)
+
+    async def acreate(self, **kwargs: Any) -> Any:
+        # A streamed response is not hedged: its tokens are printed as they arrive
+        return await self.client.call(self.endpoint, lambda: self.resource.acreate(**kwargs),
+                                      hedge=not kwargs.get("stream", False))
+
+
+def use_resilient_client(llm: Any, client: ResilientClient) -> Any:
+    """
+    Send the requests of a LangChain OpenAI LLM through `client`. LangChain's own retries are turned off, so a
+    failed request is not retried by both.
+    :param llm: langchain.llms.OpenAI or another LLM with an openai API resource as its `client`
+    :param client: the resilient client
+    :return: the LLM
+    """
+    resource = llm.client.resource if isinstance(llm.client, ResilientOpenAIResource) else llm.client
+    llm.client = ResilientOpenAIResource(resource, client)
+    llm.max_retries = 1
+    return llm
+
+
+def resilient_client_from_config(config: Any) -> ResilientClient:
+    """
+    A ResilientClient with the MAX_RETRIES, REQUEST_DEADLINE, HEDGE_REQUESTS, CIRCUIT_BREAKER_FAILURES and
+    CIRCUIT_BREAKER_RESET keys of the [SETTINGS] of a config.ini.
+    :param config: parsed config.ini
+    :return: the client
+    """
+    deadline = config.getfloat('SETTINGS', 'REQUEST_DEADLINE', fallback=60.0)
+    return ResilientClient(max_retries=config.getint('SETTINGS', 'MAX_RETRIES', fallback=3),
+                           deadline=deadline or None,
+                           hedge=config.getboolean('SETTINGS', 'HEDGE_REQUESTS', fallback=False),
+                           failure_threshold=config.getint('SETTINGS', 'CIRCUIT_BREAKER_FAILURES', fallback=5),
+                           reset_timeout=config.getfloat('SETTINGS', 'CIRCUIT_BREAKER_RESET', fallback=30.0))
@@ -0,0 +1,177 @@
+"""
+Faster startup of the interactive samples.
+
+Importing LangChain, Chroma and pdfplumber and opening a vector store take seconds. The samples keep those imports
+inside the functions that need them and hand the slow setup to a Deferred, which builds it in a background thread
+while the user types the first question, or only when it is first used:
+
+    session = Deferred(load_session)          # starts loading now
+    ...
+    session.get().query(question)             # waits for it, the first time only
+
+A sample can also run as a resident daemon that keeps everything loaded and answers over a Unix socket. The CLI then
+only imports this module and the standard library before it connects, so it is ready at once:
+
+    serve_daemon("pdf-qa.sock", handle)       # python pdf-qa-chat.py serve
+    client = connect_daemon("pdf-qa.sock")    # None when no daemon is running
+    client.request(question="...")
+
+Requests and responses are JSON objects, one per line. `handle(request, state)` gets a `state` dict of its own for
+every connection, where a sample keeps e.g. the conversation memory of that client.
+"""
+import json
+import os
+import socket
+import socketserver
+import threading
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class Deferred(Generic[T]):
+    """
+    A value built by `build()`, in a background thread started right away or, with `background=False`, on first
+    use. get() waits for it and raises the error the build raised, every time it is called. Other attributes are
+    looked up on the value, so a Deferred can stand in for it where only its methods are used.
+    """
+
+    def __init__(self, build: Callable[[], T], background: bool = True, name: str = "deferred"):
+        """
+        :param build: function making the value
+        :param background: start building in a daemon thread now, instead of in the first get()
+        :param name: name of the thread
+        """
+        self._build = build
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._value: Optional[T] = None
+        self._error: Optional[BaseException] = None
+        if background:
+            threading.Thread(target=self._run, name=name, daemon=True).start()
+
+    def _run(self):
+        with self._lock:
+            if self._done.is_set():
+                return
+            try:
+                self._value = self._build()
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._done.set()
+
+    def ready(self) -> bool:
+        """
+        :return: True once the value is built, False while it is being built or when building it failed
+        """
+        return self._done.is_set() and self._error is None
+
+    def get(self) -> T:
+        if not self._done.is_set():
+            self._run()
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.get(), name)
+
+
+class DaemonError(Exception):
+    """
+    Raised by DaemonClient.request() when the daemon could not handle the request.
+    """
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        state: Dict[str, Any] = {}
+        for line in self.rfile:
+            try:
+                response = self.server.handle_request_line(json.loads(line), state)
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(response) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, handle: Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]):
+        self.handle_request_line = handle
+        super().__init__(path, _Handler)
+
+
+def serve_daemon(path: str, handle: Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]):
+    """
+    Answer requests on a Unix socket until interrupted. Every connection is served by a thread of its own.
+    A socket left behind by a daemon that died is replaced; a running daemon is not.
+    :param path: socket file, only accessible to the current user
+    :param handle: called with every request and the state dict of its connection, returns the response. An
+                   exception is sent back as an error
+    """
+    if os.path.exists(path):
+        client = connect_daemon(path)
+        if client is not None:
+            client.close()
+            raise RuntimeError(f"A daemon is already listening on {path}")
+        os.remove(path)
+    server = _UnixServer(path, handle)
+    os.chmod(path, 0o600)
+    print(f"Listening on {path}. Stop with Ctrl+C.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class DaemonClient:
+    """
+    Connection to a daemon started with serve_daemon().
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._file = sock.makefile("rwb")
+
+    def request(self, **payload: Any) -> Dict[str, Any]:
+        """
+        Send a request and wait for its response.
+        :raises DaemonError: when the daemon failed to handle it
+        :raises ConnectionError: when the daemon went away
+        """
+        self._file.write((json.dumps(payload) + "\n").encode("utf-8"))
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("The daemon closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise DaemonError(response["error"])
+        return response
+
+    def close(self):
+        self._file.close()
+        self.sock.close()
+
+
+def connect_daemon(path: str) -> Optional[DaemonClient]:
+    """
+    :param path: socket file of the daemon
+    :return: a connection to the daemon, or None when none is running (or Unix sockets are not supported)
+    """
+    if not path or not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return DaemonClient(sock)
@@ -0,0 +1,134 @@
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator, List, Optional
+
+
+class TokenSink:
+    """
+    Destination for streamed tokens. Subclass it to send tokens somewhere other than the terminal,
+    e.g. a websocket or a queue.
+    """
+
+    def write(self, token: str):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class StdoutSink(TokenSink):
+    """
+    Write tokens to stdout as they arrive.
+    If `erase` is set, that many characters (e.g. a "waiting" placeholder) are wiped before the first token is shown.
+    """
+
+    def __init__(self, erase: int = 0):
+        self.erase = erase
+
+    def write(self, token: str):
+        if self.erase:
+            sys.stdout.write("\r" + " " * self.erase + "\r")
+            self.erase = 0
+        sys.stdout.write(token)
+        sys.stdout.flush()
+
+    def close(self):
+        sys.stdout.write("\n")
+        sys.stdout.flush()
+
+
+class ListSink(TokenSink):
+    """
+    Collect tokens in memory, for callers that want the tokens but not the terminal output.
+    """
+
+    def __init__(self):
+        self.tokens: List[str] = []
+
+    def write(self, token: str):
+        self.tokens.append(token)
+
+    @property
+    def text(self) -> str:
+        return ''.join(self.tokens)
+
+
+@dataclass
+class StreamStats:
+    """
+    Timings of one streamed response, in seconds from the moment the request was sent.
+    """
+    started: float = field(default_factory=time.perf_counter)
+    time_to_first_token: Optional[float] = None
+    total_time: Optional[float] = None
+    tokens: int = 0
+
+    def on_token(self):
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self.started
+        self.tokens += 1
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.started
+
+    def __str__(self):
+        ttft = f"{self.time_to_first_token * 1000:.0f}ms" if self.time_to_first_token is not None else "n/a"
+        total = f"{self.total_time * 1000:.0f}ms" if self.total_time is not None else "n/a"
+        return f"first token {ttft}, total {total}, {self.tokens} tokens"
+
+
+async def parse_sse(chunks: AsyncIterable[bytes]) -> AsyncIterator[str]:
+    """
+    Incrementally parse a server-sent-events byte stream and yield the data of each event as soon as it is complete.
+    Chunks may split lines or events at any byte. Comments and fields other than `data` are ignored, and multi-line
+    data is joined with newlines as the SSE spec requires.
+    :param chunks: raw bytes of the response body, e.g. aiohttp's `resp.content.iter_any()`
+    :return: async iterator over event data strings
+    """
+    buffer = b''
+    data_lines: List[str] = []
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            newline = buffer.find(b'\n')
+            if newline < 0:
+                break
+            line = buffer[:newline].rstrip(b'\r').decode('utf-8')
+            buffer = buffer[newline + 1:]
+            if not line:
+                if data_lines:
+                    yield '\n'.join(data_lines)
+                    data_lines = []
+            elif line.startswith('data:'):
+                value = line[5:]
+                data_lines.append(value[1:] if value.startswith(' ') else value)
+    if data_lines:
+        yield '\n'.join(data_lines)
+
+
+async def stream_to_sink(tokens: AsyncIterable[str], sink: TokenSink, stats: Optional[StreamStats] = None) -> str:
+    """
+    Forward tokens to a sink as they arrive and record the time to first token.
+    Leading whitespace (completions usually start with blank lines) is not forwarded to the sink.
+    :param tokens: async iterator over tokens
+    :param sink: where to write the tokens
+    :param stats: timings to fill in. Create it right before sending the request so the request time is included
+    :return: the full response text, stripped
+    """
+    stats = stats if stats is not None else StreamStats()
+    parts = []
+    visible = False
+    try:
+        async for token in tokens:
+            stats.on_token()
+            parts.append(token)
+            if not visible:
+                token = token.lstrip()
+                visible = bool(token)
+            if token:
+                sink.write(token)
+    finally:
+        stats.finish()
+        sink.close()
+    return ''.join(parts).strip()
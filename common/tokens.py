@@ -0,0 +1,69 @@
+from functools import lru_cache
+from typing import Callable
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+DEFAULT_MODEL = "text-davinci-003"
+# Tokens of prompt and completion together
+CONTEXT_WINDOWS = {
+    "text-davinci-003": 4097,
+    "text-davinci-002": 4097,
+    "gpt-3.5-turbo": 4096,
+    "gpt-4": 8192,
+    "gpt-4-32k": 32768,
+}
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def approximate_token_count(text: str) -> int:
+    """
+    Estimate the number of tokens of English text at about four characters per token.
+    :param text: text to measure
+    :return: estimated number of tokens
+    """
+    return (len(text) + 3) // 4
+
+
+def get_token_counter(model: str = DEFAULT_MODEL) -> Callable[[str], int]:
+    """
+    Return a function counting the tokens of a string for the given model.
+    The count is exact when tiktoken is installed, and an estimate of four characters per token otherwise.
+    :param model: OpenAI model name
+    :return: function mapping a string to its number of tokens
+    """
+    if tiktoken is None:
+        return approximate_token_count
+    encoding = _encoding(model)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """
+    Count the tokens of a string for the given model. See get_token_counter().
+    :param text: text to measure
+    :param model: OpenAI model name
+    :return: number of tokens
+    """
+    return get_token_counter(model)(text)
+
+
+def context_window(model: str = DEFAULT_MODEL) -> int:
+    """
+    Maximum number of tokens of a prompt and its completion for the given model, 4097 for unknown models.
+    :param model: OpenAI model name, dated snapshots like "gpt-4-0314" included
+    :return: number of tokens
+    """
+    for name in sorted(CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(name):
+            return CONTEXT_WINDOWS[name]
+    return 4097
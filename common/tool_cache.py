@@ -0,0 +1,253 @@
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+from langchain.tools import BaseTool
+from pydantic import PrivateAttr
+
+from common.answer_cache import normalize_question
+
+# Time at which a result made at a given time expires
+Expiry = Callable[[float], float]
+
+
+def normalize_tool_input(tool_input: str) -> str:
+    """
+    Key of a tool input: case, repeated whitespace, surrounding quotes and trailing punctuation are ignored, so
+    "Hollywood movies  released on May 18?" and 'hollywood movies released on may 18' share a result.
+    """
+    return normalize_question(tool_input.strip().strip('"\'`'))
+
+
+def expires_after(seconds: float) -> Expiry:
+    """
+    Expiry of results that stay valid for a fixed time, e.g. search results.
+    :param seconds: lifetime of a result
+    """
+    return lambda created: created + seconds
+
+
+def expires_at_midnight(created: float) -> float:
+    """
+    Expiry of results that depend on the current date, like the Date Parser's: the next local midnight.
+    """
+    tomorrow = date.fromtimestamp(created) + timedelta(days=1)
+    return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+
+@dataclass
+class CachedResult:
+    result: str
+    expires: float
+    seconds: float
+    """How long the tool took to produce the result, saved by every hit."""
+
+
+@dataclass
+class ToolCacheStats:
+    """
+    Counters of a CachedTool.
+    """
+    hits: int = 0
+    misses: int = 0
+    expired: int = 0
+    seconds_saved: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def record_hit(self, seconds: float):
+        self.hits += 1
+        self.seconds_saved += seconds
+
+    def record_miss(self, expired: bool):
+        self.misses += 1
+        self.expired += expired
+
+    def __str__(self):
+        return (f"{self.hits + self.misses} calls, hit rate {self.hit_rate:.1%} ({self.hits} hits, {self.misses} misses "
+                f"of which {self.expired} expired), {self.seconds_saved:.1f}s saved")
+
+
+class ToolResultCache:
+    """
+    Results of tool calls by tool name and normalized input, shared by the CachedTool wrappers of several tools.
+
+    Entries live in memory as an LRU of at most `max_entries` results. With `path`, they are also kept in a SQLite
+    file and loaded back on start, so repeated agent runs reuse the results of earlier ones until they expire.
+    """
+
+    def __init__(self, max_entries: int = 1000, path: Optional[str] = None):
+        """
+        :param max_entries: maximum number of cached results over all tools
+        :param path: SQLite file to persist the cache to, None to keep it in memory only
+        """
+        self.max_entries = max_entries
+        self.evicted = 0
+        self._entries: "OrderedDict[Tuple[str, str], CachedResult]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS tool_results (tool TEXT, input TEXT, result TEXT, "
+                             "expires REAL, seconds REAL, PRIMARY KEY (tool, input))")
+            self._db.execute("DELETE FROM tool_results WHERE expires <= ?", (time.time(),))
+            self._db.commit()
+            rows = self._db.execute("SELECT tool, input, result, expires, seconds FROM tool_results ORDER BY rowid")
+            for tool, tool_input, result, expires, seconds in rows:
+                self._entries[(tool, tool_input)] = CachedResult(result, expires, seconds)
+            self._evict()
+
+    def _delete(self, keys):
+        if self._db is not None and keys:
+            self._db.executemany("DELETE FROM tool_results WHERE tool = ? AND input = ?", keys)
+            self._db.commit()
+
+    def _evict(self):
+        overflow = list(self._entries)[:max(0, len(self._entries) - self.max_entries)]
+        for key in overflow:
+            del self._entries[key]
+        self.evicted += len(overflow)
+        self._delete(overflow)
+
+    def get(self, tool: str, tool_input: str, now: Optional[float] = None) -> Tuple[Optional[CachedResult], bool]:
+        """
+        :param tool: tool name
+        :param tool_input: normalized input
+        :param now: current time, defaults to time.time()
+        :return: the valid cached result or None, and whether an expired result was dropped
+        """
+        now = time.time() if now is None else now
+        key = (tool, tool_input)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None, False
+            if entry.expires <= now:
+                del self._entries[key]
+                self._delete([key])
+                return None, True
+            self._entries.move_to_end(key)
+            return entry, False
+
+    def put(self, tool: str, tool_input: str, entry: CachedResult):
+        """
+        Cache a result.
+        :param tool: tool name
+        :param tool_input: normalized input
+        :param entry: the result, its expiry and how long it took
+        """
+        key = (tool, tool_input)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO tool_results VALUES (?, ?, ?, ?, ?)",
+                                 (tool, tool_input, entry.result, entry.expires, entry.seconds))
+                self._db.commit()
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._delete(list(self._entries))
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+
+class CachedTool(BaseTool):
+    """
+    Wrapper serving repeated calls of any tool from a ToolResultCache.
+
+    Calls are keyed on the tool's name and normalize_tool_input() of the input, and a result is kept until the time
+    `ttl` gives for it: a number of seconds, or a function of the time the result was made such as
+    expires_at_midnight. Failed calls are not cached. Concurrent asynchronous calls with the same input wait for one
+    call of the tool and count as hits; when the caller making that call is cancelled, one of them makes it again
+    instead. The wrapper has the tool's name and description, so the agent sees no difference.
+
+        tools = [CachedTool(DateParserTool(), cache, ttl=expires_at_midnight),
+                 CachedTool(search_tool(search), cache, ttl=6 * 3600)]
+    """
+    tool: BaseTool
+    cache: ToolResultCache
+    expiry: Expiry
+    stats: ToolCacheStats
+    _pending: Dict[str, asyncio.Future] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, tool: BaseTool, cache: Optional[ToolResultCache] = None,
+                 ttl: Union[float, Expiry] = 3600, **kwargs: Any):
+        """
+        :param tool: the tool to cache
+        :param cache: cache of the results, may be shared with other tools. Defaults to a new in-memory cache
+        :param ttl: seconds a result stays valid, or function from the time a result was made to its expiry time
+        """
+        super().__init__(tool=tool, cache=cache if cache is not None else ToolResultCache(),
+                         expiry=ttl if callable(ttl) else expires_after(ttl), stats=ToolCacheStats(),
+                         name=tool.name, description=tool.description, return_direct=tool.return_direct, **kwargs)
+
+    def _lookup(self, key: str) -> Optional[str]:
+        entry, expired = self.cache.get(self.name, key)
+        if entry is None:
+            self.stats.record_miss(expired)
+            return None
+        self.stats.record_hit(entry.seconds)
+        return entry.result
+
+    def _store(self, key: str, result: str, started: float):
+        now = time.time()
+        self.cache.put(self.name, key, CachedResult(result, self.expiry(now), time.perf_counter() - started))
+
+    def _run(self, tool_input: str) -> str:
+        key = normalize_tool_input(tool_input)
+        result = self._lookup(key)
+        if result is None:
+            started = time.perf_counter()
+            result = self.tool._run(tool_input)
+            self._store(key, result, started)
+        return result
+
+    async def _arun(self, tool_input: str) -> str:
+        key = normalize_tool_input(tool_input)
+        while key in self._pending:
+            pending = self._pending[key]
+            # Unlike awaiting the future, wait() does not raise when the call is cancelled, and cancelling this
+            # waiter does not cancel the call
+            await asyncio.wait([pending])
+            if not pending.cancelled():
+                result = pending.result()
+                self.stats.record_hit(0.0)
+                return result
+            # The caller that made the call was cancelled: the first waiter to get here makes it again, the others
+            # wait for that call
+        result = self._lookup(key)
+        if result is not None:
+            return result
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        started = time.perf_counter()
+        try:
+            result = await self.tool._arun(tool_input)
+            self._store(key, result, started)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters get the exception; without waiters, do not log it as never retrieved
+            future.exception()
+            raise
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._pending[key]
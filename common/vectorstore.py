@@ -0,0 +1,321 @@
+import json
+import os
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+VECTORS_FILE = "vectors.f32"
+DOCUMENTS_FILE = "documents.json"
+HNSW_FILE = "hnsw.bin"
+
+
+class MemmapVectorStore(VectorStore):
+    """
+    Local vector store keeping unit-length float32 embeddings in one memory-mapped matrix.
+
+    Below `hnsw_threshold` chunks, search is exact: one vectorized dot product of the query with every row. From
+    there on (or always with index="hnsw"), an HNSW graph built with hnswlib answers approximate top-k queries;
+    index="exact" never builds it. Both score by cosine similarity and both apply an optional metadata `filter`
+    before ranking.
+
+    With a `persist_directory`, the matrix lives in VECTORS_FILE and is mapped, not read, when the store is opened,
+    so startup costs only the size of the chunk texts in DOCUMENTS_FILE. New rows are appended to the file;
+    deleted rows are skipped until persist() compacts them away. DOCUMENTS_FILE says how many rows of the file are
+    valid: rows appended after the last persist(), e.g. before a crash, are cut off the next time the file grows.
+    Compacted rows go to a new file, which DOCUMENTS_FILE names, so a crash never leaves the two out of step.
+
+        vectordb = MemmapVectorStore("index", OpenAIEmbeddings())
+        retriever = vectordb.as_retriever(search_kwargs={"k": 2})
+    """
+
+    def __init__(self, persist_directory: Optional[str], embedding_function: Embeddings, index: str = "auto",
+                 hnsw_threshold: int = 20000, hnsw_m: int = 16, hnsw_ef_construction: int = 200,
+                 hnsw_ef_search: int = 64):
+        """
+        :param persist_directory: directory of the store, None to keep it in memory
+        :param embedding_function: embeddings of the chunks and queries
+        :param index: "auto", "exact" or "hnsw"
+        :param hnsw_threshold: number of chunks from which "auto" switches to the HNSW index
+        :param hnsw_m: HNSW graph degree; higher is more accurate and uses more memory
+        :param hnsw_ef_construction: HNSW build-time search width
+        :param hnsw_ef_search: HNSW query-time search width, at least k; higher is more accurate and slower
+        """
+        if index not in ("auto", "exact", "hnsw"):
+            raise ValueError(f"Unknown index '{index}', expected 'auto', 'exact' or 'hnsw'")
+        if index == "hnsw" and hnswlib is None:
+            raise ImportError("The HNSW index needs hnswlib. Install it with `pip install hnswlib`.")
+        self.persist_directory = persist_directory
+        self._embedding_function = embedding_function
+        self.index = index
+        self.hnsw_threshold = hnsw_threshold
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self._vectors: Optional[np.ndarray] = None
+        # Per row: chunk id (None once deleted), text and metadata
+        self._ids: List[Optional[str]] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        self._vectors_file = VECTORS_FILE
+        self._hnsw = None
+        if persist_directory is not None and os.path.exists(os.path.join(persist_directory, DOCUMENTS_FILE)):
+            self._load()
+
+    # Storage
+
+    def _path(self, file_name: str) -> str:
+        return os.path.join(self.persist_directory, file_name)
+
+    def _load(self):
+        with open(self._path(DOCUMENTS_FILE), "r", encoding="utf-8") as f:
+            documents = json.load(f)
+        self._ids, self._texts, self._metadatas = documents["ids"], documents["texts"], documents["metadatas"]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids) if chunk_id is not None}
+        self._vectors_file = documents.get("vectors_file", VECTORS_FILE)
+        if self._ids:
+            # Rows appended after the last persist() are not part of the store
+            size = len(self._ids) * documents["dim"] * np.dtype(np.float32).itemsize
+            if os.path.getsize(self._path(self._vectors_file)) > size:
+                os.truncate(self._path(self._vectors_file), size)
+            self._vectors = np.memmap(self._path(self._vectors_file), dtype=np.float32, mode="r",
+                                      shape=(len(self._ids), documents["dim"]))
+        if hnswlib is not None and os.path.exists(self._path(HNSW_FILE)) and self._vectors is not None:
+            self._hnsw = hnswlib.Index(space="ip", dim=self._vectors.shape[1])
+            self._hnsw.load_index(self._path(HNSW_FILE), max_elements=len(self._ids))
+            self._hnsw.set_ef(self.hnsw_ef_search)
+            # A graph saved for other rows, e.g. before a crash, is rebuilt on the next search that needs it
+            if self._hnsw.get_current_count() != len(self._ids):
+                self._hnsw = None
+
+    def _append_vectors(self, vectors: np.ndarray):
+        if self.persist_directory is None:
+            self._vectors = vectors if self._vectors is None else np.vstack([self._vectors, vectors])
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        rows = 0 if self._vectors is None else self._vectors.shape[0]
+        # Drop the mapping before the file grows; a new one covering all rows is created below
+        self._vectors = None
+        with open(self._path(self._vectors_file), "ab" if rows else "wb") as f:
+            # Cut off rows that were appended but never persisted, or they would shift the new ones
+            f.truncate(rows * vectors.shape[1] * vectors.itemsize)
+            f.write(vectors.tobytes())
+        self._vectors = np.memmap(self._path(self._vectors_file), dtype=np.float32, mode="r",
+                                  shape=(rows + vectors.shape[0], vectors.shape[1]))
+
+    def persist(self):
+        """
+        Write the chunks to the persist directory, compacting deleted rows away first.
+        """
+        if self.persist_directory is None:
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        replaced_file = self._compact() if len(self._rows) < len(self._ids) else None
+        if replaced_file is not None and os.path.exists(self._path(HNSW_FILE)):
+            # The saved graph numbers the rows before compaction
+            os.remove(self._path(HNSW_FILE))
+        dim = 0 if self._vectors is None else self._vectors.shape[1]
+        with open(self._path(DOCUMENTS_FILE) + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"dim": dim, "vectors_file": self._vectors_file, "ids": self._ids, "texts": self._texts,
+                       "metadatas": self._metadatas}, f)
+        os.replace(self._path(DOCUMENTS_FILE) + ".tmp", self._path(DOCUMENTS_FILE))
+        # Only now that DOCUMENTS_FILE names the compacted file is the old one unused
+        if replaced_file is not None and os.path.exists(self._path(replaced_file)):
+            os.remove(self._path(replaced_file))
+        if self._hnsw is not None:
+            self._hnsw.save_index(self._path(HNSW_FILE))
+        elif os.path.exists(self._path(HNSW_FILE)):
+            os.remove(self._path(HNSW_FILE))
+
+    def _compact(self) -> str:
+        # Write the live rows to a new vectors file, leaving the current one as it is until DOCUMENTS_FILE names
+        # the new one. Returns the name of the replaced file
+        live = [row for row, chunk_id in enumerate(self._ids) if chunk_id is not None]
+        vectors = np.array(self._vectors[live]) if live else None
+        self._ids = [self._ids[row] for row in live]
+        self._texts = [self._texts[row] for row in live]
+        self._metadatas = [self._metadatas[row] for row in live]
+        self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+        self._vectors = None
+        # Row numbers changed, so the graph is rebuilt on the next search that needs it
+        self._hnsw = None
+        replaced_file = self._vectors_file
+        self._vectors_file = VECTORS_FILE if replaced_file != VECTORS_FILE else VECTORS_FILE + ".compacted"
+        if vectors is not None:
+            self._append_vectors(vectors)
+        elif os.path.exists(self._path(self._vectors_file)):
+            os.remove(self._path(self._vectors_file))
+        return replaced_file
+
+    # Writes
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        """
+        Embed texts and add them to the store. Adding an id that already exists replaces its chunk.
+        :param texts: chunk texts
+        :param metadatas: metadata of every chunk
+        :param ids: id of every chunk, random ids if None
+        :return: the chunk ids
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        ids = list(ids) if ids is not None else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in texts]
+        self.delete([chunk_id for chunk_id in ids if chunk_id in self._rows])
+
+        vectors = _normalize(np.asarray(self._embedding_function.embed_documents(texts), dtype=np.float32))
+        first_row = len(self._ids)
+        self._append_vectors(vectors)
+        for offset, (chunk_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+            self._ids.append(chunk_id)
+            self._texts.append(text)
+            self._metadatas.append(metadata)
+            self._rows[chunk_id] = first_row + offset
+        if self._hnsw is not None:
+            self._hnsw.resize_index(max(self._hnsw.get_max_elements(), len(self._ids)))
+            self._hnsw.add_items(vectors, np.arange(first_row, len(self._ids)))
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None):
+        """
+        Remove chunks by id. Unknown ids are ignored.
+        :param ids: chunk ids, None to remove all chunks
+        """
+        for chunk_id in list(self._rows) if ids is None else ids:
+            row = self._rows.pop(chunk_id, None)
+            if row is None:
+                continue
+            self._ids[row] = None
+            if self._hnsw is not None:
+                self._hnsw.mark_deleted(row)
+
+    def count(self) -> int:
+        """
+        :return: number of chunks in the store
+        """
+        return len(self._rows)
+
+    # Search
+
+    def _use_hnsw(self) -> bool:
+        if self.index == "exact" or hnswlib is None:
+            return False
+        return self.index == "hnsw" or self.count() >= self.hnsw_threshold
+
+    def _build_hnsw(self):
+        live = np.array(sorted(self._rows.values()), dtype=np.int64)
+        self._hnsw = hnswlib.Index(space="ip", dim=self._vectors.shape[1])
+        self._hnsw.init_index(max_elements=max(len(self._ids), 1), M=self.hnsw_m,
+                              ef_construction=self.hnsw_ef_construction)
+        self._hnsw.add_items(np.asarray(self._vectors[live]), live)
+        self._hnsw.set_ef(self.hnsw_ef_search)
+
+    def _allowed(self, filter: Optional[Dict[str, Any]]) -> Optional[Callable[[int], bool]]:
+        if not filter:
+            return None
+        return lambda row: (self._ids[row] is not None
+                            and all(self._metadatas[row].get(key) == value for key, value in filter.items()))
+
+    def _search_exact(self, query: np.ndarray, k: int, allowed) -> List[Tuple[int, float]]:
+        if allowed is None and len(self._rows) == len(self._ids):
+            rows = np.arange(len(self._ids))
+        else:
+            rows = np.array([row for row in sorted(self._rows.values()) if allowed is None or allowed(row)],
+                            dtype=np.int64)
+        if len(rows) == 0:
+            return []
+        if len(rows) == self._vectors.shape[0]:
+            scores = self._vectors @ query
+        else:
+            scores = self._vectors[rows] @ query
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[index]), float(scores[index])) for index in top]
+
+    def _search_hnsw(self, query: np.ndarray, k: int, allowed) -> List[Tuple[int, float]]:
+        if self._hnsw is None:
+            self._build_hnsw()
+        k = min(k, self.count())
+        self._hnsw.set_ef(max(self.hnsw_ef_search, k))
+        labels, distances = self._hnsw.knn_query(query.reshape(1, -1), k=k, filter=allowed)
+        # hnswlib's inner product distance is 1 - similarity
+        return [(int(label), 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0])]
+
+    def similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """
+        Return the chunks most similar to an embedding, with their cosine similarity.
+        :param embedding: query embedding
+        :param k: number of chunks to return
+        :param filter: metadata values the chunks must have
+        :return: (document, similarity) pairs, most similar first
+        """
+        return [(Document(page_content=self._texts[row], metadata=self._metadatas[row]), score)
+                for row, score in self._search(embedding, k, filter)]
+
+    def _search(self, embedding: List[float], k: int, filter: Optional[Dict[str, Any]]) -> List[Tuple[int, float]]:
+        if not self._rows:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32).reshape(1, -1))[0]
+        allowed = self._allowed(filter)
+        try:
+            return self._search_hnsw(query, k, allowed) if self._use_hnsw() else self._search_exact(query, k, allowed)
+        except RuntimeError:
+            # hnswlib cannot find k neighbours when the filter leaves fewer chunks than that
+            return self._search_exact(query, k, allowed)
+
+    def similarity_search_with_vectors_by_vector(self, embedding: List[float], k: int = 4,
+                                                 filter: Optional[Dict[str, Any]] = None
+                                                 ) -> List[Tuple[Document, np.ndarray]]:
+        """
+        Return the chunks most similar to an embedding, with their stored unit-length embeddings, so callers can
+        compare the chunks with each other without embedding them again.
+        :param embedding: query embedding
+        :param k: number of chunks to return
+        :param filter: metadata values the chunks must have
+        :return: (document, embedding) pairs, most similar first
+        """
+        return [(Document(page_content=self._texts[row], metadata=self._metadatas[row]), np.array(self._vectors[row]))
+                for row, _ in self._search(embedding, k, filter)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding_function.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, filter)]
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: Optional[str] = None,
+                   **kwargs: Any) -> "MemmapVectorStore":
+        """
+        Create a store from texts, and persist it when a directory is given.
+        """
+        store = cls(persist_directory, embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        store.persist()
+        return store
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
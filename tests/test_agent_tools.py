@@ -0,0 +1,142 @@
+"""
+Tests of the parallel ReAct agent of the Using Agents and Tools sample, against a fake LLM and a fake search.
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import List, Optional
+
+import pytest
+from langchain.llms.base import LLM
+from langchain.schema import AgentAction, AgentFinish, OutputParserException
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Using Agents and Tools'))
+
+from agent_tools import (DateParserTool, ParallelActionOutputParser, ParallelReActAgent,  # noqa: E402
+                         create_agent, search_tool)
+
+PLAN = ("I need the date and the movies released then.\n"
+        "Action 1: Date Parser\n"
+        "Action Input 1: the first day of the next leap year\n"
+        "Action 2: Search\n"
+        "Action Input 2: \"Hollywood movies released next month\"")
+ANSWER = "I now know the final answer\nFinal Answer: The first movie of the year."
+LATENCY = 0.2
+
+
+class FakeLLM(LLM):
+    responses: List[str]
+    prompts: List[str] = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        self.prompts.append(prompt)
+        return self.responses[len(self.prompts) - 1]
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        await asyncio.sleep(LATENCY)
+        return self._call(prompt, stop)
+
+
+class FakeSearch:
+    """
+    Search taking LATENCY seconds, recording how many calls ran at once.
+    """
+
+    def __init__(self):
+        self.active = 0
+        self.max_active = 0
+
+    def run(self, query: str) -> str:
+        return f"Result for {query}"
+
+    async def arun(self, query: str) -> str:
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(LATENCY)
+        self.active -= 1
+        return f"Result for {query}"
+
+
+def test_parse_single_action():
+    action = ParallelActionOutputParser().parse("Thought\nAction: Search\nAction Input: \"movies\"")
+    assert action == AgentAction("Search", "movies", "Thought\nAction: Search\nAction Input: \"movies\"")
+
+
+def test_parse_numbered_actions():
+    actions = ParallelActionOutputParser().parse(PLAN)
+    assert [(action.tool, action.tool_input) for action in actions] == [
+        ("Date Parser", "the first day of the next leap year"),
+        ("Search", "Hollywood movies released next month")]
+    # The step's output is logged once, with its first action
+    assert [action.log for action in actions] == [PLAN, ""]
+
+
+def test_parse_final_answer():
+    finish = ParallelActionOutputParser().parse(ANSWER)
+    assert isinstance(finish, AgentFinish)
+    assert finish.return_values == {"output": "The first movie of the year."}
+
+
+def test_parse_invalid_output():
+    with pytest.raises(OutputParserException):
+        ParallelActionOutputParser().parse("I do not know what to do")
+
+
+def make_agent(responses: List[str]) -> ParallelReActAgent:
+    tools = [search_tool(FakeSearch())]
+    return ParallelReActAgent.from_llm_and_tools(FakeLLM(responses=responses), tools)
+
+
+def test_scratchpad_numbers_observations_of_a_step():
+    agent = make_agent([])
+    first, second = ParallelActionOutputParser().parse(PLAN)
+    single = AgentAction("Search", "movies", "\nAction: Search\nAction Input: movies")
+    scratchpad = agent._construct_scratchpad([(first, "May 18, 2028"), (second, "Movie A"),
+                                              (single, "Movie B")])
+    assert scratchpad == (PLAN + "\nObservation 1: May 18, 2028\nObservation 2: Movie A\nThought:"
+                          "\nAction: Search\nAction Input: movies\nObservation: Movie B\nThought:")
+
+
+def test_scratchpad_single_action():
+    agent = make_agent([])
+    action = AgentAction("Search", "movies", "Action: Search\nAction Input: movies")
+    assert agent._construct_scratchpad([(action, "Movie A")]) == (
+        "Action: Search\nAction Input: movies\nObservation: Movie A\nThought:")
+
+
+def test_arun_calls_independent_tools_concurrently():
+    search = FakeSearch()
+    agent_llm = FakeLLM(responses=[PLAN, ANSWER])
+    date_llm = FakeLLM(responses=["January 1, 2028"])
+    date_parser = DateParserTool(llm=date_llm)
+    date_parser.llm_chain.verbose = False
+    agent = create_agent(agent_llm, [date_parser, search_tool(search)], verbose=False)
+
+    started = time.perf_counter()
+    answer = asyncio.run(agent.arun("When is the first movie of the next leap year released?"))
+    elapsed = time.perf_counter() - started
+
+    assert answer == "The first movie of the year."
+    # Two agent steps, then the Date Parser's LLM and the search at the same time: three latencies, not four
+    assert elapsed < 3.8 * LATENCY
+    assert date_parser.stats.llm_calls == 1
+    # Both observations are numbered in the prompt of the second step
+    assert "Observation 1: January 1, 2028\nObservation 2: Result for Hollywood movies released next month\n" \
+           "Thought:" in agent_llm.prompts[1]
+
+
+def test_concurrent_agents_share_the_search():
+    search = FakeSearch()
+
+    async def run_agents():
+        agents = [create_agent(FakeLLM(responses=["Action: Search\nAction Input: movies", ANSWER]),
+                               [search_tool(search)], verbose=False) for _ in range(5)]
+        return await asyncio.gather(*(agent.arun("Which movies?") for agent in agents))
+
+    assert asyncio.run(run_agents()) == ["The first movie of the year."] * 5
+    assert search.max_active == 5
@@ -0,0 +1,130 @@
+"""
+Tests of the session store of the Conversation Bot's server: sessions are dropped in least-recently-used order when
+there are too many of them or they hold too much memory, and after being idle for longer than the TTL. The LLMs are
+fakes answering at once.
+"""
+import asyncio
+import importlib.util
+import os
+import sys
+import time
+from typing import List, Optional
+
+from langchain.llms.base import LLM
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Conversation Bot')
+sys.path.append(BOT_DIR)
+
+spec = importlib.util.spec_from_file_location("conversation_server", os.path.join(BOT_DIR, 'conversation-server.py'))
+conversation_server = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(conversation_server)
+SessionStore = conversation_server.SessionStore
+
+
+class FakeLLM(LLM):
+    response: str = "Sure, happy to help."
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        return self.response
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None) -> str:
+        return self.response
+
+
+def make_store(**kwargs) -> SessionStore:
+    return SessionStore(FakeLLM(), FakeLLM(response="A summary."), **kwargs)
+
+
+def run_turns(store: SessionStore, *session_ids: str):
+    async def turns():
+        for session_id in session_ids:
+            await store.turn(session_id, f"Hello from {session_id}")
+
+    asyncio.run(turns())
+
+
+def test_turn_answers_and_keeps_the_session():
+    store = make_store()
+    run_turns(store, "a", "a")
+
+    assert list(store.sessions) == ["a"]
+    assert len(store.sessions["a"].chain.memory.chat_memory.messages) == 4
+    assert store.turns == 2
+    assert store.total_bytes == store.sessions["a"].size > 0
+
+
+def test_least_recently_used_session_is_evicted_past_max_sessions():
+    store = make_store(max_sessions=2)
+    run_turns(store, "a", "b", "a", "c")
+
+    # "b" was used least recently, "a" was used again after it
+    assert list(store.sessions) == ["a", "c"]
+    assert store.evicted == 1
+
+
+def test_sessions_are_evicted_past_the_byte_limit():
+    store = make_store()
+    run_turns(store, "a")
+    session_bytes = store.sessions["a"].size
+    store.max_total_bytes = 2 * session_bytes
+
+    run_turns(store, "b", "c", "d")
+
+    assert list(store.sessions) == ["c", "d"]
+    assert store.total_bytes == 2 * session_bytes
+    assert store.evicted == 2
+
+
+def test_session_that_just_answered_is_kept_over_the_byte_limit():
+    store = make_store(max_total_bytes=1)
+    run_turns(store, "a", "b")
+
+    assert list(store.sessions) == ["b"]
+    assert store.total_bytes == store.sessions["b"].size
+
+
+def test_idle_sessions_are_evicted_after_the_ttl():
+    store = make_store(idle_ttl=60)
+    run_turns(store, "a", "b", "c")
+    store.sessions["a"].last_used = time.monotonic() - 120
+    store.sessions["b"].last_used = time.monotonic() - 90
+
+    assert store.evict_idle() == 2
+    assert list(store.sessions) == ["c"]
+    assert store.total_bytes == store.sessions["c"].size
+
+
+def test_session_in_the_middle_of_a_turn_is_not_evicted():
+    store = make_store(idle_ttl=60)
+    run_turns(store, "a")
+    session = store.sessions["a"]
+    session.last_used = time.monotonic() - 120
+
+    async def evict_during_turn():
+        async with session.lock:
+            return store.evict_idle()
+
+    assert asyncio.run(evict_during_turn()) == 0
+    assert list(store.sessions) == ["a"]
+
+
+def test_used_session_moves_to_the_back():
+    store = make_store()
+    run_turns(store, "a", "b", "c")
+
+    store.get("a")
+
+    assert list(store.sessions) == ["b", "c", "a"]
+
+
+def test_dropped_session_frees_its_bytes():
+    store = make_store()
+    run_turns(store, "a", "b")
+
+    assert store.drop("a") is True
+    assert store.drop("a") is False
+    assert store.total_bytes == store.sessions["b"].size
@@ -0,0 +1,81 @@
+"""
+Tests of the Date Parser's rules in the Using Agents and Tools sample: the dates that common expressions mean on a
+fixed day, and the expressions left to the LLM.
+"""
+import os
+import sys
+from datetime import date
+
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Using Agents and Tools'))
+
+from date_rules import long_date, parse_date, parse_relative_date  # noqa: E402
+
+# Sunday, October 18, 2026
+TODAY = date(2026, 10, 18)
+# (input, date it means on TODAY, or None when it is left to the LLM)
+CASES = [
+    ("today", date(2026, 10, 18)),
+    ("Today.", date(2026, 10, 18)),
+    ("What is the date today?", date(2026, 10, 18)),
+    ("tomorrow", date(2026, 10, 19)),
+    ("yesterday", date(2026, 10, 17)),
+    ("the day after tomorrow", date(2026, 10, 20)),
+    ("day before yesterday", date(2026, 10, 16)),
+    ("a month from today", date(2026, 11, 18)),
+    ('"a month from today"', date(2026, 11, 18)),
+    ("What is the date a month from today?", date(2026, 11, 18)),
+    ("in a month", date(2026, 11, 18)),
+    ("1 month from now in long date format", date(2026, 11, 18)),
+    ("in 3 days", date(2026, 10, 21)),
+    ("in ten days", date(2026, 10, 28)),
+    ("a couple of days from now", date(2026, 10, 20)),
+    ("in 2 weeks", date(2026, 11, 1)),
+    ("in a fortnight", date(2026, 11, 1)),
+    ("after 6 months", date(2027, 4, 18)),
+    ("a year from today", date(2027, 10, 18)),
+    ("3 weeks ago", date(2026, 9, 27)),
+    ("2 years ago", date(2024, 10, 18)),
+    ("next week", date(2026, 10, 25)),
+    ("last month", date(2026, 9, 18)),
+    ("next year", date(2027, 10, 18)),
+    ("next Friday", date(2026, 10, 23)),
+    ("this friday", date(2026, 10, 23)),
+    ("Friday", date(2026, 10, 23)),
+    ("next Sunday", date(2026, 10, 25)),
+    ("Sunday", date(2026, 10, 18)),
+    ("last Sunday", date(2026, 10, 11)),
+    ("last Monday", date(2026, 10, 12)),
+    ("May 18, 2023", date(2023, 5, 18)),
+    ("Dec 25", date(2026, 12, 25)),
+    ("the 4th of July", date(2026, 7, 4)),
+    ("2027-01-31", date(2027, 1, 31)),
+    ("February 30", None),
+    ("the release date of the next Marvel movie", None),
+    ("when Charlie's warranty expires", None),
+    ("two business days after Easter", None),
+]
+# Month arithmetic keeps the day of the month or takes the last day of a shorter month
+MONTH_END_CASES = [
+    (date(2026, 1, 31), "a month from today", date(2026, 2, 28)),
+    (date(2024, 1, 31), "in 1 month", date(2024, 2, 29)),
+    (date(2026, 3, 31), "a month ago", date(2026, 2, 28)),
+    (date(2026, 12, 15), "next month", date(2027, 1, 15)),
+    (date(2024, 2, 29), "a year from today", date(2025, 2, 28)),
+]
+
+
+@pytest.mark.parametrize("text, expected", CASES)
+def test_parse_relative_date(text, expected):
+    assert parse_relative_date(text, TODAY) == expected
+
+
+@pytest.mark.parametrize("today, text, expected", MONTH_END_CASES)
+def test_month_end(today, text, expected):
+    assert parse_relative_date(text, today) == expected
+
+
+@pytest.mark.parametrize("expected", [expected for _, expected in CASES if expected is not None])
+def test_long_date_reads_back(expected):
+    assert parse_date(long_date(expected)) == expected
@@ -0,0 +1,122 @@
+"""
+Tests of the embedding cache shared by the samples (common/embeddings.py): texts are embedded once, in bounded
+batches, and served from the SQLite cache afterwards. HashEmbeddings stands in for the OpenAI API.
+"""
+from typing import List
+
+import pytest
+
+from common.embeddings import CachedEmbeddings, HashEmbeddings
+
+
+class RecordingEmbeddings(HashEmbeddings):
+    """
+    HashEmbeddings remembering the texts of every batch it was sent.
+    """
+    batches: List[List[str]] = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(list(texts))
+        return super().embed_documents(texts)
+
+
+def cached(embeddings, path=":memory:", **kwargs) -> CachedEmbeddings:
+    return CachedEmbeddings.from_path(embeddings, path, **kwargs)
+
+
+def test_repeated_texts_are_embedded_once():
+    inner = RecordingEmbeddings()
+    embeddings = cached(inner)
+    texts = ["alpha", "beta", "alpha", "gamma", "beta", "alpha"]
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert inner.batches == [["alpha", "beta", "gamma"]]
+    assert vectors == [inner._embed(text) for text in texts]
+    assert (embeddings.stats.texts, embeddings.stats.unique_texts) == (6, 3)
+    assert (embeddings.stats.hits, embeddings.stats.misses) == (0, 3)
+
+
+def test_texts_seen_before_come_from_the_cache():
+    inner = RecordingEmbeddings()
+    embeddings = cached(inner)
+    embeddings.embed_documents(["alpha", "beta"])
+
+    vectors = embeddings.embed_documents(["beta", "delta", "alpha"])
+
+    # Only the new text is sent; the cached vectors are stored as float32
+    assert inner.batches == [["alpha", "beta"], ["delta"]]
+    for text, vector in zip(["beta", "delta", "alpha"], vectors):
+        assert vector == pytest.approx(inner._embed(text), abs=1e-6)
+    assert (embeddings.stats.hits, embeddings.stats.misses) == (2, 3)
+    assert embeddings.stats.hit_rate == pytest.approx(2 / 5)
+
+
+def test_cache_persists_across_instances(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    cached(RecordingEmbeddings(), path).embed_documents(["alpha", "beta"])
+
+    inner = RecordingEmbeddings()
+    embeddings = cached(inner, path)
+    embeddings.embed_documents(["alpha", "beta"])
+
+    assert inner.batches == []
+    assert embeddings.stats.hits == 2
+
+
+def test_misses_are_sent_in_batches_of_batch_size():
+    inner = RecordingEmbeddings()
+    embeddings = cached(inner, batch_size=3, max_concurrency=1)
+    texts = [f"text {index}" for index in range(10)]
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert [len(batch) for batch in inner.batches] == [3, 3, 3, 1]
+    assert [text for batch in inner.batches for text in batch] == texts
+    assert vectors == [inner._embed(text) for text in texts]
+    assert embeddings.stats.batches == 4
+
+
+def test_batches_are_bounded_by_estimated_tokens():
+    inner = RecordingEmbeddings()
+    # 40 characters are estimated at 10 tokens, so two texts fit in 25 tokens
+    embeddings = cached(inner, batch_tokens=25, max_concurrency=1)
+    texts = [f"{index:02d}" + "x" * 38 for index in range(5)]
+
+    embeddings.embed_documents(texts)
+
+    assert [len(batch) for batch in inner.batches] == [2, 2, 1]
+
+
+def test_concurrent_batches_keep_the_order_of_the_texts():
+    inner = HashEmbeddings(latency=0.01)
+    embeddings = cached(inner, batch_size=2, max_concurrency=4)
+    texts = [f"text {index}" for index in range(9)] + ["text 0", "text 8"]
+
+    vectors = embeddings.embed_documents(texts)
+
+    assert vectors == [inner._embed(text) for text in texts]
+    assert inner.calls == 5
+
+
+def test_queries_and_documents_are_cached_apart():
+    inner = RecordingEmbeddings()
+    embeddings = cached(inner)
+    embeddings.embed_documents(["alpha"])
+
+    embeddings.embed_query("alpha")
+    embeddings.embed_query("alpha")
+
+    assert inner.batches == [["alpha"], ["alpha"]]
+    assert (embeddings.stats.hits, embeddings.stats.misses) == (1, 2)
+
+
+def test_another_model_does_not_share_entries(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    cached(RecordingEmbeddings(size=64), path).embed_documents(["alpha"])
+
+    inner = RecordingEmbeddings(size=32)
+    vector = cached(inner, path).embed_documents(["alpha"])[0]
+
+    assert inner.batches == [["alpha"]]
+    assert len(vector) == 32
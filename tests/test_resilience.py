@@ -0,0 +1,201 @@
+"""
+Tests of the resilient requests shared by the samples (common/resilience.py): the circuit breaker's states, and the
+retries and deadline of ResilientClient, against fake requests raising the errors of the OpenAI API.
+"""
+import asyncio
+import time
+
+import pytest
+
+from common.http_client import APIError
+from common.resilience import CircuitBreaker, CircuitOpenError, DeadlineExceeded, ResilientClient
+
+RESET = 0.05
+
+
+def server_error():
+    return APIError(500, "The server had an error")
+
+
+class FakeRequest:
+    """
+    Request failing with the given errors in turn, then answering "ok". `delay` is the time every attempt takes.
+    """
+
+    def __init__(self, *errors: Exception, delay: float = 0.0):
+        self.errors = list(errors)
+        self.delay = delay
+        self.attempts = 0
+
+    def __call__(self, timeout=None):
+        self.attempts += 1
+        time.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+    async def acall(self):
+        self.attempts += 1
+        await asyncio.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_breaker_opens_after_failures_in_a_row():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=RESET)
+    for _ in range(2):
+        assert breaker.before_call("/completions") is False
+        breaker.record(server_error())
+    assert breaker.state == "closed"
+
+    breaker.record(server_error())
+
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.before_call("/completions")
+    assert 0 < error.value.retry_after <= RESET
+
+
+def test_success_resets_the_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=RESET)
+    breaker.record(server_error())
+    breaker.record(None)
+    breaker.record(server_error())
+    assert breaker.state == "closed"
+
+
+def test_rate_limits_and_client_errors_do_not_open_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=RESET)
+    breaker.record(APIError(429, "Rate limit reached", retry_after=1.0))
+    breaker.record(APIError(400, "Bad request"))
+    assert breaker.state == "closed"
+
+
+def test_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=RESET)
+    breaker.record(server_error())
+    time.sleep(RESET)
+    assert breaker.state == "half-open"
+
+    assert breaker.before_call("/completions") is True
+    # Only one trial at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call("/completions")
+
+    breaker.record(None)
+    assert breaker.state == "closed"
+    assert breaker.before_call("/completions") is False
+
+
+def test_failed_trial_opens_the_breaker_again():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=RESET)
+    for _ in range(3):
+        breaker.record(server_error())
+    time.sleep(RESET)
+    assert breaker.before_call("/completions") is True
+
+    breaker.record(server_error())
+
+    assert breaker.state == "open"
+
+
+def test_released_trial_lets_the_next_request_be_the_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=RESET)
+    breaker.record(server_error())
+    time.sleep(RESET)
+    assert breaker.before_call("/completions") is True
+
+    breaker.release()
+
+    assert breaker.state == "half-open"
+    assert breaker.before_call("/completions") is True
+
+
+def test_call_retries_transient_errors():
+    client = ResilientClient(max_retries=3, base_delay=0.01)
+    request = FakeRequest(server_error(), APIError(429, "Rate limit reached", retry_after=0.01))
+
+    assert asyncio.run(client.call("/completions", request.acall)) == "ok"
+    assert request.attempts == 3
+    assert (client.stats.calls, client.stats.retries, client.stats.failed) == (1, 2, 0)
+    assert client.breaker("/completions").state == "closed"
+
+
+def test_call_does_not_retry_client_errors():
+    client = ResilientClient(max_retries=3, base_delay=0.01)
+    request = FakeRequest(APIError(400, "Bad request"))
+
+    with pytest.raises(APIError):
+        asyncio.run(client.call("/completions", request.acall))
+    assert request.attempts == 1
+    assert client.stats.failed == 1
+
+
+def test_call_gives_up_after_max_retries():
+    client = ResilientClient(max_retries=2, base_delay=0.01, failure_threshold=10)
+    request = FakeRequest(*(server_error() for _ in range(5)))
+
+    with pytest.raises(APIError):
+        asyncio.run(client.call("/completions", request.acall))
+    assert request.attempts == 3
+    assert (client.stats.retries, client.stats.failed) == (2, 1)
+
+
+def test_open_breaker_rejects_calls_at_once():
+    client = ResilientClient(max_retries=5, base_delay=0.01, failure_threshold=2, reset_timeout=10.0)
+    request = FakeRequest(*(server_error() for _ in range(5)))
+
+    # The failure that opens the breaker is not retried
+    with pytest.raises(APIError):
+        asyncio.run(client.call("/completions", request.acall))
+    assert request.attempts == 2
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(client.call("/completions", request.acall))
+    assert request.attempts == 2
+    assert client.stats.rejected == 1
+    # Other endpoints have breakers of their own
+    assert asyncio.run(client.call("/embeddings", FakeRequest().acall)) == "ok"
+
+
+def test_deadline_bounds_a_slow_attempt():
+    client = ResilientClient(max_retries=3, base_delay=0.01, deadline=0.1)
+    request = FakeRequest(delay=1.0)
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded) as error:
+        asyncio.run(client.call("/completions", request.acall))
+
+    assert time.monotonic() - started < 0.5
+    assert isinstance(error.value.__cause__, asyncio.TimeoutError)
+    assert client.stats.past_deadline == 1
+
+
+def test_retry_past_the_deadline_is_not_attempted():
+    client = ResilientClient(max_retries=3, deadline=0.2)
+    request = FakeRequest(APIError(429, "Rate limit reached", retry_after=1.0))
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded) as error:
+        asyncio.run(client.call("/completions", request.acall))
+
+    # The Retry-After delay would end after the deadline, so the call fails without waiting for it
+    assert time.monotonic() - started < 0.1
+    assert isinstance(error.value.__cause__, APIError)
+    assert request.attempts == 1
+
+
+def test_call_sync_retries_and_passes_the_time_left():
+    client = ResilientClient(max_retries=3, base_delay=0.01, deadline=5.0)
+    request = FakeRequest(server_error())
+    timeouts = []
+
+    def attempt(timeout):
+        timeouts.append(timeout)
+        return request(timeout)
+
+    assert client.call_sync("/completions", attempt) == "ok"
+    assert request.attempts == 2
+    assert all(0 < timeout <= 5.0 for timeout in timeouts)
+    assert timeouts[1] < timeouts[0]
@@ -0,0 +1,94 @@
+"""
+Tests of the server-sent-events parser of the streamed completions (common/streaming.py): the events come out the
+same however the response body is split into chunks.
+"""
+import asyncio
+import json
+from typing import List
+
+import pytest
+
+from common.streaming import parse_sse
+
+
+def events_of(*chunks: bytes) -> List[str]:
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    async def collect():
+        return [data async for data in parse_sse(body())]
+
+    return asyncio.run(collect())
+
+
+def completion_stream(*texts: str) -> bytes:
+    events = [f"data: {json.dumps({'choices': [{'text': text, 'index': 0}]})}\n\n" for text in texts]
+    return "".join(events + ["data: [DONE]\n\n"]).encode("utf-8")
+
+
+def split_every(body: bytes, size: int) -> List[bytes]:
+    return [body[start:start + size] for start in range(0, len(body), size)]
+
+
+def test_whole_events():
+    assert events_of(b"data: first\n\ndata: second\n\n") == ["first", "second"]
+
+
+def test_event_split_mid_line():
+    assert events_of(b"data: hel", b"lo\n\n") == ["hello"]
+
+
+def test_event_split_between_its_lines():
+    assert events_of(b"data: hello\n", b"\n", b"data: world\n\n") == ["hello", "world"]
+
+
+def test_event_split_after_the_field_name():
+    assert events_of(b"dat", b"a:", b" hello\n\n") == ["hello"]
+
+
+def test_chunk_ending_mid_event_holds_it_back():
+    async def body():
+        yield b"data: first\n\ndata: sec"
+        # The first event must be out before the rest of the body arrives
+        assert received == ["first"]
+        yield b"ond\n\n"
+
+    received = []
+
+    async def collect():
+        async for data in parse_sse(body()):
+            received.append(data)
+
+    asyncio.run(collect())
+    assert received == ["first", "second"]
+
+
+def test_crlf_split_between_cr_and_lf():
+    assert events_of(b"data: hello\r", b"\n\r", b"\n") == ["hello"]
+
+
+def test_multibyte_character_split_across_chunks():
+    body = "data: café ☕\n\n".encode("utf-8")
+    cut = body.index("☕".encode("utf-8")) + 1
+    assert events_of(body[:cut], body[cut:]) == ["café ☕"]
+
+
+def test_multi_line_data_comments_and_other_fields():
+    body = b": keep-alive\nevent: completion\nid: 7\ndata: line one\ndata:line two\n\n"
+    assert events_of(body) == ["line one\nline two"]
+
+
+def test_last_event_without_blank_line():
+    assert events_of(b"data: first\n\ndata: last\n") == ["first", "last"]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64])
+def test_completion_stream_in_chunks_of_any_size(size):
+    body = completion_stream("Hello", ",", " wor", "ld", "\n\ndata: not an event")
+
+    events = events_of(*split_every(body, size))
+
+    assert events[-1] == "[DONE]"
+    assert [json.loads(data)["choices"][0]["text"] for data in events[:-1]] == [
+        "Hello", ",", " wor", "ld", "\n\ndata: not an event"]